@@ -1,37 +1,219 @@
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, render_template as flask_render_template, request, redirect, url_for, jsonify, g, send_file
 import os
-import pandas as pd
+import time
 import json
+from catalogos import RegistroCatalogos, CATALOGOS, ESQUEMAS
+from catalogos_sqlite import CatalogosSQLite
+from corridas import AlmacenCorridas, FILAS_POR_PAGINA, ORDEN_LISTA, combinar
+from facetas import CASCADAS, CASCADA_VARILLAS, CASCADA_TUBING
+import flujos
+import exportar as exportacion
+import metricas
+from flujos import indice_facetas, motor_filtros, filtros_flujo_a, filtros_flujo_e
 
 app = Flask(__name__)
 
-# Directorio de archivos Excel
-BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "materiales")
-
-# Variable global para almacenar resultados de cada flujo
-materiales_finales = []
-
-# Función auxiliar para renombrar columnas
-def renombrar_columnas(df):
-    df_renombrado = df.rename(
-        columns={
-            "1. Cód.SAP": "Cód.SAP",
-            "2. MATERIAL": "MATERIAL",
-            "3. Descripción": "Descripción",
-            "5.CONDICIÓN": "CONDICIÓN"
-        }
-    )
-    columnas = ["Cód.SAP", "MATERIAL", "Descripción", "4.CANTIDAD", "CONDICIÓN"]
-    columnas_presentes = [col for col in columnas if col in df_renombrado.columns]
-    return df_renombrado[columnas_presentes]
+# Directorio de archivos Excel (MATERIALES_DIR permite apuntar a otro, p. ej. los catálogos de benchmark.py)
+BASE_DIR = os.environ.get("MATERIALES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "materiales"))
+
+# Registro de catálogos: cada Excel se parsea una vez por proceso. Con CATALOGOS_DB los catálogos
+# se importan a ese SQLite y se consultan con SQL en lugar de tenerlos en memoria (catalogos_sqlite.py)
+if os.environ.get("CATALOGOS_DB"):
+    catalogos = CatalogosSQLite(BASE_DIR, os.environ["CATALOGOS_DB"])
+else:
+    catalogos = RegistroCatalogos(BASE_DIR)
+# Posiciones de filtros ya resueltos (LRU en memoria de cada worker)
+flujos.cache_filtros.max_bytes = int(os.environ.get("FILTROS_CACHE_MB", "64")) * 1024 * 1024
+# Al arrancar se cargan los catálogos compilados (python catalogos.py); los Excel con el compilado
+# vencido se parsean a la vez en CATALOGOS_PROCESOS procesos (por defecto uno por CPU)
+_inicio_catalogos = time.perf_counter()
+_procesos_catalogos = int(os.environ.get("CATALOGOS_PROCESOS", "0")) or None
+for _archivo, _error in catalogos.precargar(procesos=_procesos_catalogos).items():
+    app.logger.warning("No se pudo cargar %s: %s", _archivo, _error)
+_segundos_catalogos = time.perf_counter() - _inicio_catalogos
+for _archivo, _tiempo in catalogos.tiempos_carga.items():
+    app.logger.info("Catálogo %s: %.3f s (%s)", _archivo, _tiempo["segundos"], _tiempo["origen"])
+# Índices armados al importar: con gunicorn en modo preload (gunicorn.conf.py) se arman una
+# vez en el master y los workers los heredan del fork en lugar de recalcularlos
+_inicio_arranque = time.perf_counter()
+try:
+    flujos.precalentar(catalogos)
+    _error_precalentar = None
+except Exception as e:
+    _error_precalentar = str(e)
+    app.logger.warning("No se pudieron armar los índices de los catálogos: %s", e)
+ARRANQUE = {
+    "pid": os.getpid(),
+    "segundos": round(time.perf_counter() - _inicio_arranque, 4),
+    "segundos_catalogos": round(_segundos_catalogos, 4),
+    "error": _error_precalentar,
+}
+# Un hilo revisa materiales/ cada CATALOGOS_INTERVALO segundos y recarga los Excel que cambian
+# (0 lo desactiva: entonces cada acceso compara el mtime del Excel, como antes)
+_intervalo_catalogos = float(os.environ.get("CATALOGOS_INTERVALO", "5"))
+if _intervalo_catalogos > 0:
+    catalogos.vigilar(_intervalo_catalogos)
+
+# Resultados de cada corrida, en un SQLite compartido por todos los workers
+os.makedirs(app.instance_path, exist_ok=True)
+corridas = AlmacenCorridas(os.environ.get("CORRIDAS_DB", os.path.join(app.instance_path, "corridas.sqlite")))
+# Exportaciones ya generadas, por digest de contenido (LRU acotado en disco)
+cache_exportaciones = exportacion.CacheExportaciones(
+    os.environ.get("EXPORTACIONES_DIR", os.path.join(app.instance_path, "exportaciones")),
+    int(os.environ.get("EXPORTACIONES_CACHE_MB", "256")) * 1024 * 1024,
+)
+# Exportaciones en segundo plano: hilos por worker y tope de trabajos pendientes
+cola_exportaciones = exportacion.ColaExportaciones(
+    cache_exportaciones,
+    int(os.environ.get("EXPORTACIONES_HILOS", "2")),
+    int(os.environ.get("EXPORTACIONES_PENDIENTES", "16")),
+)
+
+
+# ===================================
+# Métricas (GET /metrics)
+# ===================================
+# Duración de cada petición por ruta; las etapas internas se miden con metricas.etapa()
+@app.before_request
+def iniciar_medicion():
+    g.inicio_peticion = time.perf_counter()
+    g.token_metricas = metricas.fijar_ruta(request.endpoint)
+
+
+@app.after_request
+def registrar_medicion(response):
+    inicio = g.get("inicio_peticion")
+    if inicio is not None:
+        metricas.PETICIONES.observar(time.perf_counter() - inicio, request.endpoint or "-",
+                                     request.method, str(response.status_code))
+    return response
+
+
+@app.teardown_request
+def liberar_medicion(error=None):
+    if error is not None:
+        metricas.ERRORES.sumar(request.endpoint or "-")
+    token = g.pop("token_metricas", None)
+    if token is not None:
+        metricas.liberar_ruta(token)
+
+
+def render_template(plantilla, **contexto):
+    with metricas.etapa("render"):
+        return flask_render_template(plantilla, **contexto)
+
+
+# ===================================
+# Instantánea de catálogos de la petición
+# ===================================
+# Cada petición usa la misma versión de los catálogos de principio a fin, aunque el
+# vigilante publique otra mientras tanto.
+@app.before_request
+def fijar_catalogos():
+    g.token_catalogos = catalogos.fijar()
+
+
+@app.teardown_request
+def liberar_catalogos(error=None):
+    token = g.pop("token_catalogos", None)
+    if token is not None:
+        catalogos.liberar(token)
+
+
+# ===================================
+# Corrida actual (cookie "corrida")
+# ===================================
+@app.before_request
+def cargar_corrida():
+    g.corrida = request.cookies.get("corrida")
+    g.corrida_nueva = False
+
+
+@app.after_request
+def guardar_corrida(response):
+    if g.get("corrida_nueva"):
+        response.set_cookie("corrida", g.corrida, httponly=True, samesite="Lax")
+    return response
+
+
+def iniciar_corrida():
+    g.corrida = corridas.nueva()
+    g.corrida_nueva = True
+    return g.corrida
+
+
+def corrida_actual():
+    # Si el usuario entró sin pasar por el inicio, se le crea una corrida
+    if not g.get("corrida"):
+        return iniciar_corrida()
+    return g.corrida
+
+
+def registrar_resultado(flujo, df):
+    # La lista de materiales consolidada no se rearma en cada paso: la arma flujo_final o la
+    # exportación a Excel cuando la necesitan (corridas.asegurar_lista)
+    with metricas.etapa("registro"):
+        corridas.agregar(corrida_actual(), flujo, df)
+    metricas.RESULTADOS.sumar(flujo)
+    metricas.FILAS.sumar(flujo, cantidad=len(df))
+
+
+# ===================================
+# Estado del asistente entre pasos (?estado=<token>)
+# ===================================
+# Cada paso guarda lo que eligió en la corrida (corridas.guardar_paso) y redirige al siguiente
+# con un token corto; el siguiente paso lee el estado acumulado con estado_paso().
+# Los enlaces viejos, con diametros=...&filtros=<JSON> en la URL, se siguen aceptando.
+
+class PasoInvalido(Exception):
+    pass
+
+
+@app.errorhandler(PasoInvalido)
+def paso_invalido(error):
+    return "El paso del asistente ya no es válido. Vuelva a empezar desde el inicio.", 400
+
+
+def _estado_de_la_url():
+    estado = {}
+    for clave in ("diametros", "valores", "materiales"):
+        if request.args.get(clave):
+            estado[clave] = request.args[clave].split(",")
+    for clave in ("filtros", "tipos"):
+        if clave in request.args:
+            estado[clave] = json.loads(request.args[clave])
+    for clave in ("diacsg", "col"):
+        if clave in request.args:
+            estado[clave] = request.args[clave]
+    return estado
+
+
+def estado_paso():
+    token = request.args.get("estado")
+    if token is None:
+        return _estado_de_la_url()
+    estado = corridas.estado(corrida_actual(), token)
+    if estado is None:
+        raise PasoInvalido(token)
+    return estado
+
+
+def avanzar(endpoint, **delta):
+    # Guarda lo elegido en este paso y redirige al siguiente con el token nuevo
+    padre = request.args.get("estado")
+    if padre is None:
+        delta = combinar(_estado_de_la_url(), delta)
+    token = corridas.guardar_paso(corrida_actual(), padre, delta)
+    return redirect(url_for(endpoint, estado=token))
+
+
 
 # ===================================
 # Página de Inicio
 # ===================================
 @app.route("/")
 def index():
-    global materiales_finales
-    materiales_finales = []  # Reinicia la lista para cada nueva corrida
+    iniciar_corrida()  # Cada visita al inicio empieza una corrida nueva
     return render_template("index.html")
 
 
@@ -59,42 +241,60 @@ def flujo_a_decidir():
 @app.route("/flujo_a/seleccion", methods=["GET", "POST"])
 def flujo_a_seleccion():
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
-        unique_diametros = sorted([x for x in df["DIÁMETRO"].dropna().unique() if x.upper() != "TODOS"])
+        valores = motor_filtros(catalogos, "ajuste de medida.xlsx").valores("DIÁMETRO")
+        unique_diametros = sorted([x for x in valores if x.upper() != "TODOS"])
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     if request.method == "POST":
         selected = request.form.getlist("diametros")
         if not selected:
             return "Seleccione al menos un DIÁMETRO.", 400
-        diametros_str = ",".join(selected)
-        # Redirige al siguiente paso: Selección de TIPO
-        return redirect(url_for("flujo_a_seleccion_tipo", diametros=diametros_str))
+        # Redirige a la selección en cascada (TIPO → GRADO DE ACERO → ... en una sola página)
+        return avanzar("flujo_a_cascada", diametros=selected)
     else:
         return render_template("flujo_a_seleccion.html", unique_diametros=unique_diametros)
 
 
+# Pasos 2 a 5 en una sola página: los selects dependientes se completan con la API de facetas
+@app.route("/flujo_a/cascada", methods=["GET", "POST"])
+def flujo_a_cascada():
+    estado = estado_paso()
+    selected_diametros = estado.get("diametros", [])
+    if request.method == "POST":
+        filtros = {}
+        for diam in selected_diametros:
+            filtros[diam] = {
+                "tipo": request.form.get(f"tipo_{diam}", "TODOS"),
+                "acero": request.form.get(f"acero_{diam}", "Seleccionar"),
+                "acero_cup": request.form.get(f"acero_cup_{diam}", "Seleccionar"),
+                "tipo_cup": request.form.get(f"tipo_cup_{diam}", "Seleccionar"),
+            }
+        return avanzar("flujo_a_resumen", filtros=filtros)
+    try:
+        indice = indice_facetas(catalogos, "ajuste de medida.xlsx", CASCADA_VARILLAS)
+    except Exception as e:
+        return f"Error al cargar el Excel: {e}"
+    # Las opciones de TIPO se envían con la página; el resto las pide el navegador
+    tipos_dict = {}
+    for diam in selected_diametros:
+        tipos_dict[diam] = indice.opciones("TIPO", filtros_flujo_a(diam, {}, "TIPO")) or ["TODOS"]
+    return render_template("flujo_a_cascada.html", diametros=selected_diametros, tipos=tipos_dict)
+
+
 # Paso 2: Selección de TIPO
 @app.route("/flujo_a/seleccion_tipo", methods=["GET", "POST"])
 def flujo_a_seleccion_tipo():
-    diametros_str = request.args.get("diametros", "")
-    selected_diametros = diametros_str.split(",") if diametros_str else []
+    estado = estado_paso()
+    selected_diametros = estado.get("diametros", [])
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        indice = indice_facetas(catalogos, "ajuste de medida.xlsx", CASCADA_VARILLAS)
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
     # Para cada DIÁMETRO, obtener los TIPOS disponibles (se consideran filas que tengan el valor de DIÁMETRO o "TODOS")
     tipos_dict = {}
     for diam in selected_diametros:
-        subset = df[df["DIÁMETRO"].isin([diam, "TODOS"])]
-        tipos = sorted([x for x in subset["TIPO"].dropna().unique() if x.upper() != "TODOS"])
+        tipos = indice.opciones("TIPO", filtros_flujo_a(diam, {}, "TIPO"))
         if not tipos:
             tipos = ["TODOS"]
         tipos_dict[diam] = tipos
@@ -106,7 +306,7 @@ def flujo_a_seleccion_tipo():
             tipo_sel = request.form.get(f"tipo_{diam}", "TODOS")
             filtros[diam] = {"tipo": tipo_sel}
         # Redirige al siguiente paso: Selección de GRADO DE ACERO
-        return redirect(url_for("flujo_a_seleccion_acero", diametros=diametros_str, filtros=json.dumps(filtros)))
+        return avanzar("flujo_a_seleccion_acero", filtros=filtros)
     else:
         return render_template("flujo_a_seleccion_tipo.html", diametros=selected_diametros, tipos=tipos_dict)
 
@@ -114,40 +314,29 @@ def flujo_a_seleccion_tipo():
 # Paso 3: Selección de GRADO DE ACERO
 @app.route("/flujo_a/seleccion_acero", methods=["GET", "POST"])
 def flujo_a_seleccion_acero():
-    diametros_str = request.args.get("diametros", "")
-    filtros_str = request.args.get("filtros", "{}")
-    selected_diametros = diametros_str.split(",") if diametros_str else []
-    filtros = json.loads(filtros_str)
+    estado = estado_paso()
+    selected_diametros = estado.get("diametros", [])
+    filtros = estado.get("filtros", {})
     
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        indice = indice_facetas(catalogos, "ajuste de medida.xlsx", CASCADA_VARILLAS)
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
     # Para cada DIÁMETRO, filtrar por DIÁMETRO y TIPO ya seleccionado, y obtener las opciones de GRADO DE ACERO
     acero_dict = {}
     for diam in selected_diametros:
-        tipo_sel = filtros.get(diam, {}).get("tipo", "TODOS")
-        subset = df[df["DIÁMETRO"].isin([diam, "TODOS"])]
-        if tipo_sel != "TODOS":
-            subset = subset[subset["TIPO"].isin([tipo_sel, "TODOS"])]
-        opciones_acero = sorted([x for x in subset["GRADO DE ACERO"].dropna().unique() if str(x).upper() != "TODOS"]) if "GRADO DE ACERO" in subset.columns else ["Seleccionar"]
+        seleccion = filtros.get(diam, {})
+        opciones_acero = indice.opciones("GRADO DE ACERO", filtros_flujo_a(diam, seleccion, "GRADO DE ACERO")) if indice.tiene("GRADO DE ACERO") else ["Seleccionar"]
         if not opciones_acero:
             opciones_acero = ["TODOS"]
         acero_dict[diam] = opciones_acero
 
     if request.method == "POST":
-        for diam in selected_diametros:
-            ac = request.form.get(f"acero_{diam}", "Seleccionar")
-            if diam in filtros:
-                filtros[diam]["acero"] = ac
-            else:
-                filtros[diam] = {"acero": ac}
+        # Solo se guarda lo elegido en este paso; se combina con el TIPO ya guardado
+        aceros = {diam: {"acero": request.form.get(f"acero_{diam}", "Seleccionar")} for diam in selected_diametros}
         # Redirige al siguiente paso: Selección de GRADO DE ACERO CUPLA
-        return redirect(url_for("flujo_a_seleccion_acero_cup", diametros=diametros_str, filtros=json.dumps(filtros)))
+        return avanzar("flujo_a_seleccion_acero_cup", filtros=aceros)
     else:
         return render_template("flujo_a_seleccion_acero.html", diametros=selected_diametros, acero=acero_dict)
 
@@ -155,43 +344,28 @@ def flujo_a_seleccion_acero():
 # Paso 4: Selección de GRADO DE ACERO CUPLA
 @app.route("/flujo_a/seleccion_acero_cup", methods=["GET", "POST"])
 def flujo_a_seleccion_acero_cup():
-    diametros_str = request.args.get("diametros", "")
-    filtros_str = request.args.get("filtros", "{}")
-    selected_diametros = diametros_str.split(",") if diametros_str else []
-    filtros = json.loads(filtros_str)
+    estado = estado_paso()
+    selected_diametros = estado.get("diametros", [])
+    filtros = estado.get("filtros", {})
     
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        indice = indice_facetas(catalogos, "ajuste de medida.xlsx", CASCADA_VARILLAS)
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
     # Para cada DIÁMETRO, filtrar por DIÁMETRO, TIPO y GRADO DE ACERO para obtener opciones de GRADO DE ACERO CUPLA
     acero_cup_dict = {}
     for diam in selected_diametros:
-        tipo_sel = filtros.get(diam, {}).get("tipo", "TODOS")
-        ac_sel = filtros.get(diam, {}).get("acero", "Seleccionar")
-        subset = df[df["DIÁMETRO"].isin([diam, "TODOS"])]
-        if tipo_sel != "TODOS":
-            subset = subset[subset["TIPO"].isin([tipo_sel, "TODOS"])]
-        if ac_sel != "Seleccionar":
-            subset = subset[subset["GRADO DE ACERO"].isin([ac_sel, "TODOS"])]
-        opciones_acero_cup = sorted([x for x in subset["GRADO DE ACERO CUPLA"].dropna().unique() if str(x).upper() != "TODOS"]) if "GRADO DE ACERO CUPLA" in subset.columns else ["Seleccionar"]
+        seleccion = filtros.get(diam, {})
+        opciones_acero_cup = indice.opciones("GRADO DE ACERO CUPLA", filtros_flujo_a(diam, seleccion, "GRADO DE ACERO CUPLA")) if indice.tiene("GRADO DE ACERO CUPLA") else ["Seleccionar"]
         if not opciones_acero_cup:
             opciones_acero_cup = ["TODOS"]
         acero_cup_dict[diam] = opciones_acero_cup
 
     if request.method == "POST":
-        for diam in selected_diametros:
-            ac_cup = request.form.get(f"acero_cup_{diam}", "Seleccionar")
-            if diam in filtros:
-                filtros[diam]["acero_cup"] = ac_cup
-            else:
-                filtros[diam] = {"acero_cup": ac_cup}
+        aceros_cup = {diam: {"acero_cup": request.form.get(f"acero_cup_{diam}", "Seleccionar")} for diam in selected_diametros}
         # Redirige al siguiente paso: Selección de TIPO DE CUPLA
-        return redirect(url_for("flujo_a_seleccion_tipo_cup", diametros=diametros_str, filtros=json.dumps(filtros)))
+        return avanzar("flujo_a_seleccion_tipo_cup", filtros=aceros_cup)
     else:
         return render_template("flujo_a_seleccion_acero_cup.html", diametros=selected_diametros, acero_cup=acero_cup_dict)
 
@@ -199,46 +373,28 @@ def flujo_a_seleccion_acero_cup():
 # Paso 5: Selección de TIPO DE CUPLA
 @app.route("/flujo_a/seleccion_tipo_cup", methods=["GET", "POST"])
 def flujo_a_seleccion_tipo_cup():
-    diametros_str = request.args.get("diametros", "")
-    filtros_str = request.args.get("filtros", "{}")
-    selected_diametros = diametros_str.split(",") if diametros_str else []
-    filtros = json.loads(filtros_str)
+    estado = estado_paso()
+    selected_diametros = estado.get("diametros", [])
+    filtros = estado.get("filtros", {})
     
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        indice = indice_facetas(catalogos, "ajuste de medida.xlsx", CASCADA_VARILLAS)
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
     # Para cada DIÁMETRO, filtrar según DIÁMETRO, TIPO, GRADO DE ACERO y GRADO DE ACERO CUPLA para obtener opciones de TIPO DE CUPLA
     tipo_cup_dict = {}
     for diam in selected_diametros:
-        tipo_sel = filtros.get(diam, {}).get("tipo", "TODOS")
-        ac_sel = filtros.get(diam, {}).get("acero", "Seleccionar")
-        ac_cup_sel = filtros.get(diam, {}).get("acero_cup", "Seleccionar")
-        subset = df[df["DIÁMETRO"].isin([diam, "TODOS"])]
-        if tipo_sel != "TODOS":
-            subset = subset[subset["TIPO"].isin([tipo_sel, "TODOS"])]
-        if ac_sel != "Seleccionar":
-            subset = subset[subset["GRADO DE ACERO"].isin([ac_sel, "TODOS"])]
-        if ac_cup_sel != "Seleccionar":
-            subset = subset[subset["GRADO DE ACERO CUPLA"].isin([ac_cup_sel, "TODOS"])]
-        opciones_tipo_cup = sorted([x for x in subset["TIPO DE CUPLA"].dropna().unique() if str(x).upper() != "TODOS"]) if "TIPO DE CUPLA" in subset.columns else ["Seleccionar"]
+        seleccion = filtros.get(diam, {})
+        opciones_tipo_cup = indice.opciones("TIPO DE CUPLA", filtros_flujo_a(diam, seleccion, "TIPO DE CUPLA")) if indice.tiene("TIPO DE CUPLA") else ["Seleccionar"]
         if not opciones_tipo_cup:
             opciones_tipo_cup = ["TODOS"]
         tipo_cup_dict[diam] = opciones_tipo_cup
 
     if request.method == "POST":
-        for diam in selected_diametros:
-            tipo_cup = request.form.get(f"tipo_cup_{diam}", "Seleccionar")
-            if diam in filtros:
-                filtros[diam]["tipo_cup"] = tipo_cup
-            else:
-                filtros[diam] = {"tipo_cup": tipo_cup}
+        tipos_cup = {diam: {"tipo_cup": request.form.get(f"tipo_cup_{diam}", "Seleccionar")} for diam in selected_diametros}
         # Redirige al paso final/resumen
-        return redirect(url_for("flujo_a_resumen", diametros=diametros_str, filtros=json.dumps(filtros)))
+        return avanzar("flujo_a_resumen", filtros=tipos_cup)
     else:
         return render_template("flujo_a_seleccion_tipo_cup.html", diametros=selected_diametros, tipo_cup=tipo_cup_dict)
 
@@ -246,36 +402,15 @@ def flujo_a_seleccion_tipo_cup():
 # Paso Final: Aplicar filtros y generar el resultado final
 @app.route("/flujo_a/resumen", methods=["GET", "POST"])
 def flujo_a_resumen():
-    diametros_str = request.args.get("diametros", "")
-    filtros_str = request.args.get("filtros", "{}")
-    selected_diametros = diametros_str.split(",") if diametros_str else []
-    filtros = json.loads(filtros_str)
+    estado = estado_paso()
+    selected_diametros = estado.get("diametros", [])
+    filtros = estado.get("filtros", {})
     
     try:
-        file_path = os.path.join(BASE_DIR, "ajuste de medida.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        final_df_renombrado = flujos.resultado_flujo_a(catalogos, selected_diametros, filtros)
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
-    
-    # Construir la condición final combinando los filtros de cada DIÁMETRO
-    final_condition = pd.Series([False] * len(df))
-    for diam in selected_diametros:
-        cond = df["DIÁMETRO"].isin([diam, "TODOS"])
-        if filtros.get(diam, {}).get("tipo", "TODOS") != "TODOS":
-            cond = cond & df["TIPO"].isin([filtros[diam]["tipo"], "TODOS"])
-        if filtros.get(diam, {}).get("acero", "Seleccionar") != "Seleccionar":
-            cond = cond & df["GRADO DE ACERO"].isin([filtros[diam]["acero"], "TODOS"])
-        if filtros.get(diam, {}).get("acero_cup", "Seleccionar") != "Seleccionar":
-            cond = cond & df["GRADO DE ACERO CUPLA"].isin([filtros[diam]["acero_cup"], "TODOS"])
-        if filtros.get(diam, {}).get("tipo_cup", "Seleccionar") != "Seleccionar":
-            cond = cond & df["TIPO DE CUPLA"].isin([filtros[diam]["tipo_cup"], "TODOS"])
-        final_condition = final_condition | cond
-    
-    final_df = df[final_condition]
-    final_df_renombrado = renombrar_columnas(final_df)
-    materiales_finales.append(("FLUJO A", final_df_renombrado))
+    registrar_resultado("FLUJO A", final_df_renombrado)
     # Finalmente, redirigir al flujo siguiente (por ejemplo, flujo_h)
     return redirect(url_for("flujo_h"))
 
@@ -298,42 +433,31 @@ def flujo_b():
 @app.route("/flujo_b/seleccion", methods=["GET", "POST"])
 def flujo_b_seleccion():
     try:
-        file_path = os.path.join(BASE_DIR, "saca tubing.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        unique_diametros = sorted([d for d in df["DIÁMETRO"].dropna().unique() if d.upper() != "TODOS"])
+        valores = motor_filtros(catalogos, "saca tubing.xlsx").valores("DIÁMETRO")
+        unique_diametros = sorted([d for d in valores if d.upper() != "TODOS"])
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     if request.method == "POST":
         selected = request.form.getlist("diametros")
         if not selected:
             return "Selecciona al menos un DIÁMETRO.", 400
-        diametros_str = ",".join(selected)
-        return redirect(url_for("flujo_b_cantidades", diametros=diametros_str))
+        return avanzar("flujo_b_cantidades", diametros=selected)
     else:
         return render_template("flujo_b_seleccion.html", unique_diametros=unique_diametros)
 
 @app.route("/flujo_b/cantidades", methods=["GET", "POST"])
 def flujo_b_cantidades():
-    diametros_str = request.args.get("diametros", "")
-    selected = diametros_str.split(",") if diametros_str else []
+    selected = estado_paso().get("diametros", [])
     if request.method == "POST":
         quantities = {}
         for diam in selected:
             qty = request.form.get(f"qty_{diam}", type=float)
             quantities[diam] = qty
         try:
-            file_path = os.path.join(BASE_DIR, "saca tubing.xlsx")
-            df = pd.read_excel(file_path)
-            df.columns = df.columns.str.strip()
+            df_filtered_renombrado = flujos.resultado_flujo_b(catalogos, quantities)
         except Exception as e:
             return f"Error: {e}"
-        df_filtered = df[(df["DIÁMETRO"].isin(selected)) | (df["DIÁMETRO"].str.upper() == "TODOS")].copy()
-        for diam, qty in quantities.items():
-            mask = (df_filtered["DIÁMETRO"] == diam) & (df_filtered["4.CANTIDAD"].isna())
-            df_filtered.loc[mask, "4.CANTIDAD"] = qty
-        df_filtered_renombrado = renombrar_columnas(df_filtered)
-        materiales_finales.append(("FLUJO B", df_filtered_renombrado))
+        registrar_resultado("FLUJO B", df_filtered_renombrado)
         return redirect(url_for("flujo_c"))
     else:
         return render_template("flujo_b_cantidades.html", selected_diametros=selected)
@@ -362,11 +486,9 @@ def flujo_c_decidir():
 @app.route("/flujo_c/seleccion", methods=["GET", "POST"])
 def flujo_c_seleccion():
     try:
-        file_path = os.path.join(BASE_DIR, "baja tubing.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
+        valores = motor_filtros(catalogos, "baja tubing.xlsx").valores("DIÁMETRO")
         # Se extraen los DIÁMETRO únicos (excluyendo "TODOS")
-        unique_diametros = sorted([x for x in df["DIÁMETRO"].dropna().unique() if x != "TODOS"])
+        unique_diametros = sorted([x for x in valores if x != "TODOS"])
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
@@ -374,26 +496,22 @@ def flujo_c_seleccion():
         selected = request.form.getlist("diametros")
         if not selected:
             return "Selecciona al menos un DIÁMETRO.", 400
-        diametros_str = ",".join(selected)
-        return redirect(url_for("flujo_c_tipo", diametros=diametros_str))
+        return avanzar("flujo_c_tipo", diametros=selected)
     else:
         return render_template("flujo_c_seleccion.html", unique_diametros=unique_diametros)
 
 @app.route("/flujo_c/tipo", methods=["GET", "POST"])
 def flujo_c_tipo():
-    diametros_str = request.args.get("diametros", "")
-    selected_diametros = diametros_str.split(",") if diametros_str else []
+    estado = estado_paso()
+    selected_diametros = estado.get("diametros", [])
     try:
-        file_path = os.path.join(BASE_DIR, "baja tubing.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
+        indice = indice_facetas(catalogos, "baja tubing.xlsx", CASCADA_TUBING)
     except Exception as e:
         return f"Error: {e}"
     # Para cada DIÁMETRO, extraemos las opciones de TIPO (excluyendo "TODOS")
     filtros = {}
     for diam in selected_diametros:
-        subset = df[df["DIÁMETRO"] == diam]
-        tipos = sorted([x for x in subset["TIPO"].dropna().unique() if x != "TODOS"])
+        tipos = indice.opciones("TIPO", {"DIÁMETRO": [diam]})
         if not tipos:
             tipos = ["TODOS"]
         filtros[diam] = tipos
@@ -404,21 +522,17 @@ def flujo_c_tipo():
             if not sel:
                 sel = ["TODOS"]
             selected_tipos_dict[diam] = sel
-        tipos_json = json.dumps(selected_tipos_dict)
-        return redirect(url_for("flujo_c_diacsg", diametros=diametros_str, tipos=tipos_json))
+        return avanzar("flujo_c_diacsg", tipos=selected_tipos_dict)
     else:
         return render_template("flujo_c_tipo.html", selected_diametros=selected_diametros, filtros=filtros)
 
 @app.route("/flujo_c/diacsg", methods=["GET", "POST"])
 def flujo_c_diacsg():
-    diametros_str = request.args.get("diametros", "")
-    selected_diametros = diametros_str.split(",") if diametros_str else []
-    tipos_json = request.args.get("tipos", "{}")
-    selected_tipos_dict = json.loads(tipos_json)
+    estado = estado_paso()
+    selected_diametros = estado.get("diametros", [])
+    selected_tipos_dict = estado.get("tipos", {})
     try:
-        file_path = os.path.join(BASE_DIR, "baja tubing.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
+        indice = indice_facetas(catalogos, "baja tubing.xlsx", CASCADA_TUBING)
     except Exception as e:
         return f"Error: {e}"
     # Se calcula la unión de los TIPO seleccionados, agregando "TODOS"
@@ -430,62 +544,37 @@ def flujo_c_diacsg():
             union_tipos.update(sel)
             union_tipos.add("TODOS")
     diam_filter = ["TODOS"] if selected_diametros == ["TODOS"] else selected_diametros + ["TODOS"]
-    df_filtered = df[df["DIÁMETRO"].isin(diam_filter) & df["TIPO"].isin(union_tipos)]
-    unique_csg = sorted([x for x in df_filtered["DIÁMETRO CSG"].dropna().unique() if x != "TODOS"])
+    unique_csg = indice.opciones("DIÁMETRO CSG", {"DIÁMETRO": diam_filter, "TIPO": union_tipos})
     if not unique_csg:
         # Si no hay valores para DIÁMETRO CSG, se continúa automáticamente usando "TODOS"
-        return redirect(url_for("flujo_c_cantidades", diametros=diametros_str, tipos=tipos_json, diacsg="TODOS"))
+        return avanzar("flujo_c_cantidades", diacsg="TODOS")
     if request.method == "POST":
         selected_csg = request.form.get("diacsg")
         if not selected_csg:
             selected_csg = "TODOS"
         # Se fuerza el filtrado: si se selecciona un valor, se usa [valor, "TODOS"]
-        return redirect(url_for("flujo_c_cantidades", diametros=diametros_str, tipos=tipos_json, diacsg=selected_csg))
+        return avanzar("flujo_c_cantidades", diacsg=selected_csg)
     else:
         return render_template("flujo_c_diacsg.html", unique_csg=unique_csg)
 
 @app.route("/flujo_c/cantidades", methods=["GET", "POST"])
 def flujo_c_cantidades():
-    diametros_str = request.args.get("diametros", "")
-    selected_diametros = diametros_str.split(",") if diametros_str else []
-    tipos_json = request.args.get("tipos", "{}")
-    selected_tipos_dict = json.loads(tipos_json)
+    estado = estado_paso()
+    selected_diametros = estado.get("diametros", [])
+    selected_tipos_dict = estado.get("tipos", {})
     # Aquí se recibe el valor seleccionado en DIÁMETRO CSG; se utiliza para filtrar
-    diacsg = request.args.get("diacsg", "TODOS")
-    try:
-        file_path = os.path.join(BASE_DIR, "baja tubing.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-    except Exception as e:
-        return f"Error: {e}"
+    diacsg = estado.get("diacsg", "TODOS")
     if request.method == "POST":
         quantities = {}
         for diam in selected_diametros:
             for tipo in selected_tipos_dict.get(diam, []):
                 qty = request.form.get(f"qty_{diam}_{tipo}", type=float)
                 quantities[(diam, tipo)] = qty
-        # Ahora, se aplica el filtrado incluyendo DIÁMETRO, TIPO y DIÁMETRO CSG
-        for (diam, tipo), qty in quantities.items():
-            condition = (
-                df["DIÁMETRO"].isin([diam, "TODOS"]) &
-                df["TIPO"].isin([tipo, "TODOS"]) &
-                df["DIÁMETRO CSG"].isin([diacsg, "TODOS"])
-            )
-            df.loc[condition & df["4.CANTIDAD"].isna(), "4.CANTIDAD"] = qty
-        final_condition = pd.Series([False]*len(df))
-        for diam_value, fdict in selected_tipos_dict.items():
-            temp = pd.Series([False]*len(df))
-            for tipo_val in fdict:
-                cond = (
-                    df["DIÁMETRO"].isin([diam_value, "TODOS"]) &
-                    df["TIPO"].isin([tipo_val, "TODOS"]) &
-                    df["DIÁMETRO CSG"].isin([diacsg, "TODOS"])
-                )
-                temp = temp | cond
-            final_condition = final_condition | temp
-        final_df = df[final_condition]
-        final_df_renombrado = renombrar_columnas(final_df)
-        materiales_finales.append(("FLUJO C", final_df_renombrado))
+        try:
+            final_df_renombrado = flujos.resultado_flujo_c(catalogos, selected_tipos_dict, diacsg, quantities)
+        except Exception as e:
+            return f"Error: {e}"
+        registrar_resultado("FLUJO C", final_df_renombrado)
         return redirect(url_for("flujo_d"))
     else:
         # Prepara una lista de combinaciones para mostrar los campos de cantidad
@@ -514,66 +603,44 @@ def flujo_d_decidir():
 
 @app.route("/flujo_d/seleccion", methods=["GET", "POST"])
 def flujo_d_seleccion():
-    file_path = os.path.join(BASE_DIR, "profundiza.xlsx")
     try:
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        for col in df.columns:
-            if df[col].dtype == object:
-                df[col] = df[col].astype(str).str.strip()
-        # Reemplazar valores 'nan'
-        if 'TIPO' in df.columns:
-            df['TIPO'] = df['TIPO'].replace('nan', '').fillna('')
-        if 'DIÁMETRO CSG' in df.columns:
-            df['DIÁMETRO CSG'] = df['DIÁMETRO CSG'].replace('nan', '').fillna('')
+        motor = motor_filtros(catalogos, "profundiza.xlsx")
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
     # Elegir la columna a usar: si existe "DIÁMETRO", se usa; sino, "DIÁMETRO CSG"
-    if "DIÁMETRO" in df.columns:
+    if "DIÁMETRO" in motor.columnas:
         col = "DIÁMETRO"
-    elif "DIÁMETRO CSG" in df.columns:
+    elif "DIÁMETRO CSG" in motor.columnas:
         col = "DIÁMETRO CSG"
     else:
         return "La columna de DIÁMETRO no se encontró en el Excel."
     
-    unique_values = sorted(df[col].dropna().unique().tolist())
+    unique_values = sorted(motor.valores(col))
     if request.method == "POST":
         selected = request.form.getlist("valores")
         if not selected:
             return "No se seleccionaron valores.", 400
-        selected_str = ",".join(selected)
-        # Redirigir a la página de ingreso de cantidades, pasando la columna y los valores seleccionados
-        return redirect(url_for("flujo_d_cantidades", valores=selected_str, col=col))
+        # Redirigir a la página de ingreso de cantidades, guardando la columna y los valores seleccionados
+        return avanzar("flujo_d_cantidades", valores=selected, col=col)
     else:
         return render_template("flujo_d_seleccion.html", unique_values=unique_values, col=col)
 
 @app.route("/flujo_d/cantidades", methods=["GET", "POST"])
 def flujo_d_cantidades():
-    valores_str = request.args.get("valores", "")
-    col = request.args.get("col", "")
-    selected_values = valores_str.split(",") if valores_str else []
-    file_path = os.path.join(BASE_DIR, "profundiza.xlsx")
-    try:
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        for c in df.columns:
-            if df[c].dtype == object:
-                df[c] = df[c].astype(str).str.strip()
-    except Exception as e:
-        return f"Error al cargar el Excel: {e}"
+    estado = estado_paso()
+    col = estado.get("col", "")
+    selected_values = estado.get("valores", [])
     if request.method == "POST":
         quantities = {}
         for val in selected_values:
             qty = request.form.get(f"qty_{val}", type=float)
             quantities[val] = qty
-        # Filtrar el DataFrame según la columna y los valores seleccionados
-        filtered_df = df[df[col].isin(selected_values)]
-        for val, qty in quantities.items():
-            mask = (filtered_df[col] == val) & (filtered_df["4.CANTIDAD"].isna())
-            filtered_df.loc[mask, "4.CANTIDAD"] = qty
-        final_df_renombrado = renombrar_columnas(filtered_df)
-        materiales_finales.append(("FLUJO D", final_df_renombrado))
+        try:
+            final_df_renombrado = flujos.resultado_flujo_d(catalogos, col, quantities)
+        except Exception as e:
+            return f"Error al cargar el Excel: {e}"
+        registrar_resultado("FLUJO D", final_df_renombrado)
         return redirect(url_for("flujo_e"))
     else:
         # Preparar lista de valores para mostrar los campos de cantidad
@@ -600,86 +667,53 @@ def flujo_e_decidir():
 @app.route("/flujo_e/seleccion", methods=["GET", "POST"])
 def flujo_e_seleccion():
     try:
-        file_path = os.path.join(BASE_DIR, "baja varillas.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
-        unique_diametros = sorted([x for x in df["DIÁMETRO"].dropna().unique() if x.upper() != "TODOS"])
+        valores = motor_filtros(catalogos, "baja varillas.xlsx").valores("DIÁMETRO")
+        unique_diametros = sorted([x for x in valores if x.upper() != "TODOS"])
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     if request.method == "POST":
         selected = request.form.getlist("diametros")
         if not selected:
             return "Selecciona al menos un DIÁMETRO.", 400
-        diametros_str = ",".join(selected)
-        return redirect(url_for("flujo_e_filtros", diametros=diametros_str))
+        return avanzar("flujo_e_filtros", diametros=selected)
     else:
         return render_template("flujo_e_seleccion.html", unique_diametros=unique_diametros)
 
 @app.route("/flujo_e/filtros", methods=["GET", "POST"])
 def flujo_e_filtros():
-    diametros_str = request.args.get("diametros", "")
-    selected_diametros = diametros_str.split(",") if diametros_str else []
+    estado = estado_paso()
+    selected_diametros = estado.get("diametros", [])
     try:
-        file_path = os.path.join(BASE_DIR, "baja varillas.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()
+        indice = indice_facetas(catalogos, "baja varillas.xlsx", CASCADA_VARILLAS)
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     # Para cada DIÁMETRO, se obtienen las opciones para los filtros en cascada
     filtros = {}
     for diam in selected_diametros:
-        subset = df[df["DIÁMETRO"] == diam]
+        por_diametro = {"DIÁMETRO": [diam]}
         # Filtro TIPO
-        tipos = sorted([x for x in subset["TIPO"].dropna().unique() if x.upper() != "TODOS"])
+        tipos = indice.opciones("TIPO", por_diametro)
         if not tipos:
             tipos = ["TODOS"]
         # Filtros para otras columnas (si existen)
-        acero = sorted([x for x in subset["GRADO DE ACERO"].dropna().unique() if str(x).upper() != "TODOS"]) if "GRADO DE ACERO" in subset.columns else ["Seleccionar"]
-        acero_cup = sorted([x for x in subset["GRADO DE ACERO CUPLA"].dropna().unique() if str(x).upper() != "TODOS"]) if "GRADO DE ACERO CUPLA" in subset.columns else ["Seleccionar"]
-        tipo_cup = sorted([x for x in subset["TIPO DE CUPLA"].dropna().unique() if str(x).upper() != "TODOS"]) if "TIPO DE CUPLA" in subset.columns else ["Seleccionar"]
+        acero = indice.opciones("GRADO DE ACERO", por_diametro) if indice.tiene("GRADO DE ACERO") else ["Seleccionar"]
+        acero_cup = indice.opciones("GRADO DE ACERO CUPLA", por_diametro) if indice.tiene("GRADO DE ACERO CUPLA") else ["Seleccionar"]
+        tipo_cup = indice.opciones("TIPO DE CUPLA", por_diametro) if indice.tiene("TIPO DE CUPLA") else ["Seleccionar"]
         filtros[diam] = {"tipos": tipos, "acero": acero, "acero_cup": acero_cup, "tipo_cup": tipo_cup}
     if request.method == "POST":
         # Se recogen los filtros seleccionados para cada DIÁMETRO
         all_filters = {}
         for diam in selected_diametros:
-            # Recoger el filtro de TIPO
-            tipo_sel = request.form.getlist(f"tipo_{diam}")
-            # Si se seleccionó algún valor, se crea la lista con el valor y "TODOS"
-            if tipo_sel:
-                tipo_list = tipo_sel + ["TODOS"]
-            else:
-                # Si no se seleccionó nada, dejamos la lista vacía para indicar que no se filtra por TIPO
-                tipo_list = []
-        
-            # Repetir para las otras columnas, comparando con "" o "Seleccionar"
-            ac = request.form.get(f"acero_{diam}", "")
-            if ac and ac != "Seleccionar":
-                acero_list = [ac, "TODOS"]
-            else:
-                acero_list = []
-        
-            ac_cup = request.form.get(f"acero_cup_{diam}", "")
-            if ac_cup and ac_cup != "Seleccionar":
-                acero_cup_list = [ac_cup, "TODOS"]
-            else:
-                acero_cup_list = []
-        
-            t_cup = request.form.get(f"tipo_cup_{diam}", "")
-            if t_cup and t_cup != "Seleccionar":
-                tipo_cup_list = [t_cup, "TODOS"]
-            else:
-                tipo_cup_list = []
-        
-            all_filters[diam] = {"tipo_list": tipo_list,
-                                 "acero_list": acero_list,
-                                 "acero_cup_list": acero_cup_list,
-                                 "tipo_cup_list": tipo_cup_list}
+            # Si no se selecciona TIPO (o se deja "Seleccionar" en el resto) no se filtra por esa columna
+            all_filters[diam] = filtros_flujo_e(
+                request.form.getlist(f"tipo_{diam}"),
+                request.form.get(f"acero_{diam}", ""),
+                request.form.get(f"acero_cup_{diam}", ""),
+                request.form.get(f"tipo_cup_{diam}", ""),
+            )
 
         # En lugar de procesar y mostrar el resultado, redirigimos a la etapa de ingreso de cantidades
-        filtros_json = json.dumps(all_filters)
-        return redirect(url_for("flujo_e_cantidades", diametros=diametros_str, filtros=filtros_json))
+        return avanzar("flujo_e_cantidades", filtros=all_filters)
     else:
         return render_template("flujo_e_filtros.html", selected_diametros=selected_diametros, filtros=filtros)
 
@@ -687,49 +721,20 @@ def flujo_e_filtros():
 @app.route("/flujo_e/cantidades", methods=["GET", "POST"])
 @app.route("/flujo_e/cantidades", methods=["GET", "POST"])
 def flujo_e_cantidades():
-    diametros_str = request.args.get("diametros", "")
-    selected_diametros = diametros_str.split(",") if diametros_str else []
-    filtros_str = request.args.get("filtros", "{}")
-    all_filters = json.loads(filtros_str)
+    estado = estado_paso()
+    selected_diametros = estado.get("diametros", [])
+    all_filters = estado.get("filtros", {})
     
-    try:
-        file_path = os.path.join(BASE_DIR, "baja varillas.xlsx")
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-        df["DIÁMETRO"] = df["DIÁMETRO"].astype(str).str.strip()  # Aseguramos la conversión y limpieza
-        df["4.CANTIDAD"] = pd.to_numeric(df["4.CANTIDAD"], errors="coerce")
-    except Exception as e:
-        return f"Error al cargar el Excel: {e}"
-    
-    # Aplicar los filtros adicionales de cada DIÁMETRO
-    filtered_df = pd.DataFrame()
-    for diam in selected_diametros:
-        # Aquí se incluye el valor "TODOS" junto con el diámetro seleccionado
-        subset = df[df["DIÁMETRO"].isin([diam, "TODOS"])]
-        if diam in all_filters:
-            filtros_diam = all_filters[diam]
-            if filtros_diam.get("tipo_list"):
-                subset = subset[subset["TIPO"].isin(filtros_diam["tipo_list"])]
-            if "GRADO DE ACERO" in subset.columns and filtros_diam.get("acero_list"):
-                subset = subset[subset["GRADO DE ACERO"].isin(filtros_diam["acero_list"])]
-            if "GRADO DE ACERO CUPLA" in subset.columns and filtros_diam.get("acero_cup_list"):
-                subset = subset[subset["GRADO DE ACERO CUPLA"].isin(filtros_diam["acero_cup_list"])]
-            if "TIPO DE CUPLA" in subset.columns and filtros_diam.get("tipo_cup_list"):
-                subset = subset[subset["TIPO DE CUPLA"].isin(filtros_diam["tipo_cup_list"])]
-        filtered_df = pd.concat([filtered_df, subset])
-    
-   
     if request.method == "POST":
         quantities = {}
         for diam in selected_diametros:
             qty = request.form.get(f"qty_{diam}", type=float)
             quantities[diam] = qty
-        # Actualizar la columna "4.CANTIDAD" donde la celda es NaN
-        for diam, qty in quantities.items():
-            mask = (filtered_df["DIÁMETRO"] == diam) & (filtered_df["4.CANTIDAD"].isna())
-            filtered_df.loc[mask, "4.CANTIDAD"] = qty
-        final_df_renombrado = renombrar_columnas(filtered_df)
-        materiales_finales.append(("FLUJO E", final_df_renombrado))
+        try:
+            final_df_renombrado = flujos.resultado_flujo_e(catalogos, selected_diametros, all_filters, quantities)
+        except Exception as e:
+            return f"Error al cargar el Excel: {e}"
+        registrar_resultado("FLUJO E", final_df_renombrado)
         # No se muestra la lista aquí; se guarda para la consolidación final
         return redirect(url_for("flujo_h"))
     else:
@@ -761,22 +766,20 @@ def flujo_f_decidir():
 # Ruta para configurar los filtros (DIÁMETRO y DIÁMETRO CSG)
 @app.route("/flujo_f/filtros", methods=["GET", "POST"])
 def flujo_f_filtros():
-    file_path = os.path.join(BASE_DIR, "abandono-recupero.xlsx")
     try:
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
+        motor = motor_filtros(catalogos, "abandono-recupero.xlsx")
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     # Verificar que existan las columnas requeridas
-    if "DIÁMETRO" not in df.columns:
+    if "DIÁMETRO" not in motor.columnas:
         return "La columna 'DIÁMETRO' no se encontró en el Excel."
-    if "DIÁMETRO CSG" not in df.columns:
+    if "DIÁMETRO CSG" not in motor.columnas:
         return "La columna 'DIÁMETRO CSG' no se encontró en el Excel."
     # Construir opciones internas (con "TODOS") y opciones para mostrar (sin "TODOS")
-    all_diametros = list(df["DIÁMETRO"].dropna().unique())
+    all_diametros = motor.valores("DIÁMETRO")
     opciones_diam = [d for d in all_diametros if d.upper() != "TODOS"]
     # Para el filtrado interno se usa "TODOS" (si no se selecciona nada, se asume "TODOS")
-    all_diametros_csg = list(df["DIÁMETRO CSG"].dropna().unique())
+    all_diametros_csg = motor.valores("DIÁMETRO CSG")
     opciones_diacsg = [d for d in all_diametros_csg if d.upper() != "TODOS"]
     
     if request.method == "POST":
@@ -790,11 +793,7 @@ def flujo_f_filtros():
         selected_diacsg = request.form.get("diacsg")
         if not selected_diacsg:
             selected_diacsg = "TODOS"
-        # Se preparan los datos (en este ejemplo, simplemente se pasan en query string)
-        filtros = {"diametros": selected_diametros, "diacsg": selected_diacsg}
-        filtros_json = json.dumps(filtros)
-        diametros_str = ",".join(selected_diametros)
-        return redirect(url_for("flujo_f_cantidades", diametros=diametros_str, filtros=filtros_json))
+        return avanzar("flujo_f_cantidades", diametros=selected_diametros, diacsg=selected_diacsg)
     else:
         return render_template("flujo_f_filtros.html", 
                                opciones_diam=opciones_diam, 
@@ -803,29 +802,20 @@ def flujo_f_filtros():
 # Ruta para ingresar cantidades
 @app.route("/flujo_f/cantidades", methods=["GET", "POST"])
 def flujo_f_cantidades():
-    diametros_str = request.args.get("diametros", "")
     # La lista interna contiene "TODOS", pero para mostrar los inputs se excluye "TODOS"
-    selected_diametros = diametros_str.split(",") if diametros_str else []
+    selected_diametros = estado_paso().get("diametros", [])
     display_diametros = [d for d in selected_diametros if d.upper() != "TODOS"]
-    filtros_json = request.args.get("filtros", "{}")
-    # Para este flujo se usará el Excel "abandono-recupero.xlsx"
-    file_path = os.path.join(BASE_DIR, "abandono-recupero.xlsx")
-    try:
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.strip()
-    except Exception as e:
-        return f"Error al cargar el Excel: {e}"
     if request.method == "POST":
         quantities = {}
         for diam in display_diametros:
             qty = request.form.get(f"qty_{diam}", type=float)
             quantities[diam] = qty
-        filtered_df = df[df["DIÁMETRO"].isin(selected_diametros)]
-        for diam, qty in quantities.items():
-            mask = (filtered_df["DIÁMETRO"] == diam) & (filtered_df["4.CANTIDAD"].isna())
-            filtered_df.loc[mask, "4.CANTIDAD"] = qty
-        final_df_renombrado = renombrar_columnas(filtered_df)
-        materiales_finales.append(("FLUJO F", final_df_renombrado))
+        # Para este flujo se usará el Excel "abandono-recupero.xlsx"
+        try:
+            final_df_renombrado = flujos.resultado_flujo_f(catalogos, selected_diametros, quantities)
+        except Exception as e:
+            return f"Error al cargar el Excel: {e}"
+        registrar_resultado("FLUJO F", final_df_renombrado)
         # En lugar de imprimir, se guarda para consolidar al final
         return redirect(url_for("flujo_h"))
     else:
@@ -854,64 +844,35 @@ def flujo_h_decidir():
 
 @app.route("/flujo_h/seleccion", methods=["GET", "POST"])
 def flujo_h_seleccion():
-    file_path_H = os.path.join(BASE_DIR, "GENERAL(1).xlsx")
     try:
-        df_H = pd.read_excel(file_path_H)
-        df_H.columns = df_H.columns.str.strip()
-        # Si no existe la columna "4.CANTIDAD", se crea con 0
-        if "4.CANTIDAD" not in df_H.columns:
-            df_H["4.CANTIDAD"] = 0
-        else:
-            df_H["4.CANTIDAD"] = pd.to_numeric(df_H["4.CANTIDAD"], errors="coerce")
+        total_materiales = motor_filtros(catalogos, "GENERAL(1).xlsx").n_filas
     except Exception as e:
         return f"Error al cargar el Excel: {e}"
     
-    # Extraer la lista de materiales de la columna "2. MATERIAL"
-    if "2. MATERIAL" in df_H.columns:
-        materiales = df_H["2. MATERIAL"].astype(str).unique().tolist()
-    else:
-        materiales = []
-    # Se genera la tabla HTML para que el usuario la consulte (opcional)
-    #df_html = df_H.to_html(classes="table table-bordered", index=False)
+    # Los materiales se buscan con /api/materiales/buscar; la página no envía la lista completa
     if request.method == "POST":
         seleccionados = request.form.getlist("materiales")
         if not seleccionados:
             return "No se seleccionó ningún material.", 400
-        seleccion_str = ",".join(seleccionados)
-        return redirect(url_for("flujo_h_cantidades", materiales=seleccion_str))
+        return avanzar("flujo_h_cantidades", materiales=seleccionados)
     else:
-        return render_template("flujo_h_seleccion.html", materiales=materiales)
+        return render_template("flujo_h_seleccion.html", total_materiales=total_materiales)
 
 @app.route("/flujo_h/cantidades", methods=["GET", "POST"])
 def flujo_h_cantidades():
-    materiales_str = request.args.get("materiales", "")
-    seleccionados = materiales_str.split(",") if materiales_str else []
-    file_path_H = os.path.join(BASE_DIR, "GENERAL(1).xlsx")
-    try:
-        df_H = pd.read_excel(file_path_H)
-        df_H.columns = df_H.columns.str.strip()
-        # Crear o convertir la columna "4.CANTIDAD"
-        if "4.CANTIDAD" not in df_H.columns:
-            df_H["4.CANTIDAD"] = 0
-        else:
-            df_H["4.CANTIDAD"] = pd.to_numeric(df_H["4.CANTIDAD"], errors="coerce")
-    except Exception as e:
-        return f"Error al cargar el Excel: {e}"
+    seleccionados = estado_paso().get("materiales", [])
     if request.method == "POST":
         quantities = {}
         for mat in seleccionados:
             qty = request.form.get(f"qty_{mat}", type=float)
             quantities[mat] = qty
-        # Actualizamos el DataFrame: para cada material seleccionado, asignar la cantidad en filas sin valor
-        for mat, qty in quantities.items():
-            mask = (df_H["2. MATERIAL"].astype(str) == mat) & ((df_H["4.CANTIDAD"].isna()) | (df_H["4.CANTIDAD"] <= 0))
-            df_H.loc[mask, "4.CANTIDAD"] = qty
-        # Filtramos solo los materiales con cantidad mayor que 0
-        assigned_df = df_H[df_H["2. MATERIAL"].astype(str).isin(seleccionados) & (df_H["4.CANTIDAD"] > 0)]
-        if not assigned_df.empty:
-            assigned_df_renombrado = renombrar_columnas(assigned_df)
-            # Guardamos el resultado del Flujo H en la variable global
-            materiales_finales.append(("FLUJO H", assigned_df_renombrado))
+        try:
+            assigned_df_renombrado = flujos.resultado_flujo_h(catalogos, quantities)
+        except Exception as e:
+            return f"Error al cargar el Excel: {e}"
+        if assigned_df_renombrado is not None:
+            # Guardamos el resultado del Flujo H en la corrida actual
+            registrar_resultado("FLUJO H", assigned_df_renombrado)
         else:
             print("No se asignaron cantidades (o todas fueron 0).")
         return redirect(url_for("flujo_final"))
@@ -923,38 +884,351 @@ def flujo_h_cantidades():
 # ===================================
 # FLUJO FINAL: Resultados Consolidados
 # ===================================
+# La página muestra la lista de materiales consolidada y el detalle de cada flujo. De cada
+# tabla se muestra la primera página de filas, serializada al registrar el resultado; las
+# siguientes se piden a /api/corrida/resultados/<orden>/filas?pagina=N (la lista es el orden 0).
 @app.route("/flujo_final", methods=["GET"])
 def flujo_final():
-    return render_template("flujo_final.html", materiales_finales=materiales_finales)
+    corrida = corrida_actual()
+    with metricas.etapa("registro"):
+        corridas.asegurar_lista(corrida, flujos.lista_materiales)
+    return render_template(
+        "flujo_final.html",
+        lista=corridas.lista(corrida),
+        resultados=corridas.resumen(corrida),
+    )
+
+
+@app.route("/api/corrida/resultados/<int:orden>/filas")
+def api_filas_resultado(orden):
+    pagina = request.args.get("pagina", 0, type=int)
+    if orden == ORDEN_LISTA:
+        corridas.asegurar_lista(corrida_actual(), flujos.lista_materiales)
+    encontrado = corridas.pagina(corrida_actual(), orden, pagina)
+    if encontrado is None:
+        return jsonify({"error": f"La corrida no tiene el resultado {orden}"}), 404
+    flujo, columnas, total, filas = encontrado
+    # Las filas ya están en JSON: se insertan en la respuesta sin volver a serializarlas
+    encabezado = json.dumps({
+        "flujo": flujo,
+        "columnas": columnas,
+        "total": total,
+        "pagina": pagina,
+        "por_pagina": FILAS_POR_PAGINA,
+    }, ensure_ascii=False)
+    return app.response_class(encabezado[:-1] + ', "filas": ' + filas + "}", mimetype="application/json")
 
 #====================================
 # EXPORTAR AL EXCEL
 #====================================
+# El libro tiene la hoja "Materiales Consolidados" y una hoja por flujo. Los DataFrames
+# de la corrida se leen de a uno y se escriben por bloques (ver exportar.py).
+# Los archivos generados quedan en una caché en disco bajo el digest de la corrida; ese
+# digest es el ETag, así que una exportación repetida responde 304 o reenvía el archivo.
 
 @app.route("/export_excel")
 def export_excel():
-    import io
-    from flask import send_file
+    return exportar("xlsx")
 
-    # Combina todos los DataFrames en uno solo, agregando una columna que indique el flujo
-    combined_df = pd.concat([df.assign(Flujo=flow) for flow, df in materiales_finales], ignore_index=True)
-    
-    # Crea un buffer en memoria para guardar el Excel
-    output = io.BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-    
-    # Escribe el DataFrame combinado en una sola hoja
-    combined_df.to_excel(writer, sheet_name="Materiales Consolidados", index=False)
-    writer.save()
-    output.seek(0)
-    
-    return send_file(
-        output,
-        attachment_filename="materiales_consolidados.xlsx",
-        as_attachment=True,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def _formato_invalido(formato):
+    if formato not in exportacion.FORMATOS:
+        return f"Formato no soportado: {formato}. Use xlsx, csv, jsonl o parquet."
+    if formato == "parquet" and not exportacion.parquet_disponible():
+        return "La exportación a Parquet requiere pyarrow (pip install pyarrow)."
+    return None
+
+
+def _enviar_exportacion(clave, formato, abrir):
+    # abrir() devuelve el archivo; no se llama si el navegador ya tiene esta versión (304)
+    nombre, mimetype = exportacion.FORMATOS[formato]
+    if request.if_none_match.contains(clave):
+        respuesta = app.response_class(status=304)
+    else:
+        respuesta = send_file(abrir(), mimetype=mimetype, as_attachment=True, download_name=nombre)
+    respuesta.set_etag(clave)
+    # El navegador puede guardar la copia, pero debe revalidarla con If-None-Match
+    respuesta.cache_control.private = True
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+
+def _resultados_exportacion(corrida, formato):
+    # El libro Excel empieza con la lista de materiales guardada en la corrida (se arma si falta)
+    if formato == "xlsx":
+        corridas.asegurar_lista(corrida, flujos.lista_materiales)
+    return corridas.iterar(corrida)
+
+
+@app.route("/exportar/<formato>")
+def exportar(formato):
+    error = _formato_invalido(formato)
+    if error:
+        return error, 400
+    corrida = corrida_actual()
+    clave = exportacion.digest(formato, corridas.huellas(corrida), catalogos.version())
+
+    def abrir():
+        archivo = cache_exportaciones.abrir(clave, formato)
+        if archivo is None:
+            with metricas.etapa("exportar"):
+                archivo = cache_exportaciones.guardar(clave, formato, _resultados_exportacion(corrida, formato))
+        return archivo
+
+    return _enviar_exportacion(clave, formato, abrir)
+
+
+#====================================
+# EXPORTACIONES EN SEGUNDO PLANO
+#====================================
+# POST /exportar/<formato>/trabajos encola la generación y responde enseguida (202) con el id
+# del trabajo (el digest de la corrida); el worker queda libre para los pasos del asistente.
+# GET /exportaciones/<formato>/<id> devuelve estado y avance (0 a 1) y
+# GET /exportaciones/<formato>/<id>/archivo descarga el archivo terminado.
+
+def _estado_trabajo(clave, formato, estado):
+    return {
+        "trabajo": clave,
+        "formato": formato,
+        **estado,
+        "url_estado": url_for("estado_exportacion", formato=formato, clave=clave),
+        "url_archivo": url_for("archivo_exportacion", formato=formato, clave=clave),
+    }
+
+
+@app.route("/exportar/<formato>/trabajos", methods=["POST"])
+def encolar_exportacion(formato):
+    error = _formato_invalido(formato)
+    if error:
+        return jsonify({"error": error}), 400
+    corrida = corrida_actual()
+    clave = exportacion.digest(formato, corridas.huellas(corrida), catalogos.version())
+    estado = cola_exportaciones.encolar(clave, formato, lambda: _resultados_exportacion(corrida, formato))
+    if estado is None:
+        respuesta = jsonify({"error": "Hay demasiadas exportaciones en curso; intente de nuevo en unos segundos."})
+        respuesta.status_code = 503
+        respuesta.headers["Retry-After"] = "5"
+        return respuesta
+    codigo = 200 if estado["estado"] == exportacion.LISTO else 202
+    return jsonify(_estado_trabajo(clave, formato, estado)), codigo
+
+
+@app.route("/exportaciones/<formato>/<clave>")
+def estado_exportacion(formato, clave):
+    if formato not in exportacion.FORMATOS or not exportacion.id_valido(clave):
+        return jsonify({"error": "Trabajo desconocido"}), 404
+    estado = cola_exportaciones.estado(clave, formato)
+    if estado is None:
+        return jsonify({"error": "Trabajo desconocido"}), 404
+    return jsonify(_estado_trabajo(clave, formato, estado))
+
+
+@app.route("/exportaciones/<formato>/<clave>/archivo")
+def archivo_exportacion(formato, clave):
+    if formato not in exportacion.FORMATOS or not exportacion.id_valido(clave):
+        return "Trabajo desconocido", 404
+    if not cache_exportaciones.existe(clave, formato):
+        estado = cola_exportaciones.estado(clave, formato)
+        if estado is None:
+            return "Trabajo desconocido (o el archivo ya salió de la caché)", 404
+        if estado["estado"] == exportacion.ERROR:
+            return f"La exportación falló: {estado['error']}", 500
+        return "La exportación todavía no terminó", 409
+    archivo = None
+    if not request.if_none_match.contains(clave):
+        archivo = cache_exportaciones.abrir(clave, formato)
+        if archivo is None:
+            return "El archivo ya salió de la caché; vuelva a exportar", 404
+    return _enviar_exportacion(clave, formato, lambda: archivo)
+
+
+#====================================
+# API DE FACETAS
+#====================================
+# GET /api/catalogos/<catalogo>/facetas?DIÁMETRO=...&TIPO=...[&columna=...][&comodin=0]
+# Devuelve las opciones de la siguiente columna de la cascada y la cantidad de filas que
+# cumplen los filtros. Cada filtro acepta además las filas "TODOS", salvo con comodin=0.
+
+@app.route("/api/catalogos/<catalogo>/facetas")
+def api_facetas(catalogo):
+    archivo = CATALOGOS.get(catalogo)
+    if archivo not in CASCADAS:
+        return jsonify({"error": f"Catálogo desconocido: {catalogo}"}), 404
+    cascada = CASCADAS[archivo]
+    try:
+        indice = indice_facetas(catalogos, archivo, cascada)
+        motor = motor_filtros(catalogos, archivo)
+    except Exception as e:
+        return jsonify({"error": f"Error al cargar el Excel: {e}"}), 500
+
+    comodin = request.args.get("comodin", "1") != "0"
+    filtros = {}
+    for col in cascada:
+        valores = [v for v in request.args.getlist(col) if v != ""]
+        if valores:
+            filtros[col] = valores + ["TODOS"] if comodin else valores
+    columnas_filtradas = [col for col in indice.columnas if col in filtros]
+    if len(columnas_filtradas) != len(filtros):
+        return jsonify({"error": "Hay filtros sobre columnas que no existen en el catálogo"}), 400
+
+    columna = request.args.get("columna")
+    if columna is None:
+        siguientes = [col for col in indice.columnas if col not in filtros]
+        columna = siguientes[0] if siguientes else None
+    if columna is not None and not indice.tiene(columna):
+        return jsonify({"catalogo": catalogo, "columna": columna, "existe": False,
+                        "opciones": [], "filas": len(motor.filas([filtros]))})
+    if columna is not None and columnas_filtradas and \
+            indice.columnas.index(columna) <= indice.columnas.index(columnas_filtradas[-1]):
+        return jsonify({"error": f"La columna '{columna}' debe ir después de los filtros en la cascada"}), 400
+
+    opciones = indice.opciones(columna, filtros) if columna is not None else []
+    return jsonify({
+        "catalogo": catalogo,
+        "columna": columna,
+        "existe": columna is not None,
+        "opciones": opciones,
+        "filas": len(motor.filas([filtros])),
+    })
+
+
+#====================================
+# BÚSQUEDA DE MATERIALES
+#====================================
+# GET /api/materiales/buscar?q=...[&catalogo=general&catalogo=...][&pagina=0][&por_pagina=20]
+# Busca por Cód.SAP, MATERIAL y Descripción en los catálogos pedidos (todos si no se indica)
+# y devuelve una página de resultados ordenados por puntaje.
+MAX_POR_PAGINA_BUSQUEDA = 100
+
+
+@app.route("/api/materiales/buscar")
+def api_buscar_materiales():
+    nombres = request.args.getlist("catalogo") or list(CATALOGOS)
+    desconocidos = [nombre for nombre in nombres if nombre not in CATALOGOS]
+    if desconocidos:
+        return jsonify({"error": f"Catálogo desconocido: {', '.join(desconocidos)}"}), 404
+    consulta = request.args.get("q", "")
+    pagina = max(0, request.args.get("pagina", 0, type=int))
+    por_pagina = min(MAX_POR_PAGINA_BUSQUEDA, max(1, request.args.get("por_pagina", 20, type=int)))
+    archivos = {CATALOGOS[nombre]: nombre for nombre in nombres}
+    try:
+        with metricas.etapa("busqueda"):
+            encontrados = flujos.buscar_materiales(catalogos, consulta, list(archivos))
+    except Exception as e:
+        return jsonify({"error": f"Error al cargar el Excel: {e}"}), 500
+
+    resultados = []
+    for puntaje, archivo, fila in encontrados[pagina * por_pagina:(pagina + 1) * por_pagina]:
+        registro, = _registros(flujos.renombrar_columnas(motor_filtros(catalogos, archivo).tomar([fila]))[["Cód.SAP", "MATERIAL", "Descripción"]])
+        registro.update({"catalogo": archivos[archivo], "fila": fila, "puntaje": puntaje})
+        resultados.append(registro)
+    return jsonify({
+        "consulta": consulta,
+        "total": len(encontrados),
+        "pagina": pagina,
+        "por_pagina": por_pagina,
+        "resultados": resultados,
+    })
+
+
+#====================================
+# API DE INTERVENCIONES (POR LOTES)
+#====================================
+# POST /api/intervenciones con {"intervenciones": [{"pozo": "...", "A": {...}, ..., "H": {...}}, ...]}
+# (formato de cada sección en flujos.py). Devuelve la tabla consolidada de materiales de cada pozo,
+# con el mismo filtrado y la misma carga de "4.CANTIDAD" que el asistente.
+
+def _registros(df):
+    # NaN no es JSON válido: se envía como null
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+@app.route("/api/intervenciones", methods=["POST"])
+def api_intervenciones():
+    datos = request.get_json(silent=True)
+    intervenciones = datos.get("intervenciones") if isinstance(datos, dict) else datos
+    if not isinstance(intervenciones, list):
+        return jsonify({"error": "Se espera un JSON con la lista 'intervenciones'"}), 400
+    try:
+        resueltas = flujos.resolver_lote(catalogos, intervenciones)
+    except Exception as e:
+        return jsonify({"error": f"Error al cargar el Excel: {e}"}), 500
+    pozos = []
+    for i, (intervencion, (resultados, error)) in enumerate(zip(intervenciones, resueltas)):
+        pozo = intervencion.get("pozo", i) if isinstance(intervencion, dict) else i
+        if error is not None:
+            pozos.append({"pozo": pozo, "error": error})
+        else:
+            pozos.append({"pozo": pozo, "materiales": _registros(flujos.consolidar(resultados))})
+    return jsonify({"pozos": pozos})
+
+
+#====================================
+# ESTADO DE LOS CATÁLOGOS
+#====================================
+# Versión de la instantánea publicada, versión (mtime-tamaño) de cada Excel cargado y estado del vigilante
+
+@app.route("/estado/catalogos")
+def estado_catalogos():
+    return jsonify(catalogos.estadisticas())
+
+
+# Aciertos de las cachés, filas y versión de los catálogos: se leen al momento de exponer
+def _estadisticas_caches():
+    return (
+        ("catalogos", catalogos.estadisticas()),
+        ("exportaciones", cache_exportaciones.estadisticas()),
+        ("filtros", flujos.cache_filtros.estadisticas()),
     )
 
 
+metricas.registrar(metricas.Medidor(
+    "pcp_cache_aciertos_total", "Aciertos de cada caché", ("cache",),
+    lambda: [((nombre,), e["aciertos"]) for nombre, e in _estadisticas_caches()], tipo="counter"))
+metricas.registrar(metricas.Medidor(
+    "pcp_cache_fallos_total", "Fallos de cada caché", ("cache",),
+    lambda: [((nombre,), e["fallos"]) for nombre, e in _estadisticas_caches()], tipo="counter"))
+metricas.registrar(metricas.Medidor(
+    "pcp_cache_ratio_aciertos", "Proporción de aciertos de cada caché", ("cache",),
+    lambda: [((nombre,), e["ratio_aciertos"]) for nombre, e in _estadisticas_caches()]))
+metricas.registrar(metricas.Medidor(
+    "pcp_catalogo_filas", "Filas de cada catálogo cargado", ("catalogo",),
+    lambda: [((archivo,), len(e["df"])) for archivo, e in sorted(catalogos.instantanea().entradas.items())]))
+metricas.registrar(metricas.Medidor(
+    "pcp_catalogos_version", "Número de la instantánea de catálogos publicada", (),
+    lambda: [((), catalogos.estadisticas()["version"])]))
+metricas.registrar(metricas.Medidor(
+    "pcp_exportaciones_pendientes", "Exportaciones en segundo plano en cola o generándose en este worker", (),
+    lambda: [((), cola_exportaciones.estadisticas()["pendientes"])]))
+metricas.registrar(metricas.Medidor(
+    "pcp_proceso_info", "Proceso que atendió el pedido de métricas", ("pid",),
+    lambda: [((os.getpid(),), 1)]))
+
+
+@app.route("/metrics")
+def metrics():
+    return app.response_class(metricas.texto(), mimetype="text/plain; version=0.0.4")
+
+
+# Listo para recibir tráfico: todos los catálogos cargados y los índices armados. Responde 503
+# mientras no lo esté. "heredado" indica que el worker recibió la instantánea del master (preload).
+@app.route("/estado/listo")
+def estado_listo():
+    cargados = catalogos.instantanea().entradas
+    faltantes = sorted(archivo for archivo in ESQUEMAS if archivo not in cargados)
+    listo = not faltantes and ARRANQUE["error"] is None
+    return jsonify({
+        "listo": listo,
+        "faltantes": faltantes,
+        "error": ARRANQUE["error"],
+        "pid": os.getpid(),
+        "heredado": os.getpid() != ARRANQUE["pid"],
+        "segundos_arranque": ARRANQUE["segundos"],
+        "segundos_catalogos": ARRANQUE["segundos_catalogos"],
+        "carga_catalogos": catalogos.tiempos_carga,
+        "version": catalogos.instantanea().numero,
+    }), 200 if listo else 503
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,401 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from urllib.parse import urlsplit
+import numpy as np
+import pandas as pd
+import xlsxwriter
+import exportar
+from catalogos import BASE_DIR, CATALOGOS, VERSION_FORMATO, normalizar, hash_archivo, escribir_compilado
+
+
+# ===================================
+# Benchmark de los flujos con catálogos sintéticos
+# ===================================
+# python benchmark.py --factores 1,10,100,1000 --salida benchmark.json
+# python benchmark.py --comparar benchmark.json --salida nuevo.json
+#
+# Para cada factor se arma una copia de materiales/ con factor veces más filas por catálogo
+# (se guarda en --datos y se reutiliza mientras los Excel de origen no cambien). Cada copia
+# adicional repite el catálogo con DIÁMETROS nuevos ("0.875 #3") y, en GENERAL, MATERIALES
+# nuevos; las celdas "TODOS" se conservan, así que la proporción de comodines es la misma.
+#
+# Cada factor se mide en un proceso aparte (app.py importado con MATERIALES_DIR apuntando a
+# la copia): se recorren las sesiones de SESIONES con el cliente de prueba de Flask y se
+# registra la latencia de cada ruta, la de cada etapa interna (metricas.etapa) y, en una
+# pasada extra con tracemalloc, el pico de memoria de cada ruta. El resultado es un JSON
+# que puede compararse con el de otro commit (--comparar).
+
+# Cambia cuando cambia la forma de generar los catálogos (invalida las copias de --datos)
+VERSION_DATOS = 2
+VERSION_RESULTADO = 1
+FACTORES = [1, 10, 100, 1000]
+
+# Material de GENERAL usado por la sesión del flujo H
+MATERIAL_H = "ANCLA TUBING: REUMANN 7501501000  Ø 5\"      X  2.3/8\""
+
+# Pasos de cada sesión: (método, url, formulario). url None es la página a la que redirigió
+# el paso anterior. Antes de cada POST se pide la misma página por GET, como un navegador.
+SESIONES = {
+    "ajuste_y_general": [
+        ("GET", "/flujo_a", None),
+        ("POST", "/flujo_a/decidir", {"ajuste": "SI"}),
+        ("POST", "/flujo_a/seleccion", {"diametros": ["0.875", "1"]}),
+        ("POST", None, {"tipo_0.875": "LISO", "tipo_1": "X-Torque", "acero_0.875": "D4142", "acero_1": "Seleccionar"}),
+        ("GET", None, None),
+        ("POST", "/flujo_h/decidir", {"agregar_material": "SI"}),
+        ("GET", "/api/materiales/buscar?q=ancla+2.3/8&catalogo=general", None),
+        ("POST", "/flujo_h/seleccion", {"materiales": [MATERIAL_H]}),
+        ("POST", None, {f"qty_{MATERIAL_H}": "2"}),
+    ],
+    "tubing": [
+        ("POST", "/flujo_a/decidir", {"ajuste": "NO"}),
+        ("POST", "/flujo_b", {"saca_tubing": "SI"}),
+        ("POST", "/flujo_b/seleccion", {"diametros": ["2 3/8 EU", "2 7/8 EU"]}),
+        ("POST", None, {"qty_2 3/8 EU": "10", "qty_2 7/8 EU": "5"}),
+        ("POST", "/flujo_c/decidir", {"baja_tubing": "SI"}),
+        ("POST", "/flujo_c/seleccion", {"diametros": ['2 7/8"_EU_6.5_J55', "3 1/2 * 2 7/8"]}),
+        ("POST", None, {'tipo_2 7/8"_EU_6.5_J55': ["DESNUDO", "REVESTIDO EXTERIOR"]}),
+        ("POST", None, {"diacsg": '5 1/2"'}),
+        ("POST", None, {'qty_2 7/8"_EU_6.5_J55_DESNUDO': "100", 'qty_2 7/8"_EU_6.5_J55_REVESTIDO EXTERIOR': "20",
+                        "qty_3 1/2 * 2 7/8_TODOS": "3"}),
+        ("POST", "/flujo_d/decidir", {"profundizar": "SI"}),
+        ("POST", "/flujo_d/seleccion", {"valores": ["2 3/8 EU", '2 7/8"_EU']}),
+        ("POST", None, {"qty_2 3/8 EU": "7", 'qty_2 7/8"_EU': "8"}),
+        ("POST", "/flujo_e/decidir", {"baja_varilla": "NO"}),
+        ("POST", "/flujo_f/decidir", {"abandono": "SI"}),
+        ("POST", "/flujo_f/filtros", {"diametros": ["2 3/8 EU", "3 1/2 EU"], "diacsg": '7"'}),
+        ("POST", None, {"qty_2 3/8 EU": "4", "qty_3 1/2 EU": "6"}),
+        ("POST", "/flujo_h/decidir", {"agregar_material": "NO"}),
+    ],
+    "varillas": [
+        ("POST", "/flujo_a/decidir", {"ajuste": "NO"}),
+        ("POST", "/flujo_b", {"saca_tubing": "NO"}),
+        ("POST", "/flujo_c/decidir", {"baja_tubing": "NO"}),
+        ("POST", "/flujo_d/decidir", {"profundizar": "NO"}),
+        ("POST", "/flujo_e/decidir", {"baja_varilla": "SI"}),
+        ("POST", "/flujo_e/seleccion", {"diametros": ["0.875", "1.25"]}),
+        ("POST", None, {"tipo_0.875": ["LISAS", "CENTRALIZADAS"], "acero_0.875": "D4142", "tipo_1.25": []}),
+        ("POST", None, {"qty_0.875": "150", "qty_1.25": "80"}),
+        ("POST", "/flujo_h/decidir", {"agregar_material": "NO"}),
+    ],
+}
+
+
+# ===================================
+# Catálogos sintéticos
+# ===================================
+
+def _es_todos(serie):
+    return serie.astype(str).str.strip().str.upper() == "TODOS"
+
+
+def escalar(df, factor):
+    # La copia 0 es el catálogo original; la copia i agrega " #i" a los valores que definen
+    # la fila (DIÁMETRO o, en GENERAL, MATERIAL) y desplaza el Cód.SAP para no repetirlo
+    columna = "DIÁMETRO" if "DIÁMETRO" in df.columns else "2. MATERIAL"
+    valores = df[columna]
+    fijos = valores.isna() | _es_todos(valores)
+    sap_numerico = pd.api.types.is_numeric_dtype(df["1. Cód.SAP"])
+    copias = [df]
+    for i in range(1, factor):
+        copia = df.copy()
+        copia[columna] = valores.where(fijos, valores.astype(str) + f" #{i}")
+        if sap_numerico:
+            copia["1. Cód.SAP"] = df["1. Cód.SAP"] + i * 10 ** 10
+        else:
+            copia["1. Cód.SAP"] = df["1. Cód.SAP"].astype(str) + f"-{i}"
+        copias.append(copia)
+    return pd.concat(copias, ignore_index=True)
+
+
+def escribir_excel(df, ruta):
+    # constant_memory exige escribir las filas en orden (df.to_excel escribe por columnas y
+    # xlsxwriter descartaría las celdas), así que se escribe fila por fila
+    libro = xlsxwriter.Workbook(ruta, {"constant_memory": True})
+    hoja = libro.add_worksheet()
+    hoja.write_row(0, 0, list(df.columns))
+    for i, fila in enumerate(exportar.filas(None, df, list(df.columns)), 1):
+        hoja.write_row(i, 0, fila)
+    libro.close()
+
+
+def _firma_origen(base_dir, factor):
+    h = hashlib.sha1(repr((VERSION_DATOS, VERSION_FORMATO, factor)).encode("utf-8"))
+    for archivo in sorted(CATALOGOS.values()):
+        h.update(hash_archivo(os.path.join(base_dir, archivo)).encode("ascii"))
+    return h.hexdigest()
+
+
+def generar_catalogos(base_dir, destino, factor, progreso=sys.stderr):
+    # Escribe los Excel escalados y sus compilados (así app.py no tiene que parsear el Excel)
+    marca = os.path.join(destino, "origen.json")
+    firma = _firma_origen(base_dir, factor)
+    try:
+        with open(marca, encoding="utf-8") as f:
+            if json.load(f).get("firma") == firma:
+                return destino
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(destino, ignore_errors=True)
+    os.makedirs(destino)
+    for archivo in CATALOGOS.values():
+        inicio = time.perf_counter()
+        df = escalar(pd.read_excel(os.path.join(base_dir, archivo)), factor)
+        ruta = os.path.join(destino, archivo)
+        escribir_excel(df, ruta)
+        escribir_compilado(destino, archivo, normalizar(df, archivo), hash_archivo(ruta))
+        print(f"  {factor}x {archivo}: {len(df)} filas ({time.perf_counter() - inicio:.1f} s)", file=progreso)
+    with open(marca, "w", encoding="utf-8") as f:
+        json.dump({"firma": firma, "factor": factor}, f)
+    return destino
+
+
+# ===================================
+# Medición (en el proceso de cada factor)
+# ===================================
+
+def _ruta(location):
+    partes = urlsplit(location)
+    return partes.path + ("?" + partes.query if partes.query else "")
+
+
+def percentiles(valores):
+    ms = np.array(valores) * 1000
+    return {
+        "n": len(ms),
+        "media_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+class Medicion:
+    def __init__(self, app, directorio_exportaciones):
+        self.app = app
+        self.adaptador = app.url_map.bind("localhost")
+        self.directorio_exportaciones = directorio_exportaciones
+        self.tiempos = {}
+        self.memoria = {}
+        self.con_memoria = False
+
+    def _etiqueta(self, metodo, ruta):
+        endpoint, _ = self.adaptador.match(urlsplit(ruta).path, method=metodo)
+        return f"{metodo} {endpoint}"
+
+    def _acepta_get(self, ruta):
+        try:
+            self.adaptador.match(urlsplit(ruta).path, method="GET")
+        except Exception:
+            return False
+        return True
+
+    def pedir(self, cliente, metodo, ruta, datos=None, etiqueta=None):
+        etiqueta = etiqueta or self._etiqueta(metodo, ruta)
+        if self.con_memoria:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        inicio = time.perf_counter()
+        respuesta = cliente.open(ruta, method=metodo, data=datos)
+        cuerpo = respuesta.get_data()
+        transcurrido = time.perf_counter() - inicio
+        if self.con_memoria:
+            pico = tracemalloc.get_traced_memory()[1] - base
+            self.memoria[etiqueta] = max(self.memoria.get(etiqueta, 0), pico)
+        else:
+            self.tiempos.setdefault(etiqueta, []).append(transcurrido)
+        if respuesta.status_code not in (200, 302):
+            raise RuntimeError(f"{metodo} {ruta}: {respuesta.status_code} {cuerpo[:200]!r}")
+        return respuesta
+
+    def vaciar_exportaciones(self):
+        for entrada in os.scandir(self.directorio_exportaciones):
+            os.remove(entrada.path)
+
+    def sesion(self, nombre):
+        cliente = self.app.test_client()
+        self.pedir(cliente, "GET", "/")
+        siguiente = None
+        for metodo, ruta, datos in SESIONES[nombre]:
+            ruta = ruta or siguiente
+            if ruta is None:
+                raise RuntimeError(f"Sesión {nombre}: el paso anterior no redirigió")
+            if metodo == "POST" and self._acepta_get(ruta):
+                respuesta = self.pedir(cliente, "GET", ruta)
+                while respuesta.status_code == 302:
+                    ruta = _ruta(respuesta.headers["Location"])
+                    respuesta = self.pedir(cliente, "GET", ruta)
+            respuesta = self.pedir(cliente, metodo, ruta, datos)
+            siguiente = _ruta(respuesta.headers["Location"]) if respuesta.status_code == 302 else None
+        self.pedir(cliente, "GET", "/flujo_final")
+        self.pedir(cliente, "GET", "/api/corrida/resultados/0/filas?pagina=0")
+        # La primera exportación se genera; la segunda sale de la caché en disco
+        self.vaciar_exportaciones()
+        self.pedir(cliente, "GET", "/export_excel")
+        self.pedir(cliente, "GET", "/export_excel", etiqueta="GET export_excel [caché]")
+        self.pedir(cliente, "GET", "/exportar/csv")
+
+
+def medir(datos, repeticiones):
+    temporal = tempfile.mkdtemp(prefix="pcp_benchmark_")
+    exportaciones = os.path.join(temporal, "exportaciones")
+    os.environ.update({
+        "MATERIALES_DIR": datos,
+        "CORRIDAS_DB": os.path.join(temporal, "corridas.sqlite"),
+        "EXPORTACIONES_DIR": exportaciones,
+        "CATALOGOS_INTERVALO": "0",
+    })
+    try:
+        inicio = time.perf_counter()
+        import app as aplicacion
+        import metricas
+        importar = time.perf_counter() - inicio
+        medicion = Medicion(aplicacion.app, exportaciones)
+        # Una vuelta de calentamiento (plantillas, memos) que no se cuenta
+        for nombre in SESIONES:
+            medicion.sesion(nombre)
+        medicion.tiempos = {}
+        metricas.ETAPAS.muestras = []
+        for _ in range(repeticiones):
+            for nombre in SESIONES:
+                medicion.sesion(nombre)
+        muestras, metricas.ETAPAS.muestras = metricas.ETAPAS.muestras, None
+        # Pasada aparte con tracemalloc: su costo no entra en las latencias
+        tracemalloc.start()
+        medicion.con_memoria = True
+        for nombre in SESIONES:
+            medicion.sesion(nombre)
+        tracemalloc.stop()
+
+        etapas = {}
+        for (ruta, nombre), valor in muestras:
+            etapas.setdefault(f"{ruta} {nombre}", []).append(valor)
+        rutas = {}
+        for etiqueta, valores in sorted(medicion.tiempos.items()):
+            rutas[etiqueta] = percentiles(valores)
+            rutas[etiqueta]["memoria_pico_kb"] = round(medicion.memoria.get(etiqueta, 0) / 1024, 1)
+        try:
+            import resource
+            rss_max_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except ImportError:
+            rss_max_kb = None
+        return {
+            "filas": {archivo: len(aplicacion.catalogos.obtener(archivo)) for archivo in CATALOGOS.values()},
+            "arranque": {"importar_s": round(importar, 4), "precalentar_s": aplicacion.ARRANQUE["segundos"]},
+            "rutas": rutas,
+            "etapas": {clave: percentiles(valores) for clave, valores in sorted(etapas.items())},
+            "rss_max_kb": rss_max_kb,
+        }
+    finally:
+        shutil.rmtree(temporal, ignore_errors=True)
+
+
+# ===================================
+# Ejecución y comparación
+# ===================================
+
+def commit_actual():
+    try:
+        salida = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return salida.stdout.strip() or None
+
+
+def correr(factores, repeticiones, datos, base_dir=BASE_DIR, progreso=sys.stderr):
+    resultado = {
+        "version": VERSION_RESULTADO,
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit_actual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "repeticiones": repeticiones,
+        "factores": {},
+    }
+    for factor in factores:
+        print(f"Factor {factor}x: generando catálogos", file=progreso)
+        destino = generar_catalogos(base_dir, os.path.join(datos, f"x{factor}"), factor, progreso)
+        print(f"Factor {factor}x: midiendo {repeticiones} repeticiones", file=progreso)
+        # Un proceso por factor: los catálogos de un factor no se mezclan con los del siguiente
+        # y el pico de RSS es el de ese factor
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            salida = f.name
+        try:
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--medir", str(factor), "--datos", destino,
+                            "--repeticiones", str(repeticiones), "--salida", salida], check=True)
+            with open(salida, encoding="utf-8") as f:
+                resultado["factores"][str(factor)] = json.load(f)
+        finally:
+            os.remove(salida)
+    return resultado
+
+
+def comparar(anterior, actual, umbral, minimo_ms, salida=sys.stdout):
+    # Una regresión es un p50 o p90 que empeora más de umbral (relativo) y más de minimo_ms
+    regresiones = 0
+    for factor, datos in actual["factores"].items():
+        base = anterior.get("factores", {}).get(factor)
+        if base is None:
+            continue
+        print(f"\nFactor {factor}x ({anterior.get('commit')} -> {actual.get('commit')})", file=salida)
+        for grupo in ("rutas", "etapas"):
+            for clave, valores in datos[grupo].items():
+                previo = base.get(grupo, {}).get(clave)
+                if previo is None:
+                    continue
+                for medida in ("p50_ms", "p90_ms"):
+                    antes, ahora = previo[medida], valores[medida]
+                    cambio = (ahora - antes) / antes if antes else 0.0
+                    marca = ""
+                    if cambio > umbral and ahora - antes > minimo_ms:
+                        marca = "  <-- REGRESIÓN"
+                        regresiones += 1
+                    elif cambio < -umbral and antes - ahora > minimo_ms:
+                        marca = "  (mejora)"
+                    if marca or medida == "p50_ms":
+                        print(f"  {clave:<55} {medida} {antes:>10.2f} -> {ahora:>10.2f} ms ({cambio:+.0%}){marca}",
+                              file=salida)
+    return regresiones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mide la latencia y la memoria de cada ruta con catálogos sintéticos")
+    parser.add_argument("--factores", default=",".join(map(str, FACTORES)), help="Factores de escala, separados por coma")
+    parser.add_argument("--repeticiones", type=int, default=10, help="Veces que se recorre cada sesión por factor")
+    parser.add_argument("--datos", default="bench_datos", help="Directorio de los catálogos sintéticos")
+    parser.add_argument("--base-dir", default=BASE_DIR, help="Directorio de los Excel de materiales de origen")
+    parser.add_argument("--salida", default="benchmark.json", help="Archivo JSON con los resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--umbral", type=float, default=0.2, help="Empeoramiento relativo que cuenta como regresión")
+    parser.add_argument("--minimo-ms", type=float, default=1.0, help="Diferencia mínima en ms para contar una regresión")
+    parser.add_argument("--medir", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir is not None:
+        # Proceso hijo: mide un factor sobre catálogos ya generados
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(medir(args.datos, max(1, args.repeticiones)), f)
+        sys.exit(0)
+
+    factores = [int(x) for x in args.factores.split(",") if x.strip()]
+    resultado = correr(factores, max(1, args.repeticiones), args.datos, args.base_dir)
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"Resultados en {args.salida}", file=sys.stderr)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anterior = json.load(f)
+        regresiones = comparar(anterior, resultado, args.umbral, args.minimo_ms)
+        print(f"\n{regresiones} regresiones", file=sys.stderr)
+        sys.exit(1 if regresiones else 0)
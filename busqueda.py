@@ -0,0 +1,127 @@
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+
+
+# ===================================
+# Búsqueda de materiales por texto
+# ===================================
+# Cada catálogo tiene un índice invertido de trigramas sobre Cód.SAP, MATERIAL y Descripción
+# (texto en minúsculas y sin acentos). Una consulta se separa en palabras; las filas candidatas
+# de cada palabra salen de intersecar las listas de sus trigramas, se verifican contra el texto
+# y se ordenan por puntaje. El índice se arma una vez por versión del Excel
+# (catalogos.derivado), igual que los índices de facetas.
+
+CAMPOS = ["1. Cód.SAP", "2. MATERIAL", "3. Descripción"]
+
+# Puntaje de una palabra de la consulta según dónde aparece en la fila
+PUNTAJE_SAP_EXACTO = 100
+PUNTAJE_SAP_PREFIJO = 50
+PUNTAJE_MATERIAL = 10
+PUNTAJE_DESCRIPCION = 5
+PUNTAJE_SUBCADENA = 1
+
+# Tope de consultas memorizadas por índice
+MAX_MEMO = 4096
+
+# Palabras: letras y dígitos, con ".", "/" o "-" internos ("2.3/8", "j-55")
+_PALABRA = re.compile(r"[a-z0-9]+(?:[./-][a-z0-9]+)*")
+
+
+def normalizar_texto(valor):
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return ""
+    texto = unicodedata.normalize("NFKD", str(valor)).encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join(_PALABRA.findall(texto))
+
+
+def palabras(consulta):
+    # Palabras distintas de la consulta, en orden
+    return list(dict.fromkeys(normalizar_texto(consulta).split()))
+
+
+def trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceBusqueda:
+    # Todo se guarda en arreglos NumPy contiguos (textos de ancho fijo y listas de trigramas en
+    # formato CSR) en lugar de muchos objetos Python chicos: con gunicorn en modo preload los
+    # workers comparten estas páginas con el master sin copiarlas (copy-on-write).
+    def __init__(self, df):
+        campos = [df[col] if col in df.columns else pd.Series("", index=df.index) for col in CAMPOS]
+        sap, material, descripcion = ([normalizar_texto(v) for v in serie.tolist()] for serie in campos)
+        textos = [f" {s} {m} {d} " for s, m, d in zip(sap, material, descripcion)]
+        self.sap = np.array(sap, dtype=str)
+        self.material = np.array([" " + texto for texto in material], dtype=str)
+        self.descripcion = np.array([" " + texto for texto in descripcion], dtype=str)
+        # Texto completo de cada fila; el espacio inicial marca el comienzo de cada palabra
+        self.textos = np.array(textos, dtype=str)
+        self.n_filas = len(textos)
+        listas = {}
+        for fila, texto in enumerate(textos):
+            for trigrama in trigramas(texto):
+                listas.setdefault(trigrama, []).append(fila)
+        # Trigramas ordenados; las filas del trigrama i son _filas[_inicios[i]:_inicios[i + 1]]
+        orden = sorted(listas)
+        self._trigramas = np.array(orden, dtype="<U3")
+        self._inicios = np.zeros(len(orden) + 1, dtype=np.int64)
+        np.cumsum([len(listas[t]) for t in orden], out=self._inicios[1:])
+        self._filas = np.array([fila for t in orden for fila in listas[t]], dtype=np.int32)
+        self._memo = {}
+
+    def _lista(self, trigrama):
+        i = int(np.searchsorted(self._trigramas, trigrama))
+        if i == len(self._trigramas) or self._trigramas[i] != trigrama:
+            return None
+        return self._filas[self._inicios[i]:self._inicios[i + 1]]
+
+    def _candidatas(self, palabra):
+        # Palabras de 1 o 2 caracteres se buscan como comienzo de palabra (" ab"); las demás
+        # como subcadena. Una palabra de un carácter no tiene trigramas: se verifica cada fila.
+        patron = " " + palabra if len(palabra) < 3 else palabra
+        filas = None
+        for trigrama in trigramas(patron):
+            lista = self._lista(trigrama)
+            if lista is None:
+                return np.empty(0, dtype=np.int32)
+            filas = lista if filas is None else np.intersect1d(filas, lista, assume_unique=True)
+        if filas is None:
+            filas = np.arange(self.n_filas, dtype=np.int32)
+        return filas[np.char.find(self.textos[filas], patron) >= 0]
+
+    def _puntaje(self, fila, palabra):
+        sap = self.sap[fila]
+        if palabra == sap:
+            return PUNTAJE_SAP_EXACTO
+        if sap.startswith(palabra):
+            return PUNTAJE_SAP_PREFIJO
+        if " " + palabra in self.material[fila]:
+            return PUNTAJE_MATERIAL
+        if " " + palabra in self.descripcion[fila]:
+            return PUNTAJE_DESCRIPCION
+        return PUNTAJE_SUBCADENA
+
+    def buscar(self, consulta):
+        # Devuelve [(puntaje, fila)] de las filas que contienen todas las palabras, mejores primero
+        claves = tuple(palabras(consulta))
+        resultado = self._memo.get(claves)
+        if resultado is not None:
+            return resultado
+        filas = None
+        for palabra in claves:
+            candidatas = self._candidatas(palabra)
+            filas = candidatas if filas is None else np.intersect1d(filas, candidatas, assume_unique=True)
+            if not len(filas):
+                break
+        resultado = []
+        if filas is not None:
+            resultado = sorted(
+                ((sum(self._puntaje(fila, palabra) for palabra in claves), fila) for fila in filas.tolist()),
+                key=lambda par: (-par[0], par[1]),
+            )
+        if len(self._memo) >= MAX_MEMO:
+            self._memo.clear()
+        self._memo[claves] = resultado
+        return resultado
@@ -0,0 +1,242 @@
+import ast
+import numpy as np
+import pandas as pd
+
+
+# ===================================
+# Asignación de cantidades
+# ===================================
+# Las cantidades que ingresa el operador ({clave: cantidad}) se cargan en "4.CANTIDAD" de las
+# filas que no traen una cantidad fija del catálogo. La clave es el valor de una o más columnas
+# (DIÁMETRO; DIÁMETRO, TIPO y DIÁMETRO CSG en el Flujo C; MATERIAL en el H). Las claves se
+# buscan en los valores de cada columna con get_indexer y cada fila toma la cantidad de la
+# primera clave que la alcanza (en el orden de cantidades), en una sola pasada por las filas.
+# Con comodin=True una fila "TODOS" en una columna coincide con cualquier valor de la clave.
+#
+# Fórmulas: un catálogo puede traer la columna "FÓRMULA CANTIDAD". En las filas que la tienen
+# lo ingresado es el dato de la fórmula (p. ej. la profundidad en metros) y la cantidad es el
+# resultado, p. ej. "ceil(cantidad / 9.6)" o "ceil(cantidad / fila['LONGITUD'])". Se admiten
+# números, cantidad, fila["COLUMNA"] (valor numérico de esa columna en la fila), + - * / // % **
+# y las funciones ceil, floor, round, abs, min y max. Cada fórmula distinta se evalúa una sola
+# vez, sobre todas sus filas juntas.
+
+COLUMNA_FORMULA = "FÓRMULA CANTIDAD"
+COMODIN = "TODOS"
+
+def _redondear(valor, decimales=0):
+    # decimales es un número entero escrito en la fórmula (ver _validar), llega como np.float64
+    return np.round(valor, int(decimales))
+
+
+FUNCIONES = {
+    "ceil": np.ceil,
+    "floor": np.floor,
+    "round": _redondear,
+    "abs": np.abs,
+    "min": np.minimum,
+    "max": np.maximum,
+}
+
+# Cantidad de argumentos que acepta cada función
+_ARGUMENTOS = {"ceil": (1,), "floor": (1,), "round": (1, 2), "abs": (1,), "min": (2,), "max": (2,)}
+
+_OPERADORES = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub)
+
+# Tope de fórmulas compiladas memorizadas
+MAX_MEMO = 1024
+
+_compiladas = {}
+
+
+class ErrorFormula(ValueError):
+    pass
+
+
+def _validar(nodo, texto, columnas):
+    if isinstance(nodo, ast.Constant) and type(nodo.value) in (int, float):
+        return
+    if isinstance(nodo, ast.Name) and nodo.id == "cantidad":
+        return
+    if isinstance(nodo, ast.BinOp) and isinstance(nodo.op, _OPERADORES):
+        _validar(nodo.left, texto, columnas)
+        _validar(nodo.right, texto, columnas)
+        return
+    if isinstance(nodo, ast.UnaryOp) and isinstance(nodo.op, _OPERADORES):
+        _validar(nodo.operand, texto, columnas)
+        return
+    if (isinstance(nodo, ast.Call) and isinstance(nodo.func, ast.Name) and nodo.func.id in FUNCIONES
+            and not nodo.keywords and len(nodo.args) in _ARGUMENTOS[nodo.func.id]):
+        if nodo.func.id == "round" and len(nodo.args) == 2 and not (
+                isinstance(nodo.args[1], ast.Constant) and type(nodo.args[1].value) is int and 0 <= nodo.args[1].value <= 15):
+            raise ErrorFormula(f"Fórmula de cantidad no válida: '{texto}' (los decimales de round van de 0 a 15)")
+        for argumento in nodo.args:
+            _validar(argumento, texto, columnas)
+        return
+    if (isinstance(nodo, ast.Subscript) and isinstance(nodo.value, ast.Name) and nodo.value.id == "fila"
+            and isinstance(nodo.slice, ast.Constant) and isinstance(nodo.slice.value, str)):
+        if columnas is not None and nodo.slice.value not in columnas:
+            raise ErrorFormula(f"La fórmula '{texto}' usa una columna que no existe: {nodo.slice.value}")
+        return
+    raise ErrorFormula(f"Fórmula de cantidad no válida: '{texto}'")
+
+
+class _Flotantes(ast.NodeTransformer):
+    # Los números de la fórmula se evalúan como np.float64, igual que cantidad y fila[...]: con
+    # enteros de Python "9 ** 9 ** 9" calcularía un número de millones de dígitos sin soltar el
+    # GIL; en float64 el desborde da inf y la fila queda sin cantidad
+    def visit_Constant(self, nodo):
+        if type(nodo.value) not in (int, float):
+            return nodo
+        return ast.copy_location(
+            ast.Call(func=ast.Name(id="_numero", ctx=ast.Load()), args=[ast.Constant(float(nodo.value))], keywords=[]),
+            nodo,
+        )
+
+
+def compilar(texto, columnas=None):
+    # Verifica la fórmula (y, si se pasan, las columnas que usa) y la compila una sola vez
+    codigo = _compiladas.get(texto)
+    if codigo is not None and columnas is None:
+        return codigo
+    try:
+        arbol = ast.parse(texto.strip(), mode="eval")
+    except SyntaxError:
+        raise ErrorFormula(f"Fórmula de cantidad no válida: '{texto}'")
+    _validar(arbol.body, texto, None if columnas is None else set(columnas))
+    try:
+        arbol = ast.fix_missing_locations(_Flotantes().visit(arbol))
+    except OverflowError:
+        raise ErrorFormula(f"Fórmula de cantidad no válida: '{texto}' (número demasiado grande)")
+    codigo = compile(arbol, "<fórmula>", "eval")
+    if len(_compiladas) >= MAX_MEMO:
+        _compiladas.clear()
+    _compiladas[texto] = codigo
+    return codigo
+
+
+class _Fila:
+    # fila["COLUMNA"] dentro de una fórmula: los valores numéricos de esa columna en sus filas
+    def __init__(self, df, filas):
+        self.df = df
+        self.filas = filas
+
+    def __getitem__(self, columna):
+        if columna not in self.df.columns:
+            raise ErrorFormula(f"La fórmula usa una columna que no existe: {columna}")
+        valores = self.df[columna].iloc[self.filas].astype(object)
+        return pd.to_numeric(valores, errors="coerce").to_numpy(dtype=float)
+
+
+def evaluar(texto, cantidad, df, filas):
+    # cantidad: lo ingresado para cada una de las filas (posiciones en df). Un resultado no
+    # finito (división por cero, columna vacía) deja la fila sin cantidad.
+    entorno = dict(FUNCIONES, cantidad=cantidad, fila=_Fila(df, filas), _numero=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        try:
+            resultado = np.asarray(eval(compilar(texto), {"__builtins__": {}}, entorno), dtype=float)
+        except ErrorFormula:
+            raise
+        except (TypeError, ValueError) as e:
+            raise ErrorFormula(f"No se pudo evaluar la fórmula '{texto}': {e}")
+        resultado = np.broadcast_to(resultado, cantidad.shape)
+        return np.where(np.isfinite(resultado), resultado, np.nan)
+
+
+def _clave_de_cada_fila(df, columnas, claves, comodin):
+    # Posición en claves de la primera clave que alcanza cada fila (-1: ninguna)
+    if len(columnas) == 1 and not comodin:
+        return pd.Index([clave[0] for clave in claves]).get_indexer(df[columnas[0]])
+    coincide = np.ones((len(df), len(claves)), dtype=bool)
+    for j, col in enumerate(columnas):
+        valores = pd.Index(list(dict.fromkeys(clave[j] for clave in claves)))
+        codigos = valores.get_indexer(df[col])
+        coincide_col = codigos[:, None] == valores.get_indexer([clave[j] for clave in claves])[None, :]
+        if comodin:
+            coincide_col |= (df[col] == COMODIN).to_numpy()[:, None]
+        coincide &= coincide_col
+    return np.where(coincide.any(axis=1), coincide.argmax(axis=1), -1)
+
+
+def _aplicar_formulas(df, filas, valores):
+    formulas = df[COLUMNA_FORMULA].to_numpy(dtype=object)[filas]
+    con_formula = pd.notna(formulas)
+    if not con_formula.any():
+        return valores
+    valores = valores.copy()
+    for texto in dict.fromkeys(formulas[con_formula]):
+        grupo = formulas == texto
+        valores[grupo] = evaluar(texto, valores[grupo], df, filas[grupo])
+    return valores
+
+
+def asignar(df, columnas, cantidades, comodin=False, reemplazar_no_positivas=False):
+    # Modifica df (la copia filtrada de cada flujo) y lo devuelve. cantidades = {clave: cantidad},
+    # con la clave como tupla si hay varias columnas; las cantidades vacías no se asignan.
+    # Se completan las filas sin cantidad y, con reemplazar_no_positivas, también las <= 0.
+    claves = [
+        (clave if len(columnas) > 1 else (clave,), cantidad)
+        for clave, cantidad in cantidades.items()
+        if cantidad is not None and not pd.isna(cantidad)
+    ]
+    if not claves or df.empty:
+        return df
+    posiciones = _clave_de_cada_fila(df, columnas, [clave for clave, _ in claves], comodin)
+    actual = df["4.CANTIDAD"]
+    libres = actual.isna()
+    if reemplazar_no_positivas:
+        libres |= actual <= 0
+    destino = (posiciones >= 0) & libres.to_numpy()
+    if not destino.any():
+        return df
+    ingresadas = np.array([cantidad for _, cantidad in claves], dtype=float)
+    valores = ingresadas[posiciones[destino]]
+    if COLUMNA_FORMULA in df.columns:
+        valores = _aplicar_formulas(df, np.flatnonzero(destino), valores)
+    df.loc[destino, "4.CANTIDAD"] = valores
+    return df
+
+
+# ===================================
+# Verificación de las fórmulas (python cantidades.py)
+# ===================================
+# Casos de la lista de lo permitido: fórmula, cantidad ingresada y resultado esperado
+# (ErrorFormula si la fórmula debe rechazarse; NaN si la fila debe quedar sin cantidad).
+CASOS = [
+    ("ceil(cantidad / 9.6)", 1000.0, 105.0),
+    ("round(cantidad / 3, 1)", 10.0, 3.3),
+    ("max(cantidad, 5) - min(cantidad, 5)", 2.0, 3.0),
+    ("-cantidad ** 2 // 3 % 7", 10.0, 1.0),
+    ("cantidad / 0", 10.0, np.nan),
+    # Potencias desbordadas: en float64 terminan enseguida en inf (fila sin cantidad)
+    ("9 ** 9 ** 9", 1.0, np.nan),
+    ("cantidad ** 9 ** 9 ** 9", 2.0, np.nan),
+    ("1" + "0" * 400, 1.0, ErrorFormula),
+    ("__import__('os')", 1.0, ErrorFormula),
+    ("cantidad.real", 1.0, ErrorFormula),
+    ("max(cantidad)", 1.0, ErrorFormula),
+    ("round(cantidad, cantidad)", 1.0, ErrorFormula),
+    ("[cantidad]", 1.0, ErrorFormula),
+    ("cantidad +", 1.0, ErrorFormula),
+]
+
+
+def verificar():
+    errores = 0
+    for texto, cantidad, esperado in CASOS:
+        try:
+            obtenido = evaluar(texto, np.array([cantidad]), None, np.array([0]))[0]
+        except ErrorFormula:
+            obtenido = ErrorFormula
+        if obtenido is ErrorFormula or esperado is ErrorFormula:
+            correcto = obtenido is esperado
+        else:
+            correcto = np.isclose(obtenido, esperado, equal_nan=True)
+        if not correcto:
+            errores += 1
+            print(f"ERROR  {texto}: se esperaba {esperado}, se obtuvo {obtenido}")
+    print(f"{len(CASOS) - errores}/{len(CASOS)} casos correctos")
+    return errores
+
+
+if __name__ == "__main__":
+    raise SystemExit(1 if verificar() else 0)
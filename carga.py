@@ -0,0 +1,328 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit, urlencode
+import pandas as pd
+from benchmark import SESIONES, MATERIAL_H, percentiles, commit_actual
+
+
+# ===================================
+# Prueba de carga con sesiones completas del asistente
+# ===================================
+# python carga.py --usuarios 16 --duracion 60 --workers 4 --threads 2
+# python carga.py --url http://127.0.0.1:8000 --usuarios 8 --sesiones 200
+#
+# Levanta gunicorn (gunicorn.conf.py) en un puerto local con los workers/threads indicados,
+# o usa un servidor ya levantado (--url), y simula --usuarios operadores a la vez. Cada
+# operador repite sesiones completas: inicio → flujos de una sesión de benchmark.SESIONES →
+# flujo H → flujo_final → export_excel, cada una con su propia cookie de corrida.
+#
+# El flujo H de cada sesión lleva una cantidad única (el número de sesión). Al terminar se
+# compara la hoja "Materiales Consolidados" de cada exportación con la de una corrida de
+# referencia del mismo guion: si una sesión recibe filas o cantidades de otra, cuenta como
+# error de aislamiento.
+
+# Pasos de los flujos A-F de cada guion (benchmark.SESIONES sin la parte del flujo H)
+def _pasos_sin_flujo_h(pasos):
+    for i, (_, ruta, _) in enumerate(pasos):
+        if ruta and ruta.startswith(("/flujo_h", "/api/materiales")):
+            return pasos[:i]
+    return list(pasos)
+
+
+def guion(nombre, marca):
+    return _pasos_sin_flujo_h(SESIONES[nombre]) + [
+        ("POST", "/flujo_h/decidir", {"agregar_material": "SI"}),
+        ("GET", "/api/materiales/buscar?q=ancla&catalogo=general", None),
+        ("POST", "/flujo_h/seleccion", {"materiales": [MATERIAL_H]}),
+        ("POST", None, {f"qty_{MATERIAL_H}": str(marca)}),
+    ]
+
+
+class ErrorSesion(Exception):
+    pass
+
+
+def _ruta(location):
+    partes = urlsplit(location)
+    return partes.path + ("?" + partes.query if partes.query else "")
+
+
+# Antes de cada POST se pide la página por GET, como un navegador (salvo las rutas /decidir, que son solo POST)
+def _acepta_get(ruta):
+    return not urlsplit(ruta).path.endswith("/decidir")
+
+
+class Cliente:
+    # Una conexión keep-alive y la cookie de corrida de un operador
+    def __init__(self, host, puerto, tiempos, lock, timeout):
+        self.host = host
+        self.puerto = puerto
+        self.tiempos = tiempos
+        self.lock = lock
+        self.timeout = timeout
+        self.cookies = SimpleCookie()
+        self.conexion = None
+
+    def _conectar(self):
+        self.conexion = http.client.HTTPConnection(self.host, self.puerto, timeout=self.timeout)
+
+    def cerrar(self):
+        if self.conexion is not None:
+            self.conexion.close()
+            self.conexion = None
+
+    def pedir(self, metodo, ruta, datos=None):
+        encabezados = {}
+        cuerpo = None
+        if self.cookies:
+            encabezados["Cookie"] = "; ".join(f"{k}={m.value}" for k, m in self.cookies.items())
+        if datos is not None:
+            cuerpo = urlencode(datos, doseq=True)
+            encabezados["Content-Type"] = "application/x-www-form-urlencoded"
+        etiqueta = f"{metodo} {urlsplit(ruta).path}"
+        inicio = time.perf_counter()
+        for intento in range(2):
+            if self.conexion is None:
+                self._conectar()
+            try:
+                self.conexion.request(metodo, ruta, body=cuerpo, headers=encabezados)
+                respuesta = self.conexion.getresponse()
+                contenido = respuesta.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # El servidor cerró la conexión keep-alive: se reintenta una vez con una nueva
+                self.cerrar()
+                if intento:
+                    raise
+        with self.lock:
+            self.tiempos.setdefault(etiqueta, []).append(time.perf_counter() - inicio)
+        for encabezado in respuesta.headers.get_all("Set-Cookie") or []:
+            self.cookies.load(encabezado)
+        if respuesta.status not in (200, 302):
+            raise ErrorSesion(f"{etiqueta}: HTTP {respuesta.status} {contenido[:200]!r}")
+        return respuesta, contenido
+
+    def sesion(self, pasos):
+        # Devuelve el libro exportado al final de la sesión
+        self.cookies = SimpleCookie()
+        self.pedir("GET", "/")
+        siguiente = None
+        for metodo, ruta, datos in pasos:
+            ruta = ruta or siguiente
+            if ruta is None:
+                raise ErrorSesion("el paso anterior no redirigió")
+            if metodo == "POST" and _acepta_get(ruta):
+                respuesta, _ = self.pedir("GET", ruta)
+                while respuesta.status == 302:
+                    ruta = _ruta(respuesta.headers["Location"])
+                    respuesta, _ = self.pedir("GET", ruta)
+            respuesta, _ = self.pedir(metodo, ruta, datos)
+            siguiente = _ruta(respuesta.headers["Location"]) if respuesta.status == 302 else None
+        self.pedir("GET", "/flujo_final")
+        _, libro = self.pedir("GET", "/export_excel")
+        return libro
+
+
+# ===================================
+# Verificación de las exportaciones
+# ===================================
+
+def materiales(libro):
+    return pd.read_excel(io.BytesIO(libro), sheet_name="Materiales Consolidados")
+
+
+def esperado(referencia, marca):
+    # La referencia se corrió con marca 1: solo cambia la cantidad de la fila del flujo H
+    df = referencia.copy()
+    df.loc[df["Flujo"] == "FLUJO H", "4.CANTIDAD"] = marca
+    return df
+
+
+def verificar(referencias, sesiones):
+    errores = []
+    for nombre, marca, libro in sesiones:
+        try:
+            obtenido = materiales(libro)
+        except Exception as e:
+            errores.append(f"sesión {marca} ({nombre}): exportación ilegible: {e}")
+            continue
+        if obtenido.to_csv(index=False) != esperado(referencias[nombre], marca).to_csv(index=False):
+            errores.append(f"sesión {marca} ({nombre}): la exportación no coincide con la de su guion")
+    return errores
+
+
+# ===================================
+# Servidor y ejecución
+# ===================================
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def levantar_gunicorn(puerto, workers, threads, entorno, espera=120):
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app",
+         "--bind", f"127.0.0.1:{puerto}", "--workers", str(workers), "--threads", str(threads)],
+        cwd=directorio, env={**os.environ, **entorno},
+    )
+    limite = time.monotonic() + espera
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"gunicorn terminó con código {proceso.returncode}")
+        try:
+            conexion = http.client.HTTPConnection("127.0.0.1", puerto, timeout=2)
+            conexion.request("GET", "/estado/listo")
+            if conexion.getresponse().status == 200:
+                return proceso
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError(f"gunicorn no respondió en {espera} s")
+
+
+def correr(host, puerto, usuarios, sesiones, duracion, timeout, progreso=sys.stderr):
+    tiempos = {}
+    lock = threading.Lock()
+    nombres = list(SESIONES)
+
+    # Referencias: un guion de cada tipo, sin concurrencia
+    referencias = {}
+    cliente = Cliente(host, puerto, {}, lock, timeout)
+    for nombre in nombres:
+        referencias[nombre] = materiales(cliente.sesion(guion(nombre, 1)))
+    cliente.cerrar()
+
+    contador = iter(range(2, sys.maxsize))
+    exportaciones = []
+    duraciones = []
+    errores = []
+    fin = time.monotonic() + duracion if duracion else None
+
+    def operador():
+        cliente = Cliente(host, puerto, tiempos, lock, timeout)
+        while True:
+            with lock:
+                marca = next(contador)
+            if sesiones and marca - 2 >= sesiones:
+                break
+            if fin is not None and time.monotonic() >= fin:
+                break
+            nombre = nombres[marca % len(nombres)]
+            inicio = time.perf_counter()
+            try:
+                libro = cliente.sesion(guion(nombre, marca))
+            except Exception as e:
+                cliente.cerrar()
+                with lock:
+                    errores.append(f"sesión {marca} ({nombre}): {e}")
+                continue
+            with lock:
+                duraciones.append(time.perf_counter() - inicio)
+                exportaciones.append((nombre, marca, libro))
+        cliente.cerrar()
+
+    print(f"{usuarios} usuarios contra {host}:{puerto}", file=progreso)
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=operador, daemon=True) for _ in range(usuarios)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    transcurrido = time.perf_counter() - inicio
+
+    aislamiento = verificar(referencias, exportaciones)
+    peticiones = sum(len(v) for v in tiempos.values())
+    return {
+        "usuarios": usuarios,
+        "segundos": round(transcurrido, 3),
+        "sesiones_ok": len(exportaciones) - len(aislamiento),
+        "sesiones_con_error": len(errores),
+        "errores_de_aislamiento": len(aislamiento),
+        "sesiones_por_segundo": round(len(exportaciones) / transcurrido, 3) if transcurrido else 0.0,
+        "peticiones_por_segundo": round(peticiones / transcurrido, 3) if transcurrido else 0.0,
+        "sesion": percentiles(duraciones) if duraciones else None,
+        "rutas": {etiqueta: percentiles(valores) for etiqueta, valores in sorted(tiempos.items())},
+        "errores": (errores + aislamiento)[:50],
+    }
+
+
+def imprimir(resultado, salida=sys.stdout):
+    print(f"\n{resultado['sesiones_ok']} sesiones correctas en {resultado['segundos']} s "
+          f"({resultado['sesiones_por_segundo']} sesiones/s, {resultado['peticiones_por_segundo']} peticiones/s)",
+          file=salida)
+    print(f"{resultado['sesiones_con_error']} con error, {resultado['errores_de_aislamiento']} con datos de otra sesión",
+          file=salida)
+    if resultado["sesion"]:
+        s = resultado["sesion"]
+        print(f"Sesión completa: p50 {s['p50_ms']:.0f} ms, p90 {s['p90_ms']:.0f} ms, "
+              f"p99 {s['p99_ms']:.0f} ms, máx {s['max_ms']:.0f} ms", file=salida)
+    print(f"\n  {'ruta':<40} {'n':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'máx':>9}", file=salida)
+    for etiqueta, r in resultado["rutas"].items():
+        print(f"  {etiqueta:<40} {r['n']:>6} {r['p50_ms']:>9.1f} {r['p90_ms']:>9.1f} "
+              f"{r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}", file=salida)
+    for error in resultado["errores"]:
+        print(f"  ERROR {error}", file=salida)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones completas del asistente")
+    parser.add_argument("--url", help="Servidor ya levantado (si no se indica, se levanta gunicorn)")
+    parser.add_argument("--workers", type=int, default=2, help="Workers de gunicorn")
+    parser.add_argument("--threads", type=int, default=1, help="Threads por worker de gunicorn")
+    parser.add_argument("--usuarios", type=int, default=8, help="Sesiones concurrentes")
+    parser.add_argument("--sesiones", type=int, default=0, help="Sesiones a correr en total (0: sin límite)")
+    parser.add_argument("--duracion", type=float, default=30, help="Segundos de carga (0: sin límite)")
+    parser.add_argument("--datos", help="Directorio de Excel a servir (p. ej. bench_datos/x100 de benchmark.py)")
+    parser.add_argument("--timeout", type=float, default=120, help="Timeout de cada petición, en segundos")
+    parser.add_argument("--salida", help="Archivo JSON con los resultados")
+    args = parser.parse_args()
+    if not args.sesiones and not args.duracion:
+        parser.error("indique --sesiones o --duracion")
+
+    proceso = temporal = None
+    if args.url:
+        partes = urlsplit(args.url)
+        host, puerto = partes.hostname, partes.port or 80
+    else:
+        # Base de corridas y caché de exportaciones propias: la prueba no toca instance/
+        temporal = tempfile.mkdtemp(prefix="pcp_carga_")
+        entorno = {
+            "CORRIDAS_DB": os.path.join(temporal, "corridas.sqlite"),
+            "EXPORTACIONES_DIR": os.path.join(temporal, "exportaciones"),
+        }
+        if args.datos:
+            entorno["MATERIALES_DIR"] = os.path.abspath(args.datos)
+        host, puerto = "127.0.0.1", _puerto_libre()
+        proceso = levantar_gunicorn(puerto, args.workers, args.threads, entorno)
+    try:
+        resultado = correr(host, puerto, max(1, args.usuarios), args.sesiones, args.duracion, args.timeout)
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait()
+        if temporal is not None:
+            shutil.rmtree(temporal, ignore_errors=True)
+    resultado.update({
+        "commit": commit_actual(),
+        "servidor": args.url or f"gunicorn --workers {args.workers} --threads {args.threads}",
+    })
+    imprimir(resultado)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if resultado["sesiones_con_error"] or resultado["errores_de_aislamiento"] else 0)
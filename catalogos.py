@@ -0,0 +1,519 @@
+import os
+import sys
+import time
+import pickle
+import hashlib
+import argparse
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from metricas import etapa, ETAPAS
+import cantidades
+
+# Directorio por defecto de los Excel (el mismo que usa app.py)
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "materiales")
+
+# Los catálogos compilados se guardan junto a los Excel
+DIR_COMPILADOS = "compilados"
+# Se incrementa cuando cambia la normalización, para invalidar los compilados viejos
+VERSION_FORMATO = 4
+
+
+# Nombre corto de cada catálogo (se usa en las URLs de la API)
+CATALOGOS = {
+    "ajuste": "ajuste de medida.xlsx",
+    "saca_tubing": "saca tubing.xlsx",
+    "baja_tubing": "baja tubing.xlsx",
+    "profundiza": "profundiza.xlsx",
+    "baja_varillas": "baja varillas.xlsx",
+    "abandono": "abandono-recupero.xlsx",
+    "general": "GENERAL(1).xlsx",
+}
+
+
+# ===================================
+# Esquema esperado de cada catálogo
+# ===================================
+COLUMNAS_BASE = ["1. Cód.SAP", "2. MATERIAL"]
+
+ESQUEMAS = {
+    "ajuste de medida.xlsx": ["DIÁMETRO", "TIPO"],
+    "saca tubing.xlsx": ["DIÁMETRO", "4.CANTIDAD"],
+    "baja tubing.xlsx": ["DIÁMETRO", "TIPO", "DIÁMETRO CSG", "4.CANTIDAD"],
+    "profundiza.xlsx": ["DIÁMETRO", "4.CANTIDAD"],
+    "baja varillas.xlsx": ["DIÁMETRO", "TIPO", "4.CANTIDAD"],
+    "abandono-recupero.xlsx": ["DIÁMETRO", "DIÁMETRO CSG", "4.CANTIDAD"],
+    "GENERAL(1).xlsx": ["4.CANTIDAD"],
+}
+
+
+class ErrorEsquema(ValueError):
+    pass
+
+
+def validar_esquema(df, archivo):
+    requeridas = COLUMNAS_BASE + ESQUEMAS.get(archivo, [])
+    faltantes = [col for col in requeridas if col not in df.columns]
+    if faltantes:
+        raise ErrorEsquema(f"El catálogo '{archivo}' no tiene las columnas: {', '.join(faltantes)}")
+
+
+# ===================================
+# Normalización de cada catálogo
+# ===================================
+# Se aplica una sola vez al cargar (el resultado queda en el compilado); las rutas y los
+# motores de filtros reciben los valores ya limpios.
+#
+# Las columnas de filtro tienen pocos valores distintos: se guardan como Categorical, con un
+# código entero por fila y cada valor una sola vez. Sus valores son texto sin espacios en los
+# extremos, el comodín se escribe siempre "TODOS" y las celdas vacías o con el texto "nan"
+# quedan como faltantes (NaN), no como "" o "nan".
+
+COLUMNAS_FILTRO = [
+    "DIÁMETRO", "TIPO", "DIÁMETRO CSG",
+    "GRADO DE ACERO", "GRADO DE ACERO CUPLA", "TIPO DE CUPLA",
+    # ajuste de medida.xlsx usa estos nombres en plural
+    "GRADO DE ACERO CUPLAS", "TIPO DE CUPLAS",
+    "5.CONDICIÓN",
+]
+
+# Textos que en el Excel (o al pasar por astype(str)) representan una celda vacía
+VACIOS = {"", "nan", "none", "nat"}
+
+
+def valores_canonicos(serie):
+    texto = serie.astype(str).str.strip()
+    texto = texto.mask(serie.isna() | texto.str.lower().isin(VACIOS))
+    texto = texto.mask(texto.str.upper() == "TODOS", "TODOS")
+    return texto.astype("category")
+
+
+def _limpiar_cantidad(df):
+    df["4.CANTIDAD"] = pd.to_numeric(df["4.CANTIDAD"], errors="coerce")
+    return df
+
+
+# Fórmulas de cantidad (columna opcional, ver cantidades.py): texto sin espacios en los extremos
+# o NaN; una fórmula mal escrita rechaza el catálogo al cargarlo y no al usarlo en un flujo
+def _normalizar_formulas(df, archivo):
+    columna = cantidades.COLUMNA_FORMULA
+    texto = df[columna].astype(str).str.strip()
+    df[columna] = texto.mask(df[columna].isna() | texto.str.lower().isin(VACIOS))
+    for formula in df[columna].dropna().unique():
+        try:
+            cantidades.compilar(formula, df.columns)
+        except cantidades.ErrorFormula as e:
+            raise ErrorEsquema(f"El catálogo '{archivo}' tiene una fórmula inválida: {e}")
+    return df
+
+
+LIMPIEZAS = {
+    "baja varillas.xlsx": _limpiar_cantidad,
+    "GENERAL(1).xlsx": _limpiar_cantidad,
+}
+
+
+def normalizar(df, archivo):
+    df.columns = df.columns.str.strip()
+    validar_esquema(df, archivo)
+    for col in COLUMNAS_FILTRO:
+        if col in df.columns:
+            df[col] = valores_canonicos(df[col])
+    if cantidades.COLUMNA_FORMULA in df.columns:
+        df = _normalizar_formulas(df, archivo)
+    limpiar = LIMPIEZAS.get(archivo)
+    if limpiar is not None:
+        df = limpiar(df)
+    return df
+
+
+# ===================================
+# Catálogos compilados (pickle)
+# ===================================
+# El compilado guarda el DataFrame ya normalizado y el hash del Excel de origen.
+# Si el Excel cambió, el compilado está vencido y se vuelve a leer el Excel.
+# Son dos pickles seguidos: el encabezado ({"version", "sha1"}) y el DataFrame, así que para
+# saber si un compilado está vigente alcanza con leer el encabezado.
+
+def ruta_compilado(base_dir, archivo):
+    return os.path.join(base_dir, DIR_COMPILADOS, archivo + ".pkl")
+
+
+def hash_archivo(ruta):
+    h = hashlib.sha1()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 16), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def escribir_compilado(base_dir, archivo, df, sha1):
+    destino = ruta_compilado(base_dir, archivo)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    temporal = destino + ".tmp"
+    with open(temporal, "wb") as f:
+        pickle.dump({"version": VERSION_FORMATO, "sha1": sha1}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporal, destino)
+
+
+def leer_compilado(base_dir, archivo, sha1, solo_vigencia=False):
+    # Devuelve el DataFrame, o None si no hay compilado vigente. Con solo_vigencia no lee el
+    # DataFrame: devuelve True si el compilado está vigente.
+    origen = ruta_compilado(base_dir, archivo)
+    try:
+        with open(origen, "rb") as f:
+            encabezado = pickle.load(f)
+            if not isinstance(encabezado, dict) or encabezado.get("version") != VERSION_FORMATO or encabezado.get("sha1") != sha1:
+                return None
+            return True if solo_vigencia else pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def leer_excel(ruta):
+    # pandas abre el libro con openpyxl en modo read_only y recorre las filas en streaming,
+    # sin cargar estilos ni el modelo completo de la hoja
+    return normalizar(pd.read_excel(ruta, engine="openpyxl"), os.path.basename(ruta))
+
+
+def cargar_catalogo(base_dir, archivo):
+    # Devuelve (df, origen) donde origen es "compilado" o "xlsx"
+    ruta = os.path.join(base_dir, archivo)
+    sha1 = hash_archivo(ruta)
+    df = leer_compilado(base_dir, archivo, sha1)
+    if df is not None:
+        return df, "compilado"
+    df = leer_excel(ruta)
+    # Se deja el compilado listo para el próximo arranque (si el disco lo permite)
+    try:
+        escribir_compilado(base_dir, archivo, df, sha1)
+    except OSError:
+        pass
+    return df, "xlsx"
+
+
+def parsear_catalogo(base_dir, archivo, sha1):
+    # Corre en un proceso del pool de precargar(): lee el Excel, deja el compilado y devuelve
+    # (df, segundos de parseo)
+    inicio = time.perf_counter()
+    df = leer_excel(os.path.join(base_dir, archivo))
+    try:
+        escribir_compilado(base_dir, archivo, df, sha1)
+    except OSError:
+        pass
+    return df, time.perf_counter() - inicio
+
+
+# ===================================
+# Registro de catálogos en memoria
+# ===================================
+# Cada catálogo se carga una sola vez por proceso (del compilado o del Excel) y se guarda ya limpio.
+# El DataFrame devuelto es compartido: las rutas que lo modifican deben usar .copy()
+#
+# Los catálogos cargados forman una instantánea inmutable ({archivo: entrada}). Cargar o
+# recargar un archivo arma una instantánea nueva y la publica reemplazando la referencia,
+# así quien ya tiene la anterior sigue viéndola completa. Con fijar() una petición queda
+# atada a la instantánea vigente al empezar, aunque otra se publique en el medio.
+#
+# Sin vigilante, cada obtener() compara el mtime y el tamaño del Excel y lo recarga si cambió.
+# Con vigilar(), un hilo revisa materiales/ cada cierto intervalo y recarga fuera de las
+# peticiones, reconstruyendo también los derivados (índices) que tenía la versión anterior.
+
+class Instantanea:
+    def __init__(self, numero, entradas):
+        self.numero = numero
+        self.entradas = entradas
+
+
+def _nueva_entrada(firma, df, origen):
+    return {"firma": firma, "df": df, "origen": origen, "cargado": time.time(),
+            "derivados": {}, "constructores": {}}
+
+
+class RegistroCatalogos:
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self._lock = threading.Lock()
+        self._locks_archivo = {}
+        self._actual = Instantanea(0, {})
+        self._fijada = contextvars.ContextVar(f"instantanea_{id(self)}", default=None)
+        self.aciertos = 0
+        self.fallos = 0
+        # Estado del vigilante
+        self._vigilante = None
+        self._detener = threading.Event()
+        self.intervalo = None
+        self.recargas = 0
+        self.revisiones = 0
+        self.errores_recarga = {}
+        self._pendientes = {}
+        # Segundos de carga de cada archivo en precargar(): {archivo: {"origen", "segundos", "paralelo"}}
+        self.tiempos_carga = {}
+
+    def _firma(self, ruta):
+        st = os.stat(ruta)
+        return (st.st_mtime_ns, st.st_size)
+
+    def instantanea(self):
+        return self._fijada.get() or self._actual
+
+    def fijar(self):
+        # Ata el contexto actual (una petición) a la instantánea vigente; devuelve el token para liberar()
+        return self._fijada.set(self._actual)
+
+    def liberar(self, token):
+        self._fijada.reset(token)
+
+    def _publicar(self, archivo, entrada):
+        # Se llama con self._lock tomado
+        entradas = dict(self._actual.entradas)
+        entradas[archivo] = entrada
+        self._actual = Instantanea(self._actual.numero + 1, entradas)
+
+    def _entrada(self, archivo):
+        ruta = os.path.join(self.base_dir, archivo)
+        entrada = self.instantanea().entradas.get(archivo)
+        vigente = entrada is not None and (self._vigilante is not None or entrada["firma"] == self._firma(ruta))
+        with self._lock:
+            if vigente:
+                self.aciertos += 1
+                return entrada
+            self.fallos += 1
+            lock_archivo = self._locks_archivo.setdefault(archivo, threading.Lock())
+        # Un solo hilo parsea cada archivo; los demás esperan y reutilizan el resultado
+        with lock_archivo:
+            firma = self._firma(ruta)
+            entrada = self._actual.entradas.get(archivo)
+            if entrada is not None and entrada["firma"] == firma:
+                return entrada
+            entrada = self._cargar(archivo, firma)
+            with self._lock:
+                self._publicar(archivo, entrada)
+            return entrada
+
+    # Puntos de extensión del almacenamiento (catalogos_sqlite.CatalogosSQLite los redefine)
+    def _cargar(self, archivo, firma):
+        with etapa("carga_catalogo"):
+            df, origen = cargar_catalogo(self.base_dir, archivo)
+        return self._nueva(archivo, firma, df, origen)
+
+    def _nueva(self, archivo, firma, df, origen):
+        return _nueva_entrada(firma, df, origen)
+
+    def obtener(self, archivo):
+        return self._entrada(archivo)["df"]
+
+    def derivado(self, archivo, clave, construir):
+        # Estructuras derivadas de un catálogo (índices, etc.): se construyen una vez por versión
+        # y se descartan junto con la entrada cuando el Excel cambia
+        entrada = self._entrada(archivo)
+        if clave in entrada["derivados"]:
+            return entrada["derivados"][clave]
+        valor = construir(entrada["df"])
+        with self._lock:
+            entrada["constructores"].setdefault(clave, construir)
+            return entrada["derivados"].setdefault(clave, valor)
+
+    def version(self):
+        # Huella de la instantánea en uso (mtime y tamaño de cada Excel cargado)
+        entradas = self.instantanea().entradas
+        h = hashlib.sha1()
+        for archivo in sorted(ESQUEMAS):
+            entrada = entradas.get(archivo)
+            h.update(repr((archivo, entrada["firma"] if entrada else None)).encode("utf-8"))
+        return h.hexdigest()
+
+    def precargar(self, archivos=None, procesos=None):
+        # Se llama al arrancar: carga los catálogos (desde el compilado si está vigente). Los Excel
+        # sin compilado vigente se parsean a la vez en un pool de hasta `procesos` procesos (por
+        # defecto uno por CPU), así el arranque en frío tarda lo que el libro más lento y no la
+        # suma de todos. Los segundos de cada archivo quedan en self.tiempos_carga.
+        archivos = list(archivos or ESQUEMAS)
+        errores = {}
+        parsear = {}
+        parseados = set()
+        for archivo in archivos:
+            ruta = os.path.join(self.base_dir, archivo)
+            try:
+                firma, sha1 = self._firma(ruta), hash_archivo(ruta)
+            except OSError as e:
+                errores[archivo] = str(e)
+                continue
+            if not leer_compilado(self.base_dir, archivo, sha1, solo_vigencia=True):
+                parsear[archivo] = (firma, sha1)
+        procesos = min(len(parsear), procesos or os.cpu_count() or 1)
+        if procesos > 1:
+            metodos = multiprocessing.get_all_start_methods()
+            contexto = multiprocessing.get_context("fork" if "fork" in metodos else None)
+            with ProcessPoolExecutor(procesos, mp_context=contexto) as pool:
+                futuros = {archivo: pool.submit(parsear_catalogo, self.base_dir, archivo, sha1)
+                           for archivo, (firma, sha1) in parsear.items()}
+                for archivo, futuro in futuros.items():
+                    try:
+                        df, segundos = futuro.result()
+                    except Exception as e:
+                        errores[archivo] = str(e)
+                        continue
+                    ETAPAS.observar(segundos, "-", "carga_catalogo")
+                    entrada = self._nueva(archivo, parsear[archivo][0], df, "xlsx")
+                    with self._lock:
+                        self._publicar(archivo, entrada)
+                    parseados.add(archivo)
+                    self.tiempos_carga[archivo] = {"origen": "xlsx", "segundos": round(segundos, 4), "paralelo": True}
+        for archivo in archivos:
+            if archivo in errores or archivo in parseados:
+                continue
+            inicio = time.perf_counter()
+            try:
+                entrada = self._entrada(archivo)
+            except Exception as e:
+                errores[archivo] = str(e)
+                continue
+            self.tiempos_carga[archivo] = {
+                "origen": entrada["origen"], "segundos": round(time.perf_counter() - inicio, 4), "paralelo": False,
+            }
+        return errores
+
+    # ===================================
+    # Vigilante de materiales/
+    # ===================================
+
+    def vigilar(self, intervalo):
+        # Arranca el hilo que revisa los Excel cada "intervalo" segundos (una vez por proceso)
+        with self._lock:
+            if self._vigilante is not None:
+                return
+            if self.intervalo is None:
+                # Los hilos no sobreviven a un fork: cada proceso hijo (p. ej. un worker de
+                # gunicorn con preload) arranca su propio vigilante sobre la instantánea heredada
+                os.register_at_fork(after_in_child=self._tras_fork)
+            self.intervalo = intervalo
+            self._detener.clear()
+            self._vigilante = threading.Thread(target=self._vigilar, name="vigilante-catalogos", daemon=True)
+        self._vigilante.start()
+
+    def _tras_fork(self):
+        # Los locks pueden haber quedado tomados por un hilo del padre que no existe en el hijo
+        self._lock = threading.Lock()
+        self._locks_archivo = {}
+        self._detener = threading.Event()
+        if self._vigilante is not None:
+            self._vigilante = None
+            self.vigilar(self.intervalo)
+
+    def detener(self):
+        self._detener.set()
+        vigilante, self._vigilante = self._vigilante, None
+        if vigilante is not None:
+            vigilante.join()
+
+    def _vigilar(self):
+        while not self._detener.wait(self.intervalo):
+            try:
+                self.revisar()
+            except Exception as e:
+                self.errores_recarga["*"] = {"firma": None, "error": str(e)}
+
+    def revisar(self):
+        # Una pasada del vigilante. Un Excel se recarga cuando su firma cambió y se mantuvo igual
+        # en dos revisiones seguidas (así no se lee un archivo que se está copiando).
+        self.revisiones += 1
+        recargados = []
+        for archivo, entrada in list(self._actual.entradas.items()):
+            try:
+                firma = self._firma(os.path.join(self.base_dir, archivo))
+            except OSError:
+                continue
+            if firma == entrada["firma"]:
+                self._pendientes.pop(archivo, None)
+                continue
+            if self._pendientes.get(archivo) != firma:
+                self._pendientes[archivo] = firma
+                continue
+            if self.errores_recarga.get(archivo, {}).get("firma") == firma:
+                continue  # Esta versión ya falló: se espera a que el archivo vuelva a cambiar
+            if self._recargar(archivo, firma, entrada):
+                recargados.append(archivo)
+        return recargados
+
+    def _recargar(self, archivo, firma, anterior):
+        try:
+            entrada = self._cargar(archivo, firma)
+            # Los índices que tenía la versión anterior se arman antes de publicar la nueva
+            for clave, construir in list(anterior["constructores"].items()):
+                entrada["derivados"][clave] = construir(entrada["df"])
+                entrada["constructores"][clave] = construir
+        except Exception as e:
+            self.errores_recarga[archivo] = {"firma": firma, "error": str(e)}
+            return False
+        with self._lock_archivo(archivo), self._lock:
+            self._publicar(archivo, entrada)
+            self.recargas += 1
+        self.errores_recarga.pop(archivo, None)
+        self._pendientes.pop(archivo, None)
+        return True
+
+    def _lock_archivo(self, archivo):
+        with self._lock:
+            return self._locks_archivo.setdefault(archivo, threading.Lock())
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            instantanea = self._actual
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "ratio_aciertos": (self.aciertos / total) if total else 0.0,
+                "version": instantanea.numero,
+                "tiempos_carga": dict(self.tiempos_carga),
+                "vigilancia": {
+                    "activa": self._vigilante is not None,
+                    "intervalo": self.intervalo,
+                    "revisiones": self.revisiones,
+                    "recargas": self.recargas,
+                    "errores": dict(self.errores_recarga),
+                },
+                "catalogos": {
+                    archivo: {
+                        "version": f"{e['firma'][0]}-{e['firma'][1]}",
+                        "mtime_ns": e["firma"][0],
+                        "tamaño": e["firma"][1],
+                        "filas": len(e["df"]),
+                        "origen": e["origen"],
+                        "cargado": e["cargado"],
+                        "derivados": len(e["derivados"]),
+                    }
+                    for archivo, e in instantanea.entradas.items()
+                },
+            }
+
+
+# ===================================
+# Compilación: python catalogos.py
+# ===================================
+
+def compilar(base_dir, solo_validar=False):
+    errores = 0
+    for archivo in ESQUEMAS:
+        ruta = os.path.join(base_dir, archivo)
+        try:
+            df = leer_excel(ruta)
+            if not solo_validar:
+                escribir_compilado(base_dir, archivo, df, hash_archivo(ruta))
+            print(f"OK     {archivo}: {len(df)} filas, {len(df.columns)} columnas")
+        except Exception as e:
+            errores += 1
+            print(f"ERROR  {archivo}: {e}", file=sys.stderr)
+    return errores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Valida y compila los catálogos de materiales/")
+    parser.add_argument("--base-dir", default=BASE_DIR, help="Directorio de los Excel")
+    parser.add_argument("--solo-validar", action="store_true", help="Valida los esquemas sin escribir compilados")
+    args = parser.parse_args()
+    sys.exit(1 if compilar(args.base_dir, args.solo_validar) else 0)
@@ -0,0 +1,304 @@
+import json
+import time
+import hashlib
+import sqlite3
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from catalogos import RegistroCatalogos, COLUMNAS_FILTRO, _nueva_entrada
+from facetas import CASCADAS, MAX_MEMO, sin_todos
+from filtros import especificacion_canonica
+
+
+# ===================================
+# Catálogos en SQLite (opcional: CATALOGOS_DB)
+# ===================================
+# En lugar de tener cada catálogo como DataFrame en cada worker, se importa una vez a un SQLite
+# local y las opciones y los resultados de los flujos se resuelven con SQL sobre índices. La
+# memoria ya no depende del tamaño de los catálogos y todos los workers comparten el page cache
+# del sistema operativo.
+#
+# Cada versión de un Excel (su firma mtime-tamaño) es una tabla "c_<hash>" con una columna
+# _fila (la posición de la fila en el Excel) y las columnas del catálogo sin tipo declarado,
+# así los valores vuelven con el mismo tipo con el que se guardaron. La tabla catalogos_sqlite
+# registra archivo, firma, tabla, columnas (con el dtype de pandas) y filas. Se conserva la
+# versión anterior de cada catálogo hasta la siguiente recarga, así una petición atada a ella
+# (RegistroCatalogos.fijar) puede terminar.
+#
+# Índices: uno compuesto sobre la cascada del catálogo (DIÁMETRO, TIPO, DIÁMETRO CSG o
+# DIÁMETRO, TIPO, GRADO DE ACERO, GRADO DE ACERO CUPLA, TIPO DE CUPLA) y uno simple por cada
+# otra columna de filtro y por MATERIAL. El comodín "TODOS" es un valor más del IN.
+#
+# El índice de búsqueda por texto sigue en memoria (busqueda.IndiceBusqueda), armado sólo con
+# las columnas Cód.SAP, MATERIAL y Descripción.
+
+# Columnas con índice simple además de las de filtro
+COLUMNAS_INDICE = ["2. MATERIAL"]
+
+
+def _columna(nombre):
+    return '"' + nombre.replace('"', '""') + '"'
+
+
+def nombre_tabla(archivo, firma):
+    return "c_" + hashlib.sha1(repr((archivo, firma)).encode("utf-8")).hexdigest()[:16]
+
+
+class TablaSQLite:
+    # Una versión importada de un catálogo. Ocupa el lugar del DataFrame en la entrada del
+    # registro: len() da las filas y leer() trae las filas pedidas como DataFrame.
+    def __init__(self, ruta_db, archivo, tabla, columnas, filas):
+        self.ruta_db = ruta_db
+        self.archivo = archivo
+        self.tabla = tabla
+        self.tipos = dict(columnas)
+        self.columnas = [nombre for nombre, _ in columnas]
+        self.filas = filas
+
+    def __len__(self):
+        return self.filas
+
+    @contextmanager
+    def conexion(self):
+        # Una conexión de sólo lectura por consulta: sqlite3 no comparte conexiones entre hilos
+        con = sqlite3.connect(f"file:{self.ruta_db}?mode=ro", uri=True, timeout=30)
+        try:
+            yield con
+        finally:
+            con.close()
+
+    def consultar(self, sql, parametros=()):
+        with self.conexion() as con:
+            return con.execute(sql.replace("{tabla}", _columna(self.tabla)), parametros).fetchall()
+
+    def leer(self, condicion="1", parametros=(), columnas=None):
+        # DataFrame de las filas que cumplen la condición, en el orden del Excel y con los dtypes
+        # del catálogo original (el índice es la posición de la fila, como en df.iloc)
+        columnas = columnas or self.columnas
+        filas = self.consultar(
+            f"SELECT _fila, {', '.join(_columna(col) for col in columnas)} FROM {{tabla}} "
+            f"WHERE {condicion} ORDER BY _fila",
+            parametros,
+        )
+        valores = list(zip(*filas)) if filas else [()] * (len(columnas) + 1)
+        datos = {}
+        for col, columna in zip(columnas, valores[1:]):
+            tipo = self.tipos[col]
+            if tipo in ("object", "category"):
+                # Los vacíos vuelven como NaN, igual que en el DataFrame leído del Excel
+                arreglo = np.array(columna, dtype=object)
+                arreglo[pd.isna(arreglo)] = np.nan
+            else:
+                arreglo = np.array(columna, dtype=tipo)
+            datos[col] = arreglo
+        return pd.DataFrame(datos, columns=columnas, index=pd.Index(valores[0], dtype=np.int64))
+
+
+class MotorSQL:
+    # Misma interfaz que filtros.MotorFiltros, resuelta con SQL. Las posiciones de cada
+    # especificación se memorizan en la misma CacheFiltros.
+    def __init__(self, tabla, cache=None):
+        self.tabla = tabla
+        self.archivo = tabla.archivo
+        self.columnas = tabla.columnas
+        self.n_filas = len(tabla)
+        self.cache = cache
+        self.version = cache.version(tabla.archivo, tabla) if cache is not None else None
+
+    def condicion(self, grupos):
+        # WHERE de una especificación: OR de grupos, cada uno AND de "columna IN (valores)"
+        partes = []
+        parametros = []
+        for grupo in grupos:
+            restricciones = []
+            for col, valores in grupo.items():
+                if col not in self.tabla.tipos:
+                    raise KeyError(col)
+                valores = list(valores)
+                restricciones.append(f"{_columna(col)} IN ({', '.join('?' * len(valores))})" if valores else "0")
+                parametros.extend(valores)
+            partes.append("(" + " AND ".join(restricciones) + ")" if restricciones else "1")
+        return " OR ".join(partes) if partes else "0", parametros
+
+    def _calcular(self, grupos):
+        condicion, parametros = self.condicion(grupos)
+        filas = self.tabla.consultar(f"SELECT _fila FROM {{tabla}} WHERE {condicion} ORDER BY _fila", parametros)
+        return np.array([fila for fila, in filas], dtype=np.intp)
+
+    def filas(self, grupos):
+        grupos = list(grupos)
+        if self.cache is None:
+            return self._calcular(grupos)
+        clave = (self.archivo, self.version, especificacion_canonica(grupos))
+        posiciones = self.cache.obtener(clave)
+        if posiciones is None:
+            posiciones = self._calcular(grupos)
+            posiciones.setflags(write=False)
+            self.cache.guardar(clave, posiciones)
+        return posiciones
+
+    def filtrar(self, grupos):
+        return self.tomar(self.filas(grupos))
+
+    def tomar(self, posiciones):
+        # Filas en esas posiciones (ordenadas), como df.iloc
+        posiciones = [int(p) for p in posiciones]
+        if not posiciones:
+            return self.tabla.leer("0")
+        return self.tabla.leer("_fila IN (SELECT value FROM json_each(?))", (json.dumps(posiciones),))
+
+    def valores(self, col):
+        # Valores distintos no vacíos en orden de aparición, como df[col].dropna().unique()
+        filas = self.tabla.consultar(
+            f"SELECT {_columna(col)} FROM {{tabla}} WHERE {_columna(col)} IS NOT NULL "
+            f"GROUP BY {_columna(col)} ORDER BY MIN(_fila)"
+        )
+        return [valor for valor, in filas]
+
+
+class FacetasSQL:
+    # Misma interfaz que facetas.IndiceFacetas: cada consulta es un SELECT DISTINCT sobre el índice
+    def __init__(self, tabla, cascada):
+        self.tabla = tabla
+        self.columnas = [col for col in cascada if col in tabla.tipos]
+        self._memo = {}
+
+    def tiene(self, columna):
+        return columna in self.columnas
+
+    def opciones(self, columna, filtros=None):
+        filtros = filtros or {}
+        clave = (columna, frozenset((col, frozenset(vals)) for col, vals in filtros.items()))
+        resultado = self._memo.get(clave)
+        if resultado is not None:
+            return resultado
+        subconjunto = [col for col in self.columnas if col in filtros]
+        if len(subconjunto) != len(filtros):
+            raise KeyError(f"Filtros fuera de la cascada: {sorted(set(filtros) - set(subconjunto))}")
+        if columna not in self.columnas:
+            raise KeyError(columna)
+        condiciones = [f"{_columna(columna)} IS NOT NULL"]
+        parametros = []
+        for col in subconjunto:
+            valores = list(filtros[col])
+            condiciones.append(f"{_columna(col)} IN ({', '.join('?' * len(valores))})" if valores else "0")
+            parametros.extend(valores)
+        filas = self.tabla.consultar(
+            f"SELECT DISTINCT {_columna(columna)} FROM {{tabla}} WHERE {' AND '.join(condiciones)}", parametros
+        )
+        resultado = sin_todos(valor for valor, in filas)
+        if len(self._memo) >= MAX_MEMO:
+            self._memo.clear()
+        self._memo[clave] = resultado
+        return resultado
+
+
+class CatalogosSQLite(RegistroCatalogos):
+    # Registro de catálogos cuyas entradas guardan una TablaSQLite en lugar del DataFrame.
+    # Instantáneas, fijar(), el vigilante y las estadísticas son los de RegistroCatalogos.
+    def __init__(self, base_dir, ruta_db):
+        super().__init__(base_dir)
+        self.ruta_db = ruta_db
+        con = sqlite3.connect(ruta_db, timeout=30)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+        finally:
+            con.close()
+        with self._escritura() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS catalogos_sqlite ("
+                " archivo TEXT NOT NULL,"
+                " firma TEXT NOT NULL,"
+                " tabla TEXT NOT NULL,"
+                " columnas TEXT NOT NULL,"
+                " filas INTEGER NOT NULL,"
+                " importado REAL NOT NULL,"
+                " PRIMARY KEY (archivo, firma))"
+            )
+
+    @contextmanager
+    def _escritura(self):
+        # Las importaciones toman el lock al empezar (BEGIN IMMEDIATE): si dos workers ven el
+        # mismo Excel nuevo, el segundo encuentra la tabla ya importada
+        con = sqlite3.connect(self.ruta_db, timeout=60, isolation_level=None)
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+        finally:
+            con.close()
+
+    def _tabla(self, con, archivo, firma):
+        fila = con.execute(
+            "SELECT tabla, columnas, filas FROM catalogos_sqlite WHERE archivo = ? AND firma = ?",
+            (archivo, f"{firma[0]}-{firma[1]}"),
+        ).fetchone()
+        if fila is None:
+            return None
+        tabla, columnas, filas = fila
+        return TablaSQLite(self.ruta_db, archivo, tabla, json.loads(columnas), filas)
+
+    def _cargar(self, archivo, firma):
+        # Si esta versión del Excel ya está importada (otro worker, o un arranque anterior) no se lee
+        con = sqlite3.connect(self.ruta_db, timeout=30)
+        try:
+            tabla = self._tabla(con, archivo, firma)
+        finally:
+            con.close()
+        if tabla is not None:
+            return _nueva_entrada(firma, tabla, "sqlite")
+        return super()._cargar(archivo, firma)
+
+    def _nueva(self, archivo, firma, df, origen):
+        return _nueva_entrada(firma, self._importar(archivo, firma, df), origen)
+
+    def _importar(self, archivo, firma, df):
+        tabla = nombre_tabla(archivo, firma)
+        columnas = [(str(col), str(tipo)) for col, tipo in df.dtypes.items()]
+        with self._escritura() as con:
+            existente = self._tabla(con, archivo, firma)
+            if existente is not None:
+                return existente
+            con.execute(f"DROP TABLE IF EXISTS {_columna(tabla)}")
+            con.execute(
+                f"CREATE TABLE {_columna(tabla)} (_fila INTEGER PRIMARY KEY, "
+                f"{', '.join(_columna(col) for col, _ in columnas)})"
+            )
+            valores = df.astype(object).where(df.notna(), None)
+            con.executemany(
+                f"INSERT INTO {_columna(tabla)} VALUES ({', '.join('?' * (len(columnas) + 1))})",
+                ((i,) + fila for i, fila in enumerate(valores.itertuples(index=False, name=None))),
+            )
+            presentes = [col for col, _ in columnas]
+            cascada = [col for col in CASCADAS.get(archivo, []) if col in presentes]
+            if cascada:
+                con.execute(
+                    f"CREATE INDEX {_columna(tabla + '_cascada')} ON {_columna(tabla)} "
+                    f"({', '.join(_columna(col) for col in cascada)})"
+                )
+            simples = [col for col in COLUMNAS_FILTRO + COLUMNAS_INDICE if col in presentes and col not in cascada[:1]]
+            for i, col in enumerate(simples):
+                con.execute(f"CREATE INDEX {_columna(f'{tabla}_{i}')} ON {_columna(tabla)} ({_columna(col)})")
+            con.execute(
+                "INSERT INTO catalogos_sqlite (archivo, firma, tabla, columnas, filas, importado) VALUES (?, ?, ?, ?, ?, ?)",
+                (archivo, f"{firma[0]}-{firma[1]}", tabla, json.dumps(columnas, ensure_ascii=False), len(df), time.time()),
+            )
+            # Se conservan esta versión y la anterior; las más viejas se borran
+            viejas = con.execute(
+                "SELECT firma, tabla FROM catalogos_sqlite WHERE archivo = ? ORDER BY importado DESC LIMIT -1 OFFSET 2",
+                (archivo,),
+            ).fetchall()
+            for firma_vieja, tabla_vieja in viejas:
+                con.execute(f"DROP TABLE IF EXISTS {_columna(tabla_vieja)}")
+                con.execute("DELETE FROM catalogos_sqlite WHERE archivo = ? AND firma = ?", (archivo, firma_vieja))
+            con.execute("ANALYZE " + _columna(tabla))
+        return TablaSQLite(self.ruta_db, archivo, tabla, columnas, len(df))
+
+    def estadisticas(self):
+        estadisticas = super().estadisticas()
+        estadisticas["almacen"] = {"tipo": "sqlite", "ruta": self.ruta_db}
+        return estadisticas
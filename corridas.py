@@ -0,0 +1,373 @@
+import json
+import math
+import time
+import uuid
+import zlib
+import hashlib
+import pickle
+import secrets
+import sqlite3
+import pandas as pd
+from contextlib import contextmanager
+
+
+# ===================================
+# Almacén de corridas (SQLite)
+# ===================================
+# Cada corrida del asistente tiene un id y su lista de resultados ("FLUJO X", DataFrame).
+# Al vivir en un archivo SQLite local, todos los workers de gunicorn ven las mismas corridas.
+
+# Las corridas sin actividad por más de este tiempo se borran
+VIGENCIA_SEGUNDOS = 7 * 24 * 3600
+# Filas por página de la representación pre-serializada (flujo_final y /api/corrida)
+FILAS_POR_PAGINA = 100
+# La lista de materiales consolidada se guarda como un resultado más, con este orden reservado
+# (los flujos empiezan en 1); iterar, huellas y resumen la excluyen. Se arma recién cuando se
+# pide (asegurar_lista) y agregar la borra al sumar un resultado.
+ORDEN_LISTA = 0
+FLUJO_LISTA = "LISTA DE MATERIALES"
+# Bytes aleatorios de cada token de paso del asistente (8 caracteres en base64 para URL)
+BYTES_TOKEN = 6
+
+
+def _serializar(df):
+    return zlib.compress(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL), 6)
+
+
+def _deserializar(blob):
+    return pickle.loads(zlib.decompress(blob))
+
+
+def huella(df):
+    # Huella del contenido de la tabla (columnas, tipos y valores), independiente de cómo se serializó
+    h = hashlib.sha1()
+    h.update(repr([(str(col), str(tipo)) for col, tipo in df.dtypes.items()]).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def _valor_json(valor):
+    # Valores listos para mostrar: vacíos como null y cantidades enteras sin ".0"
+    if valor is None:
+        return None
+    if isinstance(valor, float):
+        if math.isnan(valor):
+            return None
+        return int(valor) if valor.is_integer() else valor
+    if isinstance(valor, (int, str, bool)):
+        return valor
+    return str(valor)
+
+
+def paginar(df):
+    # Las filas se serializan una vez, al registrar el resultado, en páginas JSON de FILAS_POR_PAGINA
+    filas = [[_valor_json(v) for v in fila] for fila in df.astype(object).values.tolist()]
+    paginas = [
+        json.dumps(filas[i:i + FILAS_POR_PAGINA], ensure_ascii=False)
+        for i in range(0, len(filas), FILAS_POR_PAGINA)
+    ]
+    return [str(col) for col in df.columns], paginas
+
+
+def combinar(estado, delta):
+    # Aplica el delta de un paso sobre el estado acumulado; los diccionarios se combinan por clave
+    # (p. ej. {"filtros": {diam: {"acero": ...}}} agrega el acero sin perder el tipo ya elegido)
+    resultado = dict(estado)
+    for clave, valor in delta.items():
+        if isinstance(valor, dict) and isinstance(resultado.get(clave), dict):
+            valor = combinar(resultado[clave], valor)
+        resultado[clave] = valor
+    return resultado
+
+
+class ResultadosCorrida:
+    # Resultados de una corrida tal como se leyeron: ("FLUJO X", DataFrame) al recorrerlos, un
+    # DataFrame descomprimido por vez. Se pueden recorrer más de una vez y len() no descomprime
+    # nada. lista() devuelve la lista de materiales guardada, o None si no estaba al día.
+    def __init__(self, filas, lista=None):
+        self._filas = filas
+        self._lista = lista
+
+    def __len__(self):
+        return len(self._filas)
+
+    def __iter__(self):
+        return ((flujo, _deserializar(datos)) for flujo, datos in self._filas)
+
+    def lista(self):
+        return None if self._lista is None else _deserializar(self._lista)
+
+
+class AlmacenCorridas:
+    def __init__(self, ruta_db):
+        self.ruta_db = ruta_db
+        # WAL: las lecturas de un worker no bloquean las escrituras de otro
+        con = sqlite3.connect(ruta_db, timeout=30)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+        finally:
+            con.close()
+        with self._conexion() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS corridas ("
+                " id TEXT PRIMARY KEY,"
+                " actualizada REAL NOT NULL)"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS resultados ("
+                " corrida TEXT NOT NULL,"
+                " orden INTEGER NOT NULL,"
+                " flujo TEXT NOT NULL,"
+                " datos BLOB NOT NULL,"
+                " huella TEXT,"
+                " columnas TEXT,"
+                " total INTEGER,"
+                " PRIMARY KEY (corrida, orden))"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS paginas ("
+                " corrida TEXT NOT NULL,"
+                " orden INTEGER NOT NULL,"
+                " pagina INTEGER NOT NULL,"
+                " filas TEXT NOT NULL,"
+                " PRIMARY KEY (corrida, orden, pagina))"
+            )
+            # Pasos del asistente: cada uno guarda solo lo que eligió (delta) y apunta al anterior
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS pasos ("
+                " token TEXT PRIMARY KEY,"
+                " corrida TEXT NOT NULL,"
+                " padre TEXT,"
+                " delta TEXT NOT NULL)"
+            )
+            # Bases creadas antes de guardar la huella y las páginas de cada resultado
+            columnas = [fila[1] for fila in con.execute("PRAGMA table_info(resultados)")]
+            for columna, tipo in (("huella", "TEXT"), ("columnas", "TEXT"), ("total", "INTEGER")):
+                if columna not in columnas:
+                    con.execute(f"ALTER TABLE resultados ADD COLUMN {columna} {tipo}")
+
+    @contextmanager
+    def _conexion(self, escritura=True):
+        # Una conexión por operación: sqlite3 no comparte conexiones entre hilos.
+        # Las escrituras toman el lock al empezar la transacción (BEGIN IMMEDIATE).
+        con = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+        try:
+            con.execute("BEGIN IMMEDIATE" if escritura else "BEGIN")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+        finally:
+            con.close()
+
+    def nueva(self):
+        corrida = uuid.uuid4().hex
+        ahora = time.time()
+        with self._conexion() as con:
+            con.execute("INSERT INTO corridas (id, actualizada) VALUES (?, ?)", (corrida, ahora))
+            self._purgar(con, ahora)
+        return corrida
+
+    def _purgar(self, con, ahora):
+        limite = ahora - VIGENCIA_SEGUNDOS
+        for tabla in ("paginas", "resultados", "pasos"):
+            con.execute(
+                f"DELETE FROM {tabla} WHERE corrida IN (SELECT id FROM corridas WHERE actualizada < ?)",
+                (limite,),
+            )
+        con.execute("DELETE FROM corridas WHERE actualizada < ?", (limite,))
+
+    # ===================================
+    # Estado del asistente entre pasos
+    # ===================================
+    # En lugar de viajar en la URL, lo elegido en cada paso se guarda aquí bajo un token corto
+    # (la URL lleva solo ?estado=<token>). Un paso nuevo no copia el estado: guarda su delta y
+    # el token del paso anterior. Los tokens no se modifican, así que volver atrás en el
+    # navegador y elegir otra cosa abre una rama nueva sin afectar la anterior.
+
+    def guardar_paso(self, corrida, padre, delta):
+        token = secrets.token_urlsafe(BYTES_TOKEN)
+        with self._conexion() as con:
+            con.execute(
+                "INSERT INTO corridas (id, actualizada) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET actualizada = excluded.actualizada",
+                (corrida, time.time()),
+            )
+            con.execute(
+                "INSERT INTO pasos (token, corrida, padre, delta) VALUES (?, ?, ?, ?)",
+                (token, corrida, padre, json.dumps(delta, ensure_ascii=False, separators=(",", ":"))),
+            )
+        return token
+
+    def estado(self, corrida, token):
+        # Estado acumulado hasta el paso "token", o None si el token no es de esta corrida
+        with self._conexion(escritura=False) as con:
+            deltas = con.execute(
+                "WITH RECURSIVE cadena (token, padre, delta, nivel) AS ("
+                " SELECT token, padre, delta, 0 FROM pasos WHERE token = ? AND corrida = ?"
+                " UNION ALL"
+                " SELECT p.token, p.padre, p.delta, c.nivel + 1 FROM pasos p"
+                " JOIN cadena c ON p.token = c.padre AND p.corrida = ?"
+                ") SELECT delta FROM cadena ORDER BY nivel DESC",
+                (token, corrida, corrida),
+            ).fetchall()
+        if not deltas:
+            return None
+        estado = {}
+        for delta, in deltas:
+            estado = combinar(estado, json.loads(delta))
+        return estado
+
+    def _guardar(self, con, corrida, orden, flujo, preparado):
+        # Guarda el resultado (ver _preparar) con su huella y sus filas pre-serializadas;
+        # reemplaza si ya existe
+        datos, firma, columnas, total, paginas = preparado
+        con.execute("DELETE FROM paginas WHERE corrida = ? AND orden = ?", (corrida, orden))
+        con.execute(
+            "INSERT OR REPLACE INTO resultados (corrida, orden, flujo, datos, huella, columnas, total) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (corrida, orden, flujo, datos, firma, columnas, total),
+        )
+        con.executemany(
+            "INSERT INTO paginas (corrida, orden, pagina, filas) VALUES (?, ?, ?, ?)",
+            [(corrida, orden, i, filas) for i, filas in enumerate(paginas)],
+        )
+
+    @staticmethod
+    def _preparar(df):
+        # Compresión, huella y páginas se calculan antes de abrir la transacción de escritura,
+        # para no tener tomado el lock de la base (compartido por todos los workers) mientras tanto
+        columnas, paginas = paginar(df)
+        return _serializar(df), huella(df), json.dumps(columnas, ensure_ascii=False), len(df), paginas
+
+    def agregar(self, corrida, flujo, df):
+        # La lista de materiales guardada deja de estar al día: se borra y se vuelve a armar
+        # cuando alguien la pide (asegurar_lista)
+        preparado = self._preparar(df)
+        with self._conexion() as con:
+            con.execute(
+                "INSERT INTO corridas (id, actualizada) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET actualizada = excluded.actualizada",
+                (corrida, time.time()),
+            )
+            orden, = con.execute(
+                "SELECT COALESCE(MAX(orden), 0) + 1 FROM resultados WHERE corrida = ?", (corrida,)
+            ).fetchone()
+            self._guardar(con, corrida, orden, flujo, preparado)
+            for tabla in ("paginas", "resultados"):
+                con.execute(f"DELETE FROM {tabla} WHERE corrida = ? AND orden = ?", (corrida, ORDEN_LISTA))
+
+    def asegurar_lista(self, corrida, consolidar):
+        # Arma y guarda la lista de materiales (consolidar(resultados) -> DataFrame) si la corrida
+        # no la tiene al día. Se calcula fuera de la transacción de escritura; si mientras tanto
+        # otro worker agregó un resultado, la lista ya quedó vieja y no se guarda.
+        with self._conexion(escritura=False) as con:
+            if con.execute(
+                "SELECT 1 FROM resultados WHERE corrida = ? AND orden = ?", (corrida, ORDEN_LISTA)
+            ).fetchone():
+                return
+            filas = con.execute(
+                "SELECT orden, flujo, datos FROM resultados WHERE corrida = ? AND orden > 0 ORDER BY orden",
+                (corrida,),
+            ).fetchall()
+        if not filas:
+            return
+        preparado = self._preparar(consolidar([(flujo, _deserializar(datos)) for _, flujo, datos in filas]))
+        with self._conexion() as con:
+            ultimo, = con.execute(
+                "SELECT COALESCE(MAX(orden), 0) FROM resultados WHERE corrida = ?", (corrida,)
+            ).fetchone()
+            if ultimo == filas[-1][0]:
+                self._guardar(con, corrida, ORDEN_LISTA, FLUJO_LISTA, preparado)
+
+    def iterar(self, corrida):
+        # Lee los blobs comprimidos en el momento de la llamada (no al consumir: una exportación en
+        # segundo plano ve la corrida como estaba al encolarla); ver ResultadosCorrida
+        with self._conexion(escritura=False) as con:
+            filas = con.execute(
+                "SELECT flujo, datos FROM resultados WHERE corrida = ? AND orden > 0 ORDER BY orden",
+                (corrida,),
+            ).fetchall()
+            lista = con.execute(
+                "SELECT datos FROM resultados WHERE corrida = ? AND orden = ?", (corrida, ORDEN_LISTA)
+            ).fetchone()
+        return ResultadosCorrida(filas, lista[0] if lista else None)
+
+    def resultados(self, corrida):
+        return list(self.iterar(corrida))
+
+    def huellas(self, corrida):
+        # [(flujo, huella)] de la corrida sin leer los DataFrames; los resultados guardados
+        # antes de existir la columna se identifican por el hash de su blob
+        with self._conexion(escritura=False) as con:
+            filas = con.execute(
+                "SELECT flujo, huella, CASE WHEN huella IS NULL THEN datos END "
+                "FROM resultados WHERE corrida = ? AND orden > 0 ORDER BY orden",
+                (corrida,),
+            ).fetchall()
+        return [(flujo, firma or hashlib.sha1(datos).hexdigest()) for flujo, firma, datos in filas]
+
+    def _resultado_sin_paginas(self, con, corrida, orden):
+        # Resultados guardados antes de pre-serializar: se paginan al vuelo desde el blob
+        datos, = con.execute(
+            "SELECT datos FROM resultados WHERE corrida = ? AND orden = ?", (corrida, orden)
+        ).fetchone()
+        return paginar(_deserializar(datos))
+
+    def resumen(self, corrida):
+        # Para cada resultado: flujo, columnas, total de filas y la primera página ya decodificada.
+        # No lee los DataFrames, así que el costo no depende del tamaño de las tablas.
+        return self._resumen(corrida, "r.orden > 0")
+
+    def lista(self, corrida):
+        # Resumen de la lista de materiales consolidada, o None si la corrida no la tiene
+        resumen = self._resumen(corrida, f"r.orden = {ORDEN_LISTA}")
+        return resumen[0] if resumen else None
+
+    def _resumen(self, corrida, condicion):
+        resumen = []
+        with self._conexion(escritura=False) as con:
+            filas = con.execute(
+                "SELECT r.orden, r.flujo, r.columnas, r.total, p.filas FROM resultados r "
+                "LEFT JOIN paginas p ON p.corrida = r.corrida AND p.orden = r.orden AND p.pagina = 0 "
+                f"WHERE r.corrida = ? AND {condicion} ORDER BY r.orden",
+                (corrida,),
+            ).fetchall()
+            for orden, flujo, columnas, total, primera in filas:
+                if columnas is None:
+                    columnas, paginas = self._resultado_sin_paginas(con, corrida, orden)
+                    total, primera = sum(len(json.loads(p)) for p in paginas), (paginas or ["[]"])[0]
+                else:
+                    columnas = json.loads(columnas)
+                resumen.append({
+                    "orden": orden,
+                    "flujo": flujo,
+                    "columnas": columnas,
+                    "total": total,
+                    "paginas": math.ceil(total / FILAS_POR_PAGINA),
+                    "filas": json.loads(primera or "[]"),
+                })
+        return resumen
+
+    def pagina(self, corrida, orden, pagina):
+        # (flujo, columnas, total, filas) con las filas como texto JSON tal cual se guardó, o None
+        with self._conexion(escritura=False) as con:
+            fila = con.execute(
+                "SELECT flujo, columnas, total FROM resultados WHERE corrida = ? AND orden = ?",
+                (corrida, orden),
+            ).fetchone()
+            if fila is None:
+                return None
+            flujo, columnas, total = fila
+            if columnas is None:
+                columnas, paginas = self._resultado_sin_paginas(con, corrida, orden)
+                total = sum(len(json.loads(p)) for p in paginas)
+                filas = paginas[pagina] if 0 <= pagina < len(paginas) else "[]"
+                return flujo, columnas, total, filas
+            filas = con.execute(
+                "SELECT filas FROM paginas WHERE corrida = ? AND orden = ? AND pagina = ?",
+                (corrida, orden, pagina),
+            ).fetchone()
+        return flujo, json.loads(columnas), total, filas[0] if filas else "[]"
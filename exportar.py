@@ -0,0 +1,376 @@
+import io
+import os
+import re
+import csv
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import xlsxwriter
+import flujos
+
+
+# ===================================
+# Exportación de resultados
+# ===================================
+# Los resultados de una corrida son una secuencia de ("FLUJO X", DataFrame). Se recorren
+# de a uno y por bloques de filas, sin armar una tabla combinada en memoria.
+# El libro Excel empieza con la lista de materiales que guarda la corrida (corridas.asegurar_lista);
+# CSV, JSON Lines y Parquet llevan el detalle línea por línea con la columna "Flujo".
+
+# Columnas de la tabla consolidada (renombrar_columnas siempre devuelve un subconjunto, en este orden)
+COLUMNAS = ["Cód.SAP", "MATERIAL", "Descripción", "4.CANTIDAD", "CONDICIÓN", "Flujo"]
+# Filas por bloque al recorrer un DataFrame
+FILAS_POR_BLOQUE = 1000
+# Tamaño de los bloques de texto generados para CSV y JSON Lines
+BLOQUE_TEXTO = 64 * 1024
+# Cambia cuando cambia el contenido de los archivos generados (invalida la caché de exportaciones)
+VERSION_EXPORTACION = 2
+
+FORMATOS = {
+    "xlsx": ("materiales_consolidados.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("materiales_consolidados.csv", "text/csv; charset=utf-8"),
+    "jsonl": ("materiales_consolidados.jsonl", "application/x-ndjson"),
+    "parquet": ("materiales_consolidados.parquet", "application/vnd.apache.parquet"),
+}
+
+
+def filas(flujo, df, columnas=COLUMNAS[:-1]):
+    # Filas del DataFrame como listas de valores Python, con None para los vacíos.
+    # Si se indica un flujo, se agrega al final de cada fila.
+    tabla = df.reindex(columns=columnas)
+    sufijo = [] if flujo is None else [flujo]
+    for inicio in range(0, len(tabla), FILAS_POR_BLOQUE):
+        bloque = tabla.iloc[inicio:inicio + FILAS_POR_BLOQUE].astype(object)
+        for fila in bloque.where(bloque.notna(), None).values.tolist():
+            yield fila + sufijo
+
+
+def _nombre_de_hoja(flujo, usados):
+    # Una hoja por flujo; Excel limita el nombre a 31 caracteres y no admite repetidos
+    nombre, n = flujo[:31], 2
+    while nombre in usados:
+        sufijo = f" ({n})"
+        nombre, n = flujo[:31 - len(sufijo)] + sufijo, n + 1
+    usados.add(nombre)
+    return nombre
+
+
+def _total(resultados):
+    # Cantidad de tablas si la secuencia la conoce sin recorrerse (corridas.ResultadosCorrida)
+    return len(resultados) if hasattr(resultados, "__len__") else None
+
+
+def _avisar(avance, hechas, total):
+    if avance is not None and total:
+        avance(hechas / total)
+
+
+def escribir_xlsx(resultados, destino, avance=None):
+    # constant_memory: xlsxwriter baja cada fila al disco apenas se escribe; las filas de cada
+    # hoja deben ir en orden, pero se puede escribir en varias hojas a la vez. Así los resultados
+    # se recorren una sola vez: cada DataFrame se descomprime, se escribe en la hoja consolidada
+    # y en su propia hoja, y se suelta antes del siguiente.
+    # avance(fracción) se llama al terminar la lista de materiales y cada flujo.
+    total = _total(resultados)
+    libro = xlsxwriter.Workbook(destino, {"constant_memory": True, "nan_inf_to_errors": True})
+    encabezado = libro.add_format({"bold": True})
+    # Primera hoja: lista de materiales (una línea por Cód.SAP / MATERIAL / CONDICIÓN), la que
+    # guardó la corrida; sólo se arma aquí si la secuencia no la trae
+    lista = resultados.lista() if hasattr(resultados, "lista") else None
+    if lista is None:
+        if total is None:
+            resultados = list(resultados)
+            total = len(resultados)
+        lista = flujos.lista_materiales(resultados)
+    hoja_lista = libro.add_worksheet("Lista de Materiales")
+    hoja_lista.write_row(0, 0, flujos.COLUMNAS_LISTA, encabezado)
+    for i, fila in enumerate(filas(None, lista, flujos.COLUMNAS_LISTA), 1):
+        hoja_lista.write_row(i, 0, fila)
+    del lista
+    # Partes del avance: la lista de materiales y cada flujo
+    partes = total + 1 if total is not None else None
+    _avisar(avance, 1, partes)
+    consolidada = libro.add_worksheet("Materiales Consolidados")
+    consolidada.write_row(0, 0, COLUMNAS, encabezado)
+    fila_actual = 1
+    usados = set()
+    for n, (flujo, df) in enumerate(resultados, 2):
+        hoja = libro.add_worksheet(_nombre_de_hoja(flujo, usados))
+        hoja.write_row(0, 0, COLUMNAS[:-1], encabezado)
+        for i, fila in enumerate(filas(flujo, df), 1):
+            consolidada.write_row(fila_actual, 0, fila)
+            hoja.write_row(i, 0, fila[:-1])
+            fila_actual += 1
+        _avisar(avance, n, partes)
+    libro.close()
+
+
+def generar_csv(resultados):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    # BOM para que Excel abra el CSV como UTF-8
+    buffer.write("﻿")
+    escritor.writerow(COLUMNAS)
+    for flujo, df in resultados:
+        for fila in filas(flujo, df):
+            escritor.writerow(["" if v is None else v for v in fila])
+            if buffer.tell() >= BLOQUE_TEXTO:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def generar_jsonl(resultados):
+    for flujo, df in resultados:
+        lineas = []
+        for fila in filas(flujo, df):
+            lineas.append(json.dumps(dict(zip(COLUMNAS, fila)), ensure_ascii=False))
+            if len(lineas) >= FILAS_POR_BLOQUE:
+                yield ("\n".join(lineas) + "\n").encode("utf-8")
+                lineas = []
+        if lineas:
+            yield ("\n".join(lineas) + "\n").encode("utf-8")
+
+
+def _con_avance(resultados, avance):
+    # Recorre los resultados avisando el avance: al pedir una tabla, las anteriores ya se escribieron.
+    # Sin len() (un generador) no hay avance parcial: la secuencia no se copia para contarla.
+    total = _total(resultados)
+    for i, resultado in enumerate(resultados):
+        _avisar(avance, i, total)
+        yield resultado
+
+
+def escribir_parquet(resultados, destino, avance=None):
+    # Parquet es opcional: requiere pyarrow (no está en requirements.txt). Un row group por flujo.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    esquema = pa.schema([(col, pa.float64() if col == "4.CANTIDAD" else pa.string()) for col in COLUMNAS])
+    with pq.ParquetWriter(destino, esquema) as escritor:
+        for flujo, df in _con_avance(resultados, avance):
+            columnas = {col: [] for col in COLUMNAS}
+            for fila in filas(flujo, df):
+                for col, valor in zip(COLUMNAS, fila):
+                    if valor is not None and col != "4.CANTIDAD":
+                        valor = str(valor)
+                    columnas[col].append(valor)
+            escritor.write_table(pa.table(columnas, schema=esquema))
+
+
+def parquet_disponible():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _escribir_generado(generador):
+    def escribir(resultados, destino, avance=None):
+        with open(destino, "wb") as f:
+            for bloque in generador(_con_avance(resultados, avance)):
+                f.write(bloque)
+    return escribir
+
+
+# Cada escritor recibe los resultados, la ruta de destino y, opcionalmente, avance(fracción)
+ESCRITORES = {
+    "xlsx": escribir_xlsx,
+    "csv": _escribir_generado(generar_csv),
+    "jsonl": _escribir_generado(generar_jsonl),
+    "parquet": escribir_parquet,
+}
+
+
+# ===================================
+# Caché de exportaciones en disco
+# ===================================
+# Cada archivo generado se guarda bajo un digest de su contenido de origen: formato, huellas de
+# las tablas de la corrida y versión de los catálogos. El mismo digest sirve de ETag, así que
+# repetir una exportación cuesta una consulta de huellas y, a lo sumo, leer el archivo ya hecho.
+# Al superar el tamaño máximo se borran los archivos usados hace más tiempo (mtime = último uso).
+
+def digest(formato, huellas, version_catalogos):
+    h = hashlib.sha256()
+    h.update(repr((VERSION_EXPORTACION, formato, version_catalogos, list(huellas))).encode("utf-8"))
+    return h.hexdigest()
+
+
+class CacheExportaciones:
+    def __init__(self, directorio, max_bytes):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        os.makedirs(directorio, exist_ok=True)
+
+    def ruta(self, clave, formato):
+        return os.path.join(self.directorio, f"{clave}.{formato}")
+
+    def abrir(self, clave, formato):
+        # Devuelve el archivo ya abierto: si otro worker lo borra después, el descriptor sigue válido
+        ruta = self.ruta(clave, formato)
+        try:
+            f = open(ruta, "rb")
+            os.utime(ruta)
+        except FileNotFoundError:
+            with self._lock:
+                self.fallos += 1
+            return None
+        with self._lock:
+            self.aciertos += 1
+        return f
+
+    def existe(self, clave, formato):
+        return os.path.exists(self.ruta(clave, formato))
+
+    def guardar(self, clave, formato, resultados, avance=None):
+        # Se escribe en un temporal del mismo directorio y se renombra: otro worker nunca
+        # ve un archivo a medio escribir, y si dos generan el mismo digest gana cualquiera
+        ruta = self.ruta(clave, formato)
+        descriptor, temporal = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+        os.close(descriptor)
+        try:
+            ESCRITORES[formato](resultados, temporal, avance)
+            os.replace(temporal, ruta)
+        except BaseException:
+            os.remove(temporal)
+            raise
+        f = open(ruta, "rb")
+        self._recortar(ruta, os.fstat(f.fileno()).st_size)
+        return f
+
+    def _recortar(self, conservar, tamaño_conservado):
+        archivos = []
+        for entrada in os.scandir(self.directorio):
+            if entrada.is_file() and not entrada.name.endswith((".tmp", ".estado")) and entrada.path != conservar:
+                try:
+                    st = entrada.stat()
+                except FileNotFoundError:
+                    continue
+                archivos.append((st.st_mtime, st.st_size, entrada.path))
+        total = sum(tamaño for _, tamaño, _ in archivos) + tamaño_conservado
+        for _, tamaño, ruta in sorted(archivos):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            total -= tamaño
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "ratio_aciertos": (self.aciertos / total) if total else 0.0,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# ===================================
+# Exportaciones en segundo plano
+# ===================================
+# POST /exportar/<formato>/trabajos encola la generación y responde enseguida con el id del
+# trabajo, que es el mismo digest de la caché: dos pedidos de la misma corrida comparten el
+# trabajo y, si el archivo ya existe, no hay nada que encolar. Mientras se genera, el estado
+# queda en "<digest>.<formato>.estado" junto a la caché, así que cualquier worker de gunicorn
+# puede responder la consulta de estado aunque el trabajo corra en otro.
+#
+# Los trabajos corren en un pool acotado de hilos del worker: mientras tanto el worker sigue
+# atendiendo los pasos del asistente. Si hay demasiados trabajos pendientes se rechazan
+# nuevos (503) en lugar de acumularlos.
+
+EN_COLA = "en_cola"
+GENERANDO = "generando"
+LISTO = "listo"
+ERROR = "error"
+
+# Un estado "en curso" sin actualizar por más de este tiempo es de un worker que terminó
+# sin completar el trabajo: se puede volver a encolar
+ESTADO_VENCIDO_SEGUNDOS = 600
+
+# Los ids de trabajo son digests sha256 (también son nombres de archivo: no se acepta otra cosa)
+_ID_TRABAJO = re.compile(r"[0-9a-f]{64}")
+
+
+def id_valido(clave):
+    return bool(_ID_TRABAJO.fullmatch(clave))
+
+
+class ColaExportaciones:
+    def __init__(self, cache, hilos, max_pendientes):
+        self.cache = cache
+        self.max_pendientes = max_pendientes
+        # Los hilos se crean con el primer trabajo: con preload_app el master no llega a tenerlos
+        self._pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="exportar")
+        self._lock = threading.Lock()
+        self._pendientes = set()
+
+    def _ruta_estado(self, clave, formato):
+        return self.cache.ruta(clave, formato) + ".estado"
+
+    def _escribir_estado(self, clave, formato, estado, avance=0.0, error=None):
+        ruta = self._ruta_estado(clave, formato)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"estado": estado, "avance": round(avance, 3), "error": error, "actualizado": time.time()}, f)
+        os.replace(temporal, ruta)
+
+    def estado(self, clave, formato):
+        # {"estado", "avance", "error"} del trabajo, o None si no existe
+        if self.cache.existe(clave, formato):
+            return {"estado": LISTO, "avance": 1.0, "error": None}
+        try:
+            with open(self._ruta_estado(clave, formato), encoding="utf-8") as f:
+                datos = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if datos["estado"] in (EN_COLA, GENERANDO) and time.time() - datos["actualizado"] > ESTADO_VENCIDO_SEGUNDOS:
+            return None
+        return {"estado": datos["estado"], "avance": datos["avance"], "error": datos["error"]}
+
+    def encolar(self, clave, formato, resultados):
+        # resultados() devuelve la secuencia de ("FLUJO X", DataFrame); se llama sólo si hay que
+        # generar el archivo. Devuelve el estado del trabajo, o None si la cola está llena.
+        with self._lock:
+            actual = self.estado(clave, formato)
+            if actual is not None and actual["estado"] != ERROR:
+                return actual
+            if len(self._pendientes) >= self.max_pendientes:
+                return None
+            self._pendientes.add((clave, formato))
+        try:
+            self._escribir_estado(clave, formato, EN_COLA)
+            self._pool.submit(self._generar, clave, formato, resultados())
+        except BaseException:
+            with self._lock:
+                self._pendientes.discard((clave, formato))
+            raise
+        return {"estado": EN_COLA, "avance": 0.0, "error": None}
+
+    def _generar(self, clave, formato, resultados):
+        try:
+            self._escribir_estado(clave, formato, GENERANDO)
+            archivo = self.cache.guardar(
+                clave, formato, resultados,
+                avance=lambda fraccion: self._escribir_estado(clave, formato, GENERANDO, fraccion),
+            )
+            archivo.close()
+            os.remove(self._ruta_estado(clave, formato))
+        except Exception as e:
+            self._escribir_estado(clave, formato, ERROR, error=str(e))
+        finally:
+            with self._lock:
+                self._pendientes.discard((clave, formato))
+
+    def estadisticas(self):
+        with self._lock:
+            return {"pendientes": len(self._pendientes), "max_pendientes": self.max_pendientes}
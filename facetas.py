@@ -0,0 +1,75 @@
+from itertools import combinations, product
+
+
+# Columnas de las cascadas de filtros de cada catálogo
+CASCADA_VARILLAS = ["DIÁMETRO", "TIPO", "GRADO DE ACERO", "GRADO DE ACERO CUPLA", "TIPO DE CUPLA"]
+CASCADA_TUBING = ["DIÁMETRO", "TIPO", "DIÁMETRO CSG"]
+
+# Cascada de cada catálogo (los que no tienen filtros en cascada solo filtran por DIÁMETRO)
+CASCADAS = {
+    "ajuste de medida.xlsx": CASCADA_VARILLAS,
+    "baja varillas.xlsx": CASCADA_VARILLAS,
+    "baja tubing.xlsx": CASCADA_TUBING,
+    "abandono-recupero.xlsx": ["DIÁMETRO", "DIÁMETRO CSG"],
+    "saca tubing.xlsx": ["DIÁMETRO"],
+    "profundiza.xlsx": ["DIÁMETRO"],
+}
+
+# Tope de consultas memorizadas por índice
+MAX_MEMO = 4096
+
+
+def con_todos(valor):
+    # Valores aceptados para una selección: el valor elegido o la fila comodín "TODOS"
+    return (valor, "TODOS")
+
+
+def sin_todos(valores):
+    return sorted(x for x in valores if str(x).upper() != "TODOS")
+
+
+# ===================================
+# Índice de facetas en cascada
+# ===================================
+# Para cada columna de la cascada y cada subconjunto de columnas anteriores se
+# precalcula {valores de las columnas anteriores: valores posibles de la columna}.
+# Una consulta es entonces el producto de los valores aceptados en cada filtro
+# (p. ej. el valor elegido y "TODOS") resuelto con búsquedas en diccionario.
+
+class IndiceFacetas:
+    def __init__(self, df, cascada):
+        self.columnas = [col for col in cascada if col in df.columns]
+        self._tablas = {}
+        self._memo = {}
+        for j, col in enumerate(self.columnas):
+            previas = self.columnas[:j]
+            for r in range(len(previas) + 1):
+                for subconjunto in combinations(previas, r):
+                    tabla = {}
+                    filas = df[list(subconjunto) + [col]].dropna(subset=[col]).drop_duplicates()
+                    for fila in filas.itertuples(index=False, name=None):
+                        tabla.setdefault(fila[:-1], set()).add(fila[-1])
+                    self._tablas[(col, subconjunto)] = tabla
+
+    def tiene(self, columna):
+        return columna in self.columnas
+
+    def opciones(self, columna, filtros=None):
+        # filtros: {columna anterior: valores aceptados}. Devuelve las opciones ordenadas sin "TODOS".
+        filtros = filtros or {}
+        clave = (columna, frozenset((col, frozenset(vals)) for col, vals in filtros.items()))
+        resultado = self._memo.get(clave)
+        if resultado is not None:
+            return resultado
+        subconjunto = tuple(col for col in self.columnas if col in filtros)
+        if len(subconjunto) != len(filtros):
+            raise KeyError(f"Filtros fuera de la cascada: {sorted(set(filtros) - set(subconjunto))}")
+        tabla = self._tablas[(columna, subconjunto)]
+        valores = set()
+        for combo in product(*(filtros[col] for col in subconjunto)):
+            valores.update(tabla.get(combo, ()))
+        resultado = sin_todos(valores)
+        if len(self._memo) >= MAX_MEMO:
+            self._memo.clear()
+        self._memo[clave] = resultado
+        return resultado
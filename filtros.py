@@ -0,0 +1,191 @@
+import itertools
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+# ===================================
+# Motor de filtros con comodín "TODOS"
+# ===================================
+# Una especificación es una lista de grupos; cada grupo es {columna: valores aceptados}.
+# Una fila entra en el resultado si cumple todas las restricciones de algún grupo
+# (un grupo vacío acepta todas las filas). El comodín se expresa incluyendo "TODOS"
+# entre los valores aceptados (ver facetas.con_todos).
+#
+# Cada columna se codifica una vez como enteros (0 = vacío); las columnas de filtro ya vienen
+# como Categorical (catalogos.normalizar) y se usan sus códigos. Para las columnas de una
+# consulta se precalculan las combinaciones distintas de códigos, así cada grupo se
+# evalúa sobre esas combinaciones y no sobre todas las filas; al final una sola pasada
+# por las filas devuelve las posiciones, ordenadas y sin duplicados.
+#
+# Las posiciones de cada especificación se memorizan en una CacheFiltros compartida por todos
+# los catálogos, bajo (catálogo, versión del catálogo, especificación canónica).
+
+# Tope de memoria de la caché de filtros (app.py lo toma de FILTROS_CACHE_MB)
+MAX_BYTES_CACHE = 64 * 1024 * 1024
+
+# Costo aproximado de una entrada además de las posiciones (clave, tupla y arreglo vacío)
+BYTES_POR_ENTRADA = 512
+
+# Número de versión de cada DataFrame de catálogo que pasa por la caché
+_versiones = itertools.count(1)
+
+
+def especificacion_canonica(grupos):
+    # Misma clave para especificaciones equivalentes: el orden de los grupos, de las columnas y
+    # de los valores no cambia el resultado, y tampoco los valores o grupos repetidos
+    return tuple(sorted({
+        tuple(sorted((col, tuple(sorted(set(valores), key=repr))) for col, valores in grupo.items()))
+        for grupo in grupos
+    }, key=repr))
+
+
+class CacheFiltros:
+    # LRU de posiciones ya calculadas con tope de memoria. Cuando se arma el motor de una versión
+    # nueva de un catálogo se descartan las entradas de las versiones anteriores.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._vigentes = {}
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.descartes = 0
+
+    def _quitar(self, clave):
+        # Se llama con self._lock tomado
+        self.bytes -= self._entradas.pop(clave).nbytes + BYTES_POR_ENTRADA
+        self.descartes += 1
+
+    def version(self, archivo, df):
+        # Versión vigente del catálogo. Un DataFrame nuevo (el Excel cambió) es una versión nueva
+        # y descarta las entradas de las anteriores; dos motores armados a la vez sobre el mismo
+        # DataFrame comparten la versión.
+        with self._lock:
+            vigente = self._vigentes.get(archivo)
+            if vigente is not None and vigente[0] is df:
+                return vigente[1]
+            version = next(_versiones)
+            self._vigentes[archivo] = (df, version)
+            for clave in [c for c in self._entradas if c[0] == archivo]:
+                self._quitar(clave)
+            return version
+
+    def obtener(self, clave):
+        with self._lock:
+            posiciones = self._entradas.get(clave)
+            if posiciones is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return posiciones
+
+    def guardar(self, clave, posiciones):
+        tamaño = posiciones.nbytes + BYTES_POR_ENTRADA
+        with self._lock:
+            # Una petición atada a una versión ya reemplazada no vuelve a llenar la caché
+            vigente = self._vigentes.get(clave[0])
+            if tamaño > self.max_bytes or vigente is None or vigente[1] != clave[1] or clave in self._entradas:
+                return
+            self._entradas[clave] = posiciones
+            self.bytes += tamaño
+            while self.bytes > self.max_bytes:
+                self._quitar(next(iter(self._entradas)))
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "ratio_aciertos": (self.aciertos / total) if total else 0.0,
+                "entradas": len(self._entradas),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "descartes": self.descartes,
+            }
+
+
+class MotorFiltros:
+    def __init__(self, df, archivo=None, cache=None):
+        self.df = df
+        self.columnas = list(df.columns)
+        self.n_filas = len(df)
+        self._lock = threading.Lock()
+        self._codigos = {}
+        self._combinaciones = {}
+        self.archivo = archivo
+        self.cache = cache
+        self.version = cache.version(archivo, df) if cache is not None else None
+
+    def codificar(self, col):
+        codificada = self._codigos.get(col)
+        if codificada is None:
+            serie = self.df[col]
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                codigos, valores = serie.cat.codes.to_numpy(), serie.cat.categories
+            else:
+                codigos, valores = pd.factorize(serie)
+            mapa = {valor: i + 1 for i, valor in enumerate(valores)}
+            codificada = (codigos.astype(np.int32) + 1, mapa)
+            with self._lock:
+                codificada = self._codigos.setdefault(col, codificada)
+        return codificada
+
+    def _combinaciones_de(self, columnas):
+        combinadas = self._combinaciones.get(columnas)
+        if combinadas is None:
+            matriz = np.column_stack([self.codificar(col)[0] for col in columnas])
+            combos, inversa = np.unique(matriz, axis=0, return_inverse=True)
+            combinadas = (combos, inversa.reshape(-1))
+            with self._lock:
+                combinadas = self._combinaciones.setdefault(columnas, combinadas)
+        return combinadas
+
+    def _aceptados(self, col, valores):
+        mapa = self.codificar(col)[1]
+        tabla = np.zeros(len(mapa) + 1, dtype=bool)
+        tabla[[mapa[v] for v in valores if v in mapa]] = True
+        return tabla
+
+    def filas(self, grupos):
+        # Devuelve las posiciones (iloc) de las filas que cumplen la especificación.
+        # El arreglo puede venir de la caché: es de sólo lectura.
+        grupos = list(grupos)
+        if self.cache is None:
+            return self._calcular(grupos)
+        clave = (self.archivo, self.version, especificacion_canonica(grupos))
+        posiciones = self.cache.obtener(clave)
+        if posiciones is None:
+            posiciones = self._calcular(grupos)
+            posiciones.setflags(write=False)
+            self.cache.guardar(clave, posiciones)
+        return posiciones
+
+    def _calcular(self, grupos):
+        columnas = tuple(sorted({col for grupo in grupos for col in grupo}))
+        if not grupos:
+            return np.empty(0, dtype=np.intp)
+        if not columnas:
+            return np.arange(self.n_filas)
+        combos, inversa = self._combinaciones_de(columnas)
+        aceptadas = np.zeros(len(combos), dtype=bool)
+        for grupo in grupos:
+            cumple = np.ones(len(combos), dtype=bool)
+            for col, valores in grupo.items():
+                cumple &= self._aceptados(col, valores)[combos[:, columnas.index(col)]]
+            aceptadas |= cumple
+        return np.flatnonzero(aceptadas[inversa])
+
+    def filtrar(self, grupos):
+        return self.df.iloc[self.filas(grupos)]
+
+    def tomar(self, posiciones):
+        return self.df.iloc[posiciones]
+
+    def valores(self, col):
+        # Valores distintos no vacíos en orden de aparición
+        return list(self.df[col].dropna().unique())
@@ -0,0 +1,434 @@
+import json
+import pandas as pd
+from facetas import IndiceFacetas, CASCADAS, con_todos
+from filtros import MotorFiltros, CacheFiltros, MAX_BYTES_CACHE
+from busqueda import IndiceBusqueda, CAMPOS
+from catalogos import CATALOGOS
+from catalogos_sqlite import TablaSQLite, MotorSQL, FacetasSQL
+from metricas import etapa
+from cantidades import asignar
+
+
+# ===================================
+# Lógica de resultado de cada flujo
+# ===================================
+# Funciones sin Flask: las usan las rutas del asistente y el cálculo por lotes.
+# Reciben el registro de catálogos y las selecciones, y devuelven el DataFrame renombrado.
+
+# Función auxiliar para renombrar columnas
+def renombrar_columnas(df):
+    df_renombrado = df.rename(
+        columns={
+            "1. Cód.SAP": "Cód.SAP",
+            "2. MATERIAL": "MATERIAL",
+            "3. Descripción": "Descripción",
+            "5.CONDICIÓN": "CONDICIÓN"
+        }
+    )
+    columnas = ["Cód.SAP", "MATERIAL", "Descripción", "4.CANTIDAD", "CONDICIÓN"]
+    columnas_presentes = [col for col in columnas if col in df_renombrado.columns]
+    resultado = df_renombrado[columnas_presentes]
+    # Los resultados salen sin Categoricals: se concatenan y agrupan con los de otros catálogos
+    categoricas = {col: object for col in columnas_presentes if isinstance(resultado[col].dtype, pd.CategoricalDtype)}
+    return resultado.astype(categoricas) if categoricas else resultado
+
+
+# Índice de facetas de un catálogo (se construye una vez por versión del Excel).
+# Con CatalogosSQLite el catálogo es una TablaSQLite y las opciones se consultan con SQL.
+def _facetas(fuente, cascada):
+    if isinstance(fuente, TablaSQLite):
+        return FacetasSQL(fuente, cascada)
+    return IndiceFacetas(fuente, cascada)
+
+
+def indice_facetas(catalogos, archivo, cascada):
+    return catalogos.derivado(archivo, ("facetas", tuple(cascada)), lambda fuente: _facetas(fuente, cascada))
+
+
+# Posiciones de filtros ya resueltos, compartidas por los motores de todos los catálogos
+cache_filtros = CacheFiltros(MAX_BYTES_CACHE)
+
+
+# Motor de filtros de un catálogo (códigos enteros por columna, una vez por versión del Excel)
+def _motor(fuente, archivo):
+    if isinstance(fuente, TablaSQLite):
+        return MotorSQL(fuente, cache_filtros)
+    return MotorFiltros(fuente, archivo, cache_filtros)
+
+
+def motor_filtros(catalogos, archivo):
+    return catalogos.derivado(archivo, "motor_filtros", lambda fuente: _motor(fuente, archivo))
+
+
+# Índice de búsqueda por texto de un catálogo (una vez por versión del Excel); de una
+# TablaSQLite se leen sólo las columnas que indexa
+def _busqueda(fuente):
+    if isinstance(fuente, TablaSQLite):
+        return IndiceBusqueda(fuente.leer(columnas=[col for col in CAMPOS if col in fuente.tipos]))
+    return IndiceBusqueda(fuente)
+
+
+def indice_busqueda(catalogos, archivo):
+    return catalogos.derivado(archivo, "busqueda", _busqueda)
+
+
+# Busca en varios catálogos y devuelve [(puntaje, archivo, fila)], mejores primero.
+# Con igual puntaje se respeta el orden de los catálogos y de las filas.
+def buscar_materiales(catalogos, consulta, archivos):
+    encontrados = []
+    for archivo in archivos:
+        encontrados.extend((puntaje, archivo, fila) for puntaje, fila in indice_busqueda(catalogos, archivo).buscar(consulta))
+    encontrados.sort(key=lambda e: -e[0])
+    return encontrados
+
+
+# Filtros del Flujo A para un DIÁMETRO, con las columnas anteriores a "columna" (None: todas).
+# TIPO no filtra si es "TODOS"; los grados y el tipo de cupla no filtran si son "Seleccionar".
+def filtros_flujo_a(diam, seleccion, columna):
+    pasos = [
+        ("TIPO", "tipo", "TODOS"),
+        ("GRADO DE ACERO", "acero", "Seleccionar"),
+        ("GRADO DE ACERO CUPLA", "acero_cup", "Seleccionar"),
+        ("TIPO DE CUPLA", "tipo_cup", "Seleccionar"),
+    ]
+    filtros = {"DIÁMETRO": con_todos(diam)}
+    for col, clave, sin_filtro in pasos:
+        if col == columna:
+            break
+        valor = seleccion.get(clave, sin_filtro)
+        if valor != sin_filtro:
+            filtros[col] = con_todos(valor)
+    return filtros
+
+
+# Filtros del Flujo E para un DIÁMETRO a partir de lo elegido en el formulario.
+# Una lista vacía indica que no se filtra por esa columna.
+def filtros_flujo_e(tipos, acero, acero_cup, tipo_cup):
+    def lista(valor):
+        return [valor, "TODOS"] if valor and valor != "Seleccionar" else []
+    return {
+        "tipo_list": list(tipos) + ["TODOS"] if tipos else [],
+        "acero_list": lista(acero),
+        "acero_cup_list": lista(acero_cup),
+        "tipo_cup_list": lista(tipo_cup),
+    }
+
+
+# Construye de antemano los motores de filtros de los catálogos con cascada
+# (útil antes de un fork, para que los procesos hijos los compartan)
+def precalentar(catalogos):
+    # Arma de antemano lo que usan las rutas: códigos de los motores de filtros, índices de
+    # facetas y de búsqueda. En gunicorn con preload corre en el master, antes del fork.
+    for archivo, cascada in CASCADAS.items():
+        motor = motor_filtros(catalogos, archivo)
+        if isinstance(motor, MotorFiltros):
+            for col in cascada:
+                if col in motor.columnas:
+                    motor.codificar(col)
+        indice_facetas(catalogos, archivo, cascada)
+    for archivo in CATALOGOS.values():
+        indice_busqueda(catalogos, archivo)
+
+
+# Flujo A: ajuste de medida. filtros = {diam: {"tipo", "acero", "acero_cup", "tipo_cup"}}
+def resultado_flujo_a(catalogos, diametros, filtros):
+    motor = motor_filtros(catalogos, "ajuste de medida.xlsx")
+    # Un grupo de filtros por cada DIÁMETRO; el resultado es la unión de los grupos
+    grupos = [filtros_flujo_a(diam, filtros.get(diam, {}), None) for diam in diametros]
+    with etapa("filtro"):
+        return renombrar_columnas(motor.filtrar(grupos))
+
+
+# Flujo B: saca tubing. cantidades = {diam: cantidad}
+def resultado_flujo_b(catalogos, cantidades):
+    motor = motor_filtros(catalogos, "saca tubing.xlsx")
+    with etapa("filtro"):
+        df_filtered = motor.filtrar([{"DIÁMETRO": list(cantidades) + ["TODOS"]}]).copy()
+    with etapa("cantidades"):
+        asignar(df_filtered, ["DIÁMETRO"], cantidades)
+    return renombrar_columnas(df_filtered)
+
+
+# Flujo C: baja tubing. tipos = {diam: [tipos]}, cantidades = {(diam, tipo): cantidad}
+def resultado_flujo_c(catalogos, tipos, diacsg, cantidades):
+    motor = motor_filtros(catalogos, "baja tubing.xlsx")
+    grupos = [
+        {"DIÁMETRO": con_todos(diam_value), "TIPO": con_todos(tipo_val), "DIÁMETRO CSG": con_todos(diacsg)}
+        for diam_value, fdict in tipos.items()
+        for tipo_val in fdict
+    ]
+    # Copia: las cantidades se asignan sobre las filas filtradas
+    with etapa("filtro"):
+        df = motor.filtrar(grupos).copy()
+    # Cada cantidad alcanza a las filas de su DIÁMETRO, TIPO y DIÁMETRO CSG o con "TODOS"
+    with etapa("cantidades"):
+        por_clave = {(diam, tipo, diacsg): qty for (diam, tipo), qty in cantidades.items()}
+        asignar(df, ["DIÁMETRO", "TIPO", "DIÁMETRO CSG"], por_clave, comodin=True)
+    return renombrar_columnas(df)
+
+
+# Flujo D: profundiza. cantidades = {valor de la columna col: cantidad}
+def resultado_flujo_d(catalogos, col, cantidades):
+    motor = motor_filtros(catalogos, "profundiza.xlsx")
+    # Filtrar el DataFrame según la columna y los valores seleccionados
+    with etapa("filtro"):
+        filtered_df = motor.filtrar([{col: list(cantidades)}]).copy()
+    with etapa("cantidades"):
+        asignar(filtered_df, [col], cantidades)
+    return renombrar_columnas(filtered_df)
+
+
+# Flujo E: baja varillas. filtros = {diam: filtros_flujo_e(...)}, cantidades = {diam: cantidad}
+def resultado_flujo_e(catalogos, diametros, filtros, cantidades):
+    motor = motor_filtros(catalogos, "baja varillas.xlsx")
+    # Aplicar los filtros adicionales de cada DIÁMETRO (las filas "TODOS" aparecen una sola vez)
+    grupos = []
+    for diam in diametros:
+        # Aquí se incluye el valor "TODOS" junto con el diámetro seleccionado
+        grupo = {"DIÁMETRO": con_todos(diam)}
+        filtros_diam = filtros.get(diam, {})
+        for col, clave in (("TIPO", "tipo_list"),
+                           ("GRADO DE ACERO", "acero_list"),
+                           ("GRADO DE ACERO CUPLA", "acero_cup_list"),
+                           ("TIPO DE CUPLA", "tipo_cup_list")):
+            if col in motor.columnas and filtros_diam.get(clave):
+                grupo[col] = filtros_diam[clave]
+        grupos.append(grupo)
+    # Copia: las cantidades se asignan sobre este DataFrame
+    with etapa("filtro"):
+        filtered_df = motor.filtrar(grupos).copy()
+    # Actualizar la columna "4.CANTIDAD" donde la celda es NaN
+    with etapa("cantidades"):
+        asignar(filtered_df, ["DIÁMETRO"], cantidades)
+    return renombrar_columnas(filtered_df)
+
+
+# Flujo F: abandono/recupero. diametros incluye "TODOS"; cantidades = {diam: cantidad}
+def resultado_flujo_f(catalogos, diametros, cantidades):
+    motor = motor_filtros(catalogos, "abandono-recupero.xlsx")
+    with etapa("filtro"):
+        filtered_df = motor.filtrar([{"DIÁMETRO": list(diametros)}]).copy()
+    with etapa("cantidades"):
+        asignar(filtered_df, ["DIÁMETRO"], cantidades)
+    return renombrar_columnas(filtered_df)
+
+
+# Flujo H: material de agregación. cantidades = {material: cantidad}
+# Devuelve None si ningún material quedó con cantidad mayor que 0.
+def resultado_flujo_h(catalogos, cantidades):
+    seleccionados = list(cantidades)
+    # Copia: las cantidades se asignan sobre las filas de los materiales seleccionados
+    with etapa("filtro"):
+        df_H = motor_filtros(catalogos, "GENERAL(1).xlsx").filtrar([{"2. MATERIAL": seleccionados}]).copy()
+    # Cada material seleccionado toma su cantidad en las filas sin valor o con valor <= 0
+    with etapa("cantidades"):
+        asignar(df_H, ["2. MATERIAL"], cantidades, reemplazar_no_positivas=True)
+    # Filtramos solo los materiales con cantidad mayor que 0
+    with etapa("filtro"):
+        assigned_df = df_H[df_H["2. MATERIAL"].astype(str).isin(seleccionados) & (df_H["4.CANTIDAD"] > 0)]
+    if assigned_df.empty:
+        return None
+    return renombrar_columnas(assigned_df)
+
+
+# ===================================
+# Intervenciones completas (por lotes)
+# ===================================
+# Una intervención describe las elecciones de un pozo, con una sección por flujo:
+#   {"pozo": "...",
+#    "A": {"diametros": [...], "filtros": {diam: {"tipo", "acero", "acero_cup", "tipo_cup"}}},
+#    "B": {"cantidades": {diam: cantidad}},
+#    "C": {"tipos": {diam: [tipos]}, "diacsg": "TODOS", "cantidades": {diam: {tipo: cantidad}}},
+#    "D": {"columna": "DIÁMETRO", "cantidades": {valor: cantidad}},
+#    "E": {"diametros": {diam: {"tipos": [...], "acero", "acero_cup", "tipo_cup"}}, "cantidades": {diam: cantidad}},
+#    "F": {"diametros": [...], "cantidades": {diam: cantidad}},
+#    "H": {"cantidades": {material: cantidad}}}
+# Se respetan los caminos del asistente: el Flujo A salta de B a F, y E y F son excluyentes.
+
+FLUJOS = "ABCDEFH"
+
+
+class ErrorIntervencion(ValueError):
+    pass
+
+
+def _cantidad(valor):
+    # Igual que request.form.get(..., type=float): None si no es un número
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _seccion(intervencion, flujo):
+    seccion = intervencion.get(flujo)
+    if seccion is not None and not isinstance(seccion, dict):
+        raise ErrorIntervencion(f"La sección del Flujo {flujo} debe ser un objeto")
+    return seccion
+
+
+# Forma de cada campo de las secciones: (verificación, descripción para el mensaje de error).
+# Un campo ausente toma su valor por omisión; uno presente con otra forma rechaza la intervención
+# (p. ej. un texto donde va una lista se recorrería letra por letra).
+def _es_texto_o_nulo(valor):
+    return valor is None or isinstance(valor, str)
+
+
+def _es_lista_de_textos(valor):
+    return isinstance(valor, list) and all(isinstance(x, str) for x in valor)
+
+
+def _es_cantidad(valor):
+    # Como en el formulario: un número, un texto con un número o nada (sin cantidad)
+    return valor is None or (isinstance(valor, (int, float, str)) and not isinstance(valor, bool))
+
+
+def _objeto_de(verificar):
+    return lambda valor: isinstance(valor, dict) and all(verificar(x) for x in valor.values())
+
+
+# Columnas por las que el Flujo D elige los diámetros a profundizar (como flujo_d_seleccion)
+COLUMNAS_FLUJO_D = ["DIÁMETRO", "DIÁMETRO CSG"]
+
+_CANTIDADES = (_objeto_de(_es_cantidad), "un objeto {valor: cantidad}")
+_SELECCION_E = {"tipos": _es_lista_de_textos, "acero": _es_texto_o_nulo, "acero_cup": _es_texto_o_nulo, "tipo_cup": _es_texto_o_nulo}
+
+CAMPOS = {
+    "A": {
+        "diametros": (_es_lista_de_textos, "una lista de textos"),
+        "filtros": (_objeto_de(_objeto_de(_es_texto_o_nulo)), 'un objeto {diámetro: {"tipo", "acero", "acero_cup", "tipo_cup"}}'),
+    },
+    "B": {"cantidades": _CANTIDADES},
+    "C": {
+        "tipos": (_objeto_de(_es_lista_de_textos), "un objeto {diámetro: [tipos]}"),
+        "diacsg": (_es_texto_o_nulo, "un texto"),
+        "cantidades": (_objeto_de(_objeto_de(_es_cantidad)), "un objeto {diámetro: {tipo: cantidad}}"),
+    },
+    "D": {
+        "columna": (lambda valor: valor in COLUMNAS_FLUJO_D, " o ".join(f'"{col}"' for col in COLUMNAS_FLUJO_D)),
+        "cantidades": _CANTIDADES,
+    },
+    "E": {
+        "diametros": (
+            _objeto_de(lambda f: isinstance(f, dict) and all(verificar(f[k]) for k, verificar in _SELECCION_E.items() if k in f)),
+            'un objeto {diámetro: {"tipos": [...], "acero", "acero_cup", "tipo_cup"}}',
+        ),
+        "cantidades": _CANTIDADES,
+    },
+    "F": {"diametros": (_es_lista_de_textos, "una lista de textos"), "cantidades": _CANTIDADES},
+    "H": {"cantidades": _CANTIDADES},
+}
+
+
+def _validar_campos(intervencion, flujo, seccion):
+    for campo, (verificar, descripcion) in CAMPOS[flujo].items():
+        if campo in seccion and not verificar(seccion[campo]):
+            pozo = intervencion.get("pozo")
+            origen = f"Pozo {pozo}, Flujo {flujo}" if pozo not in (None, "") else f"Flujo {flujo}"
+            raise ErrorIntervencion(f"{origen}: el campo '{campo}' debe ser {descripcion}")
+
+
+def validar_intervencion(intervencion):
+    if not isinstance(intervencion, dict):
+        raise ErrorIntervencion("Cada intervención debe ser un objeto")
+    presentes = [f for f in FLUJOS if _seccion(intervencion, f) is not None]
+    for flujo in presentes:
+        _validar_campos(intervencion, flujo, intervencion[flujo])
+    if "A" in presentes and any(f in presentes for f in "BCDEF"):
+        raise ErrorIntervencion("El Flujo A (ajuste de medida) no se combina con los flujos B a F")
+    if "E" in presentes and "F" in presentes:
+        raise ErrorIntervencion("Los flujos E y F son excluyentes")
+    return presentes
+
+
+def resolver_seccion(catalogos, flujo, seccion):
+    if flujo == "A":
+        return resultado_flujo_a(catalogos, list(seccion.get("diametros", [])), seccion.get("filtros", {}))
+    if flujo == "B":
+        cantidades = {d: _cantidad(q) for d, q in seccion.get("cantidades", {}).items()}
+        return resultado_flujo_b(catalogos, cantidades)
+    if flujo == "C":
+        tipos = {d: list(t) or ["TODOS"] for d, t in seccion.get("tipos", {}).items()}
+        por_diametro = seccion.get("cantidades", {})
+        cantidades = {
+            (d, t): _cantidad(por_diametro.get(d, {}).get(t))
+            for d, lista in tipos.items()
+            for t in lista
+        }
+        return resultado_flujo_c(catalogos, tipos, seccion.get("diacsg") or "TODOS", cantidades)
+    if flujo == "D":
+        columna = seccion.get("columna", "DIÁMETRO")
+        if columna not in motor_filtros(catalogos, "profundiza.xlsx").columnas:
+            raise ErrorIntervencion(f"Flujo D: el catálogo de profundización no tiene la columna '{columna}' (campo 'columna')")
+        cantidades = {v: _cantidad(q) for v, q in seccion.get("cantidades", {}).items()}
+        return resultado_flujo_d(catalogos, columna, cantidades)
+    if flujo == "E":
+        elegidos = seccion.get("diametros", {})
+        filtros = {
+            d: filtros_flujo_e(f.get("tipos", []), f.get("acero"), f.get("acero_cup"), f.get("tipo_cup"))
+            for d, f in elegidos.items()
+        }
+        por_diametro = seccion.get("cantidades", {})
+        cantidades = {d: _cantidad(por_diametro.get(d)) for d in elegidos}
+        return resultado_flujo_e(catalogos, list(elegidos), filtros, cantidades)
+    if flujo == "F":
+        # Igual que en el asistente: se agrega "TODOS" a los diámetros elegidos
+        diametros = list(seccion.get("diametros", [])) + ["TODOS"]
+        por_diametro = seccion.get("cantidades", {})
+        cantidades = {d: _cantidad(por_diametro.get(d)) for d in diametros if d.upper() != "TODOS"}
+        return resultado_flujo_f(catalogos, diametros, cantidades)
+    if flujo == "H":
+        cantidades = {m: _cantidad(q) for m, q in seccion.get("cantidades", {}).items()}
+        return resultado_flujo_h(catalogos, cantidades)
+    raise ErrorIntervencion(f"Flujo desconocido: {flujo}")
+
+
+def consolidar(resultados):
+    # Una sola tabla con la columna "Flujo", como la hoja de export_excel
+    if not resultados:
+        return pd.DataFrame(columns=["Cód.SAP", "MATERIAL", "Descripción", "4.CANTIDAD", "CONDICIÓN", "Flujo"])
+    return pd.concat([df.assign(Flujo=flow) for flow, df in resultados], ignore_index=True)
+
+
+# Lista de materiales: una línea por Cód.SAP / MATERIAL / CONDICIÓN con la cantidad sumada
+# de todos los flujos y los flujos que la aportan (en orden de aparición)
+CLAVES_LISTA = ["Cód.SAP", "MATERIAL", "CONDICIÓN"]
+COLUMNAS_LISTA = ["Cód.SAP", "MATERIAL", "Descripción", "4.CANTIDAD", "CONDICIÓN", "Flujos"]
+
+
+def lista_materiales(resultados):
+    tabla = consolidar(resultados).reindex(columns=COLUMNAS_LISTA[:-1] + ["Flujo"])
+    if tabla.empty:
+        return pd.DataFrame(columns=COLUMNAS_LISTA)
+    tabla["4.CANTIDAD"] = pd.to_numeric(tabla["4.CANTIDAD"], errors="coerce")
+    # dropna=False: los materiales de FLUJO H no tienen CONDICIÓN
+    grupos = tabla.groupby(CLAVES_LISTA, dropna=False, sort=False)
+    lista = grupos.agg(**{"Descripción": ("Descripción", "first")})
+    lista["4.CANTIDAD"] = grupos["4.CANTIDAD"].sum(min_count=1)
+    # Mismo orden de grupos que arriba: drop_duplicates conserva la primera aparición
+    aportes = tabla.drop_duplicates(CLAVES_LISTA + ["Flujo"])
+    lista["Flujos"] = aportes.groupby(CLAVES_LISTA, dropna=False, sort=False)["Flujo"].agg(", ".join).values
+    return lista.reset_index()[COLUMNAS_LISTA]
+
+
+def resolver_lote(catalogos, intervenciones, memo=None):
+    # Resuelve muchas intervenciones a la vez. Cada sección distinta (mismo flujo y mismas
+    # elecciones) se calcula una sola vez y se reutiliza en todos los pozos que la repiten;
+    # "memo" permite compartir esos resultados entre llamadas (p. ej. en un proceso del lote).
+    # Devuelve una lista con (resultados, None) o (None, mensaje de error) por intervención.
+    memo = {} if memo is None else memo
+    salida = []
+    for intervencion in intervenciones:
+        try:
+            resultados = []
+            for flujo in validar_intervencion(intervencion):
+                seccion = intervencion[flujo]
+                clave = (flujo, json.dumps(seccion, sort_keys=True, ensure_ascii=False))
+                if clave not in memo:
+                    memo[clave] = resolver_seccion(catalogos, flujo, seccion)
+                if memo[clave] is not None:
+                    resultados.append((f"FLUJO {flujo}", memo[clave]))
+            salida.append((resultados, None))
+        except (ErrorIntervencion, KeyError, TypeError, AttributeError, ValueError) as e:
+            salida.append((None, str(e)))
+    return salida
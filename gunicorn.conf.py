@@ -0,0 +1,25 @@
+import gc
+import os
+
+
+# ===================================
+# Configuración de gunicorn
+# ===================================
+# gunicorn -c gunicorn.conf.py app:app
+#
+# Con preload_app el master importa app.py una sola vez: carga los catálogos y arma sus
+# índices (flujos.precalentar) antes de crear los workers. Los workers los heredan del fork
+# y comparten esas páginas de memoria mientras nadie las modifique (copy-on-write), así que
+# sumar workers no repite el arranque ni multiplica la memoria de los catálogos.
+# GUNICORN_PRELOAD=0 vuelve al modo sin preload (cada worker carga lo suyo).
+
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+timeout = 120
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+
+def when_ready(server):
+    # Se llama en el master antes de crear los workers. gc.freeze() pasa los objetos ya creados
+    # a una generación que el recolector no recorre: así el GC de cada worker no escribe en
+    # las páginas heredadas y no las copia.
+    gc.freeze()
@@ -0,0 +1,128 @@
+import os
+import re
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+import pandas as pd
+import flujos
+from catalogos import RegistroCatalogos, BASE_DIR
+
+
+# ===================================
+# Campañas de planificación sin servidor web
+# ===================================
+# python lote.py campaña.json --salida resultados/ --jobs 4
+#
+# La entrada es un JSON con la lista de intervenciones (mismo formato que POST
+# /api/intervenciones, ver flujos.py) o un CSV con una columna "pozo" y una columna
+# por flujo (A, B, C, D, E, F, H) cuyo contenido es el JSON de esa sección.
+#
+# Los catálogos y sus motores de filtros se cargan una vez en el proceso principal;
+# con fork los procesos hijos los heredan (copy-on-write) en lugar de volver a leerlos.
+
+# Estado de cada proceso: el registro heredado y las secciones ya resueltas
+_catalogos = None
+_memo = {}
+
+
+def _iniciar_proceso(base_dir):
+    global _catalogos
+    # Sin fork (p. ej. Windows) cada proceso carga sus propios catálogos
+    if _catalogos is None:
+        _catalogos = RegistroCatalogos(base_dir)
+
+
+def leer_intervenciones(ruta):
+    if ruta.lower().endswith(".csv"):
+        intervenciones = []
+        with open(ruta, newline="", encoding="utf-8-sig") as f:
+            for fila in csv.DictReader(f):
+                intervencion = {"pozo": fila.get("pozo", "")}
+                for flujo in flujos.FLUJOS:
+                    if (fila.get(flujo) or "").strip():
+                        intervencion[flujo] = json.loads(fila[flujo])
+                intervenciones.append(intervencion)
+        return intervenciones
+    with open(ruta, encoding="utf-8") as f:
+        datos = json.load(f)
+    return datos["intervenciones"] if isinstance(datos, dict) else datos
+
+
+def nombre_archivo(pozo):
+    return re.sub(r"[^\w.-]+", "_", str(pozo)).strip("_") or "pozo"
+
+
+def resolver_pozo(tarea):
+    # Se ejecuta en un proceso del pool: resuelve un pozo y escribe su libro
+    i, intervencion, salida = tarea
+    pozo = intervencion.get("pozo", i) if isinstance(intervencion, dict) else i
+    inicio = time.perf_counter()
+    (resultados, error), = flujos.resolver_lote(_catalogos, [intervencion], memo=_memo)
+    resumen = {"pozo": pozo, "estado": "OK" if error is None else "ERROR", "error": error or "",
+               "flujos": "", "filas": 0, "cantidad_total": 0.0, "archivo": ""}
+    tabla = None
+    if error is None:
+        tabla = flujos.consolidar(resultados)
+        archivo = f"{i + 1:04d}_{nombre_archivo(pozo)}.xlsx"
+        with pd.ExcelWriter(os.path.join(salida, archivo), engine="xlsxwriter") as writer:
+            tabla.to_excel(writer, sheet_name="Materiales Consolidados", index=False)
+        resumen.update({
+            "flujos": ", ".join(flujo for flujo, _ in resultados),
+            "filas": len(tabla),
+            "cantidad_total": float(pd.to_numeric(tabla["4.CANTIDAD"], errors="coerce").sum()),
+            "archivo": archivo,
+        })
+    resumen["segundos"] = round(time.perf_counter() - inicio, 4)
+    return i, resumen, tabla
+
+
+def correr_campaña(intervenciones, salida, jobs, base_dir=BASE_DIR, progreso=sys.stderr):
+    global _catalogos
+    os.makedirs(salida, exist_ok=True)
+    _catalogos = RegistroCatalogos(base_dir)
+    errores = _catalogos.precargar()
+    if errores:
+        raise RuntimeError("; ".join(f"{archivo}: {error}" for archivo, error in errores.items()))
+    flujos.precalentar(_catalogos)
+
+    metodos = multiprocessing.get_all_start_methods()
+    contexto = multiprocessing.get_context("fork" if "fork" in metodos else None)
+    tareas = [(i, intervencion, salida) for i, intervencion in enumerate(intervenciones)]
+    resumenes = [None] * len(tareas)
+    tablas = [None] * len(tareas)
+    inicio = time.perf_counter()
+    with contexto.Pool(jobs, initializer=_iniciar_proceso, initargs=(base_dir,)) as pool:
+        chunksize = max(1, len(tareas) // (jobs * 8))
+        for hechos, (i, resumen, tabla) in enumerate(pool.imap_unordered(resolver_pozo, tareas, chunksize), 1):
+            resumenes[i] = resumen
+            if tabla is not None:
+                tablas[i] = tabla.assign(Pozo=resumen["pozo"])
+            transcurrido = time.perf_counter() - inicio
+            print(f"[{hechos}/{len(tareas)}] {resumen['pozo']}: {resumen['estado']} "
+                  f"({resumen['filas']} filas) - {hechos / transcurrido:.1f} pozos/s", file=progreso)
+
+    # Resumen de la campaña: una fila por pozo y todos los materiales juntos
+    resumen_df = pd.DataFrame(resumenes)
+    materiales = [t for t in tablas if t is not None]
+    with pd.ExcelWriter(os.path.join(salida, "resumen_campaña.xlsx"), engine="xlsxwriter") as writer:
+        resumen_df.to_excel(writer, sheet_name="Resumen", index=False)
+        if materiales:
+            pd.concat(materiales, ignore_index=True).to_excel(writer, sheet_name="Materiales Campaña", index=False)
+    total = time.perf_counter() - inicio
+    print(f"{len(tareas)} pozos en {total:.2f} s ({len(tareas) / total if total else 0:.1f} pozos/s), "
+          f"{int((resumen_df['estado'] == 'ERROR').sum()) if len(resumen_df) else 0} con error", file=progreso)
+    return resumen_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resuelve una campaña de intervenciones sin servidor web")
+    parser.add_argument("entrada", help="Archivo JSON o CSV con las intervenciones")
+    parser.add_argument("--salida", default="campaña", help="Directorio donde se escriben los libros")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Cantidad de procesos")
+    parser.add_argument("--base-dir", default=BASE_DIR, help="Directorio de los Excel de materiales")
+    args = parser.parse_args()
+    resumen = correr_campaña(leer_intervenciones(args.entrada), args.salida, max(1, args.jobs), args.base_dir)
+    sys.exit(1 if len(resumen) and (resumen["estado"] == "ERROR").any() else 0)
@@ -0,0 +1,160 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+# ===================================
+# Métricas en formato Prometheus
+# ===================================
+# Contadores e histogramas en memoria del proceso, expuestos por GET /metrics. Registrar una
+# observación cuesta un perf_counter, un bisect y un lock, así que pueden quedar activas en
+# producción. Con varios workers de gunicorn cada uno lleva las suyas: /metrics muestra las
+# del worker que atendió el pedido (la etiqueta "pid" de pcp_proceso_info lo identifica).
+#
+# Etapas medidas (histograma pcp_etapa_segundos, por ruta y etapa):
+#   carga_catalogo  lectura del compilado o del Excel
+#   filtro          selección de filas de un catálogo
+#   cantidades      asignación de cantidades
+#   registro        guardado del resultado y de la lista de materiales en la corrida
+#   busqueda        búsqueda de materiales por texto
+#   render          plantilla Jinja
+#   exportar        generación del archivo exportado
+
+# Límites de los buckets, en segundos
+LIMITES_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Ruta de la petición en curso (endpoint de Flask); "-" fuera de una petición (p. ej. el vigilante)
+_ruta = contextvars.ContextVar("ruta_metricas", default="-")
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _etiquetas(nombres, valores, extra=""):
+    pares = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def sumar(self, *valores, cantidad=1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def lineas(self):
+        with self._lock:
+            valores = dict(self._valores)
+        for etiquetas, valor in sorted(valores.items()):
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {_numero(valor)}"
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.limites = tuple(limites)
+        self._lock = threading.Lock()
+        # etiquetas -> [cuentas por bucket (el último es +Inf), suma]
+        self._series = {}
+        # Si es una lista, además se guarda cada observación como (etiquetas, valor) (benchmark.py)
+        self.muestras = None
+
+    def observar(self, valor, *etiquetas):
+        i = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.limites) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+            if self.muestras is not None:
+                self.muestras.append((etiquetas, valor))
+
+    def lineas(self):
+        with self._lock:
+            series = {etiquetas: (list(cuentas), suma) for etiquetas, (cuentas, suma) in self._series.items()}
+        for etiquetas, (cuentas, suma) in sorted(series.items()):
+            acumulado = 0
+            for limite, cuenta in zip(self.limites + (float("inf"),), cuentas):
+                acumulado += cuenta
+                le = f'le="{_numero(limite)}"'
+                yield f"{self.nombre}_bucket{_etiquetas(self.etiquetas, etiquetas, le)} {acumulado}"
+            yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {_numero(suma)}"
+            yield f"{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {acumulado}"
+
+
+class Medidor:
+    # Valores que se leen al momento de exponer: funcion() -> [(valores de etiquetas, valor)].
+    # Sirve también para contadores que ya lleva otro objeto (tipo="counter").
+    def __init__(self, nombre, ayuda, etiquetas, funcion, tipo="gauge"):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.funcion = funcion
+        self.tipo = tipo
+
+    def lineas(self):
+        for etiquetas, valor in self.funcion():
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {_numero(valor)}"
+
+
+PETICIONES = Histograma("pcp_peticion_segundos", "Duración de las peticiones por ruta", ("ruta", "metodo", "estado"))
+ERRORES = Contador("pcp_peticion_errores_total", "Peticiones que terminaron con una excepción", ("ruta",))
+ETAPAS = Histograma("pcp_etapa_segundos", "Duración de cada etapa dentro de una petición", ("ruta", "etapa"))
+FILAS = Contador("pcp_filas_total", "Filas de materiales registradas por flujo", ("flujo",))
+RESULTADOS = Contador("pcp_resultados_total", "Resultados registrados por flujo", ("flujo",))
+
+_metricas = [PETICIONES, ERRORES, ETAPAS, FILAS, RESULTADOS]
+
+
+def registrar(metrica):
+    _metricas.append(metrica)
+    return metrica
+
+
+def fijar_ruta(ruta):
+    return _ruta.set(ruta or "-")
+
+
+def liberar_ruta(token):
+    _ruta.reset(token)
+
+
+@contextmanager
+def etapa(nombre):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        ETAPAS.observar(time.perf_counter() - inicio, _ruta.get(), nombre)
+
+
+def texto():
+    lineas = []
+    for metrica in _metricas:
+        lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+        lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+        lineas.extend(metrica.lineas())
+    return "\n".join(lineas) + "\n"